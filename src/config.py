@@ -8,8 +8,46 @@ CENTER = SCREEN_SIZE // 2    # Screen center in pixels
 G = 6.67430e-11             # Gravitational constant
 DELTA_T = 200000            # Time interval (adjusted for display)
 SCALE = 12e8                 # Scale to convert meters into pixels (adjusted to reduce values)
+SIMULATION_THREAD = True    # Step the simulation on a background thread, decoupled from the render frame rate
+STEPS_PER_SECOND = 60       # Simulation steps per wall-clock second at speed 1
+MAX_STEP_BACKLOG = 0.25     # Wall-clock seconds of steps that can be owed after a slow frame (the rest is dropped)
+MAX_FRAME_STEP_TIME = 0.012 # Seconds per frame spent stepping at max speed when not threaded
+TRAIL_LIMIT = 200           # Number of trail positions kept per body
+TRAIL_STRIDE = 1            # Frames between two trail positions
+TRAIL_OVERDRAW = 0.25       # Samples (fraction of the limit) appended to the trail layer before it is redrawn
+SOFTENING = 0.0             # Softening length (m) added to every pair distance, avoids singular close approaches
+USE_FLOAT32 = False         # Compute the pair interactions in single precision (faster, less accurate)
+FORCE_SOLVER = "direct"     # Gravity solver (direct | barnes_hut)
+BARNES_HUT_THETA = 0.5      # Opening angle of the Barnes-Hut solver (0 is exact, larger is faster)
+COMPUTE_BACKEND = "auto"    # Backend of the direct-sum kernels (auto | numba | numpy), auto uses Numba when installed
+NUMBA_MIN_BODIES = 256      # Bodies from which auto uses Numba, smaller systems do not pay back its import and compile time
+ADAPTIVE_RTOL = 1e-8        # Relative tolerance of the adaptive (DOPRI5) integrator
+ADAPTIVE_ATOL = (1e3, 1e-3) # Absolute tolerance of the adaptive integrator for (position (m), velocity (m/s))
+BLOCK_ETA = 0.01            # Accuracy parameter of the block time steps (Aarseth criterion), smaller is more accurate
+BLOCK_MAX_LEVEL = 16        # Deepest level of the block time steps, the smallest step is delta_t / 2^BLOCK_MAX_LEVEL
+ENSEMBLE_CHECK_INTERVAL = 10 # Steps between two energy/escape checks of the ensemble members
+COLLISIONS = False          # Merge the bodies that touch after every step (conserving mass and momentum)
+BODY_DENSITY = 5500.0       # Density (kg/m³) that gives the radius of the bodies without one
+DIAGNOSTICS_INTERVAL = 10   # Steps between two samples of the conserved quantities (energy, momenta)
+DIAGNOSTICS_CAPACITY = 4096 # Number of samples of the conserved quantities kept in memory
+PROFILE_WINDOW = 240        # Durations per phase used by the percentiles of the performance HUD (/perf)
+PROFILE_TRACE_LIMIT = 100000 # Timed events kept per thread for the Chrome trace export
+CHECKPOINT_VERSION = 3      # Version of the checkpoint file layout (3 added the test particles)
+CHECKPOINT_PATH = "checkpoint.npz" # Default checkpoint file of the interactive simulation
+CHECKPOINT_INTERVAL = 0     # Wall-clock seconds between automatic checkpoints of the interactive simulation (0 disables)
+TEMPLATE_CACHE_DIR = ".template_cache" # Directory (inside src/utils) of the compiled .npz templates
+TEMPLATE_CHUNK_ROWS = 65536 # Rows parsed at once when streaming a CSV/NPY body list
+CHART_DIR = "charts"        # Directory of the chart files (/generate_chart)
+CHART_POINTS = 2000         # Points kept per plotted series after the downsampling
+CHART_MAX_BODIES = 50       # Most massive bodies plotted by the trail charts
+CHART_WORKERS = 2           # Worker processes rendering the charts (a chart window keeps one busy)
 
 
 FUNCTIONS_MANAGER = namedtuple("ENVFunctions", ["refresh_simulation", "change_saved_trails_limit",
                                                 "load_template", "change_method", "clear_trails",
-                                                "toggle_trails", "generate_chart"])
\ No newline at end of file
+                                                "toggle_trails", "generate_chart", "get_integrator_stats",
+                                                "change_force_solver", "change_trails_stride",
+                                                "change_speed", "toggle_pause", "start_recording",
+                                                "stop_recording", "start_replay", "stop_replay",
+                                                "save_checkpoint", "load_checkpoint", "toggle_perf",
+                                                "export_perf", "toggle_collisions"])
\ No newline at end of file
@@ -0,0 +1,282 @@
+import time
+from typing import Iterable
+import numpy as np
+from numpy import ndarray
+
+from config import G
+from core.compiled import numba_tree_walk
+from core.gravity import pairwise_accelerations
+
+MORTON_BITS = 21 # Bits per axis of the Morton codes, so the codes fit in a uint64
+TARGET_BATCH_SIZE = 4096 # Number of bodies walked through the tree at once, bounds the frontier size
+
+def part_bits(values: ndarray) -> ndarray:
+    """Spread the lower 32 bits of every value, inserting a zero bit between them (used to build Morton codes)"""
+
+    values = values.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    values = (values | (values << np.uint64(16))) & np.uint64(0x0000FFFF0000FFFF)
+    values = (values | (values << np.uint64(8))) & np.uint64(0x00FF00FF00FF00FF)
+    values = (values | (values << np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    values = (values | (values << np.uint64(2))) & np.uint64(0x3333333333333333)
+    values = (values | (values << np.uint64(1))) & np.uint64(0x5555555555555555)
+    return values
+
+class QuadTree:
+    """Linear quadtree stored in flat arrays (one entry per node), built from the Morton order of the bodies.
+
+    Every node covers the contiguous range [start, end) of the bodies sorted by `order`, its children are the
+    contiguous nodes [first_child, first_child + child_count). Nodes with at most `leaf_size` bodies are leaves.
+    """
+
+    def __init__(self, positions: ndarray, masses: ndarray, leaf_size: int = 8, max_depth: int = MORTON_BITS):
+        """Build the tree
+
+        Args:
+            positions (ndarray): The (N, 2) positions of the bodies
+            masses (ndarray): The (N,) masses of the bodies
+            leaf_size (int, optional): Maximum number of bodies of a leaf. Defaults to 8.
+            max_depth (int, optional): Maximum depth of the tree (at most MORTON_BITS). Defaults to MORTON_BITS.
+        """
+
+        max_depth = min(max_depth, MORTON_BITS)
+        lower = positions.min(axis=0)
+        width = max(float((positions.max(axis=0) - lower).max()), np.finfo(np.float64).tiny)
+        cells = 1 << MORTON_BITS
+        grid = np.clip(((positions - lower) / width * cells).astype(np.int64), 0, cells - 1)
+        codes = part_bits(grid[:, 0]) | (part_bits(grid[:, 1]) << np.uint64(1))
+
+        self.order = np.argsort(codes, kind="stable")
+        codes = codes[self.order]
+        self.positions = positions[self.order]
+        self.masses = masses[self.order]
+        count = len(masses)
+
+        starts, ends, sizes, parents = [np.array([0])], [np.array([count])], [np.array([width])], [np.array([-1])]
+        level_offset, level_starts, level_ends = 0, starts[0], ends[0]
+        for level in range(1, max_depth + 1):
+            # Only the nodes of the previous level with more than leaf_size bodies are split
+            split = np.flatnonzero(level_ends - level_starts > leaf_size)
+            if len(split) == 0:
+                break
+            body_node = np.repeat(split, (level_ends - level_starts)[split])
+            body_index = self.ranges(level_starts[split], level_ends[split])
+            keys = codes[body_index] >> np.uint64(2 * (MORTON_BITS - level))
+            new_group = np.ones(len(body_index), dtype=bool)
+            new_group[1:] = (keys[1:] != keys[:-1]) | (body_node[1:] != body_node[:-1])
+            group_first = np.flatnonzero(new_group)
+            level_starts = body_index[group_first]
+            level_ends = np.append(body_index[group_first[1:] - 1] + 1, body_index[-1] + 1)
+            starts.append(level_starts)
+            ends.append(level_ends)
+            sizes.append(np.full(len(level_starts), width / (1 << level)))
+            parents.append(level_offset + body_node[group_first])
+            level_offset += len(starts[-2])
+
+        self.depth = len(starts) - 1
+        self.start = np.concatenate(starts)
+        self.end = np.concatenate(ends)
+        self.size = np.concatenate(sizes)
+        parent = np.concatenate(parents)
+        node_count = len(self.start)
+
+        # Children are stored contiguously right after the previous level, so the first one and the count are enough
+        self.child_count = np.bincount(parent[1:], minlength=node_count)
+        self.first_child = np.full(node_count, -1, dtype=np.int64)
+        children = np.arange(1, node_count)
+        first = np.ones(len(children), dtype=bool)
+        first[1:] = parent[2:] != parent[1:-1]
+        self.first_child[parent[1:][first]] = children[first]
+
+        # Mass and centre of mass of every node from prefix sums over the sorted bodies
+        mass_sum = np.concatenate(([0.0], np.cumsum(self.masses)))
+        moment_sum = np.vstack((np.zeros((1, 2)), np.cumsum(self.masses[:, np.newaxis] * self.positions, axis=0)))
+        self.mass = mass_sum[self.end] - mass_sum[self.start]
+        moment = moment_sum[self.end] - moment_sum[self.start]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.center_of_mass = np.where(self.mass[:, np.newaxis] > 0, moment / self.mass[:, np.newaxis],
+                                           (self.positions[self.start] + self.positions[self.end - 1]) / 2)
+
+    @staticmethod
+    def ranges(starts: ndarray, ends: ndarray) -> ndarray:
+        """Concatenate the integer ranges [starts[i], ends[i]) without a Python loop"""
+
+        lengths = ends - starts
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return np.arange(lengths.sum()) + offsets
+
+    def accelerations(self, theta: float = 0.5, softening: float = 0.0, backend: str = "numpy") -> ndarray:
+        """Compute the acceleration of every body walking the tree with the opening angle theta
+
+        Args:
+            theta (float, optional): Opening angle, a node is used as a point mass when size / distance < theta. Defaults to 0.5.
+            softening (float, optional): Softening length of every interaction. Defaults to 0.0.
+            backend (str, optional): The backend of the walk (numba | numpy), see core.compiled.select_backend. Defaults to "numpy".
+
+        Returns:
+            ndarray: The (N, 2) accelerations in the original body order
+        """
+
+        return self.evaluate(theta, softening, False, backend)
+
+    def potential_energy(self, theta: float = 0.5, softening: float = 0.0, backend: str = "numpy") -> float:
+        """Approximate the potential energy of the system with the same walk as the accelerations
+
+        Args:
+            theta (float, optional): Opening angle. Defaults to 0.5.
+            softening (float, optional): Softening length of every interaction. Defaults to 0.0.
+            backend (str, optional): The backend of the walk (numba | numpy). Defaults to "numpy".
+
+        Returns:
+            float: The potential energy (J)
+        """
+
+        potentials = self.evaluate(theta, softening, True, backend)[:, 2]
+        return 0.5 * float(np.dot(self.masses, potentials[self.order])) # Every pair was counted twice
+
+    def evaluate(self, theta: float, softening: float, potential: bool, backend: str = "numpy") -> ndarray:
+        """Walk the tree for every body (compiled, or in batches with NumPy), returns (N, 2) accelerations or (N, 3) with
+        the potential per unit mass"""
+
+        count = len(self.masses)
+        if backend == "numba":
+            sorted_result = numba_tree_walk(self, theta, softening, potential)
+        else:
+            sorted_result = np.zeros((count, 3 if potential else 2))
+            for batch_start in range(0, count, TARGET_BATCH_SIZE):
+                targets = np.arange(batch_start, min(batch_start + TARGET_BATCH_SIZE, count))
+                sorted_result[targets] = self.walk(targets, theta, softening, potential)
+
+        result = np.empty_like(sorted_result)
+        result[self.order] = sorted_result
+        return result
+
+    def walk(self, targets: ndarray, theta: float, softening: float, potential: bool = False) -> ndarray:
+        """Walk the tree for a batch of (sorted) bodies, expanding all the (body, node) pairs one level at a time"""
+
+        result = np.zeros((len(targets), 3 if potential else 2))
+        target = np.arange(len(targets)) # Index inside the batch
+        node = np.zeros(len(targets), dtype=np.int64)
+        softening_sq = softening ** 2
+        theta_sq = theta ** 2
+        while len(target):
+            body = targets[target]
+            distance_vector = self.center_of_mass[node] - self.positions[body]
+            distance_sq = np.einsum("ij,ij->i", distance_vector, distance_vector)
+            inside = (self.start[node] <= body) & (body < self.end[node])
+            accept = ~inside & (self.size[node] ** 2 < theta_sq * distance_sq)
+            leaf = self.first_child[node] < 0
+
+            # Far nodes (or leaves that do not hold the body) act as a single point mass
+            point = accept | (leaf & ~inside & (self.end[node] - self.start[node] == 1))
+            self.accumulate(result, target[point], distance_vector[point], distance_sq[point] + softening_sq,
+                            self.mass[node[point]])
+
+            # Close leaves are summed directly body by body, skipping the body itself
+            direct = leaf & ~point
+            if direct.any():
+                direct_node = node[direct]
+                lengths = self.end[direct_node] - self.start[direct_node]
+                pair_target = np.repeat(target[direct], lengths)
+                source = self.ranges(self.start[direct_node], self.end[direct_node])
+                other = source != targets[pair_target]
+                pair_target, source = pair_target[other], source[other]
+                pair_vector = self.positions[source] - self.positions[targets[pair_target]]
+                pair_sq = np.einsum("ij,ij->i", pair_vector, pair_vector) + softening_sq
+                self.accumulate(result, pair_target, pair_vector, pair_sq, self.masses[source])
+
+            # Every other node is opened, the next frontier holds its children
+            opened = ~point & ~leaf
+            opened_node = node[opened]
+            target = np.repeat(target[opened], self.child_count[opened_node])
+            node = self.ranges(self.first_child[opened_node], self.first_child[opened_node] + self.child_count[opened_node])
+
+        return result
+
+    @staticmethod
+    def accumulate(result: ndarray, target: ndarray, distance_vector: ndarray, distance_sq: ndarray, mass: ndarray):
+        valid = distance_sq > 0
+        weight = np.zeros(len(distance_sq))
+        weight[valid] = G * mass[valid] / (distance_sq[valid] * np.sqrt(distance_sq[valid]))
+        result[:, 0] += np.bincount(target, weight * distance_vector[:, 0], minlength=len(result))
+        result[:, 1] += np.bincount(target, weight * distance_vector[:, 1], minlength=len(result))
+        if result.shape[1] > 2: # Potential per unit mass, -G m / d
+            result[:, 2] -= np.bincount(target, weight * distance_sq, minlength=len(result))
+
+def barnes_hut_accelerations(positions: ndarray, masses: ndarray, theta: float = 0.5, softening: float = 0.0,
+                             leaf_size: int = 8, backend: str = "numpy") -> ndarray:
+    """Calculate the gravitational acceleration of every body in O(N log N) with a quadtree rebuilt on every call
+
+    The walk costs far more than the build. With NumPy it is batched over (body, node) pairs, with the numba backend
+    every body walks the tree in a compiled loop (about 8x faster, 0.75 s instead of 6 s for 1e5 bodies on one core).
+    Either way it only beats the direct sum of the same backend from about 1000 bodies (theta 0.5), below that the
+    direct solver is faster.
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        theta (float, optional): Opening angle (0 is the exact direct sum, larger is faster and less accurate). Defaults to 0.5.
+        softening (float, optional): Softening length of every interaction. Defaults to 0.0.
+        leaf_size (int, optional): Maximum number of bodies of a leaf. Defaults to 8.
+        backend (str, optional): The backend of the walk (numba | numpy), see core.compiled.select_backend. Defaults to "numpy".
+
+    Returns:
+        ndarray: The (N, 2) accelerations of the bodies
+    """
+
+    if len(masses) < 2:
+        return np.zeros((len(masses), 2))
+    return QuadTree(positions, masses, leaf_size).accelerations(theta, softening, backend)
+
+def barnes_hut_potential_energy(positions: ndarray, masses: ndarray, theta: float = 0.5, softening: float = 0.0,
+                                leaf_size: int = 8, backend: str = "numpy") -> float:
+    """Approximate the potential energy of the system in O(N log N), see barnes_hut_accelerations
+
+    Returns:
+        float: The potential energy (J)
+    """
+
+    if len(masses) < 2:
+        return 0.0
+    return QuadTree(positions, masses, leaf_size).potential_energy(theta, softening, backend)
+
+def theta_accuracy_report(positions: ndarray, masses: ndarray, thetas: Iterable[float] = (0.2, 0.35, 0.5, 0.7, 1.0),
+                          softening: float = 0.0, backend: str = "numpy") -> list[dict]:
+    """Compare the Barnes-Hut accelerations against the direct sum for several opening angles
+
+    The errors are normalised by the RMS acceleration of the system. The error relative to the acceleration of each
+    body (max_relative_error) is also reported, but it blows up for the bodies whose pulls nearly cancel (close to
+    the centre of a cluster or between two masses): a tiny absolute error over a tiny net acceleration.
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        thetas (Iterable[float], optional): The opening angles to evaluate. Defaults to (0.2, 0.35, 0.5, 0.7, 1.0).
+        softening (float, optional): Softening length of every interaction. Defaults to 0.0.
+        backend (str, optional): The backend of the tree walk (numba | numpy). Defaults to "numpy".
+
+    Returns:
+        list[dict]: One entry per theta with the RMS normalised errors (median, 99th percentile, max), the largest
+        per body relative error and the timings
+    """
+
+    start = time.perf_counter()
+    reference = pairwise_accelerations(positions, masses, softening)
+    direct_time = time.perf_counter() - start
+    reference_norm = np.linalg.norm(reference, axis=1)
+    rms_norm = max(float(np.sqrt(np.mean(reference_norm ** 2))), np.finfo(np.float64).tiny)
+    reference_norm = np.maximum(reference_norm, np.finfo(np.float64).tiny)
+
+    report = []
+    for theta in thetas:
+        start = time.perf_counter()
+        approximation = barnes_hut_accelerations(positions, masses, theta, softening, backend=backend)
+        elapsed = time.perf_counter() - start
+        difference = np.linalg.norm(approximation - reference, axis=1)
+        error = difference / rms_norm
+        report.append({
+            "theta": theta, "bodies": len(masses),
+            "median_error": float(np.median(error)), "p99_error": float(np.percentile(error, 99)),
+            "max_error": float(error.max()), "max_relative_error": float((difference / reference_norm).max()),
+            "time_s": elapsed, "direct_time_s": direct_time,
+        })
+    return report
@@ -0,0 +1,237 @@
+from typing import Iterator, Optional, Tuple, Union
+from numpy import double, ndarray
+import numpy as np
+
+from config import BODY_DENSITY, TRAIL_LIMIT, TRAIL_STRIDE
+from core.celestial_body import CelestialBody, generate_unique_color
+from core.trails import TrailBuffer
+
+def radius_from_mass(masses: Union[double, ndarray], density: double = BODY_DENSITY) -> Union[double, ndarray]:
+    """The radius (m) of a uniform sphere of the given mass (kg) and density (kg/m³)"""
+
+    return np.cbrt(3 * np.asarray(masses, dtype=np.float64) / (4 * np.pi * density))
+
+class BodySystem:
+    """Structure-of-arrays storage of all the bodies of a simulation.
+
+    The state lives in contiguous (capacity, 2) position, velocity and acceleration arrays and (capacity,)
+    mass and radius arrays, only the first `count` rows are in use. The public properties return views over the rows in
+    use, so they must not be kept across `add`/`remove` calls (the storage can be reallocated).
+    The trails are kept in a TrailBuffer with one row per body.
+    The massive bodies fill the rows [0, massive) and the test particles (massless, they only feel the gravity of the
+    massive bodies) the rows after them, so the solvers take the particles as one slice.
+    """
+
+    def __init__(self, capacity: int = 16, trail_limit: int = TRAIL_LIMIT, trail_stride: int = TRAIL_STRIDE):
+        """Initialize an empty body system
+
+        Args:
+            capacity (int, optional): The initial number of rows allocated. Defaults to 16.
+            trail_limit (int, optional): The number of trail samples kept per body. Defaults to TRAIL_LIMIT.
+            trail_stride (int, optional): Frames between two trail samples. Defaults to TRAIL_STRIDE.
+        """
+
+        capacity = max(1, capacity)
+        self.count = 0
+        self.massive = 0 # Number of massive bodies, the rows after them are test particles
+        self._positions = np.zeros((capacity, 2), dtype=np.float64)
+        self._velocities = np.zeros((capacity, 2), dtype=np.float64)
+        self._accelerations = np.zeros((capacity, 2), dtype=np.float64)
+        self._masses = np.zeros(capacity, dtype=np.float64)
+        self._radii = np.zeros(capacity, dtype=np.float64)
+        self.names: list[str] = []
+        self.colors: list[Tuple[int, int, int]] = []
+        self.trails = TrailBuffer(capacity, trail_limit, trail_stride)
+        self.bodies: list[CelestialBody] = []
+
+    @property
+    def capacity(self) -> int:
+        return self._masses.shape[0]
+
+    @property
+    def positions(self) -> ndarray:
+        return self._positions[:self.count]
+
+    @property
+    def velocities(self) -> ndarray:
+        return self._velocities[:self.count]
+
+    @property
+    def accelerations(self) -> ndarray:
+        return self._accelerations[:self.count]
+
+    @property
+    def masses(self) -> ndarray:
+        return self._masses[:self.count]
+
+    @property
+    def radii(self) -> ndarray:
+        """The (N,) radii used by the collision detection"""
+        return self._radii[:self.count]
+
+    def reserve(self, capacity: int):
+        """Make sure the storage can hold at least `capacity` bodies, growing geometrically to amortize the copies
+
+        Args:
+            capacity (int): The number of bodies that must fit
+        """
+
+        if capacity <= self.capacity:
+            return
+        new_capacity = max(capacity, 2 * self.capacity)
+        for attribute in ("_positions", "_velocities", "_accelerations", "_masses", "_radii"):
+            old = getattr(self, attribute)
+            new = np.zeros((new_capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, attribute, new)
+
+    def add(self, name: str, mass: double, position: ndarray, velocity: ndarray,
+            color: Optional[Tuple[int, int, int]] = None, radius: Optional[double] = None,
+            test_particle: bool = False) -> CelestialBody:
+        """Append a body to the system
+
+        Args:
+            name (str): The Celestial Body name
+            mass (double): The mass of the celestial body
+            position (ndarray): The initial position of the body
+            velocity (ndarray): The initial velocity of the body
+            color (Optional[Tuple[int, int, int]], optional): The color, if not provided is a random color. Defaults to None.
+            radius (Optional[double], optional): The radius (m), if not provided it is computed from the mass. Defaults to None.
+            test_particle (bool, optional): Add a massless test particle (the mass is ignored). Defaults to False.
+
+        Returns:
+            CelestialBody: The view over the new body
+        """
+
+        self.reserve(self.count + 1)
+        index = self.count
+        self.count += 1
+        self.names.append(name)
+        self.colors.append(None)
+        self.bodies.append(None)
+        self.trails.add_rows(1)
+        if not test_particle:
+            if self.massive < index: # The first test particle moves to the new row at the end, the body takes its place
+                self._move_row(self.massive, index)
+                self.trails.clear(self.massive)
+            index = self.massive
+            self.massive += 1
+        mass = 0.0 if test_particle else mass
+
+        self._positions[index] = position
+        self._velocities[index] = velocity
+        self._accelerations[index] = 0
+        self._masses[index] = mass
+        self._radii[index] = radius if radius is not None else radius_from_mass(mass)
+        self.names[index] = name
+        self.colors[index] = color if color is not None else generate_unique_color()
+        body = CelestialBody(self, index)
+        self.bodies[index] = body
+        return body
+
+    def add_arrays(self, positions: ndarray, velocities: ndarray, masses: ndarray, names: Optional[list[str]] = None,
+                   colors: Optional[list[Tuple[int, int, int]]] = None, radii: Optional[ndarray] = None,
+                   test_particles: bool = False):
+        """Append many bodies at once from (M, 2) / (M,) arrays without building them one by one
+
+        Args:
+            positions (ndarray): The (M, 2) initial positions
+            velocities (ndarray): The (M, 2) initial velocities
+            masses (ndarray): The (M,) masses
+            names (Optional[list[str]], optional): The names, if not provided they are numbered. Defaults to None.
+            colors (Optional[list[Tuple[int, int, int]]], optional): The colors, if not provided are random colors. Defaults to None.
+            radii (Optional[ndarray], optional): The (M,) radii, if not provided they are computed from the masses. Defaults to None.
+            test_particles (bool, optional): Add massless test particles (the masses are ignored). Defaults to False.
+        """
+
+        amount = len(masses)
+        start = self.count
+        if test_particles:
+            masses = np.zeros(amount)
+        self.reserve(start + amount)
+        self._positions[start:start + amount] = positions
+        self._velocities[start:start + amount] = velocities
+        self._accelerations[start:start + amount] = 0
+        self._masses[start:start + amount] = masses
+        self._radii[start:start + amount] = radii if radii is not None else radius_from_mass(masses)
+        self.count += amount
+
+        self.names.extend(names if names is not None else [f"Body {start + i}" for i in range(amount)])
+        self.colors.extend(colors if colors is not None else [generate_unique_color() for _ in range(amount)])
+        self.trails.add_rows(amount)
+        self.bodies.extend(CelestialBody(self, index) for index in range(start, start + amount))
+        if not test_particles:
+            if self.massive < start: # The new bodies go before the test particles
+                self._permute(np.concatenate((np.arange(self.massive), np.arange(start, start + amount),
+                                              np.arange(self.massive, start))))
+            self.massive += amount
+
+    def _move_row(self, source: int, target: int):
+        """Copy the row source over the row target (the body view of the source moves with it)"""
+
+        if source == target:
+            return
+        for array in (self._positions, self._velocities, self._accelerations, self._masses, self._radii):
+            array[target] = array[source]
+        for values in (self.names, self.colors, self.bodies):
+            values[target] = values[source]
+        self.bodies[target].index = target
+        self.trails.move_row(source, target)
+
+    def _permute(self, order: ndarray):
+        """Reorder the rows in use, the row i takes the body of the row order[i]"""
+
+        for array in (self._positions, self._velocities, self._accelerations, self._masses, self._radii):
+            array[:self.count] = array[order]
+        for values in (self.names, self.colors, self.bodies):
+            values[:] = [values[index] for index in order]
+        for index, body in enumerate(self.bodies):
+            body.index = index
+        self.trails.permute(order)
+
+    def remove(self, body: Union[CelestialBody, int]):
+        """Remove a body in O(1) by moving the last row into its slot (the last massive body for a massive one, the
+        last row then fills the slot it left)
+
+        Args:
+            body (Union[CelestialBody, int]): The body (or its index) that will be removed
+        """
+
+        index = body.index if isinstance(body, CelestialBody) else body
+        if not 0 <= index < self.count:
+            raise IndexError(f"Body index {index} out of range")
+
+        last = self.count - 1
+        removed = self.bodies[index]
+        if index < self.massive:
+            self.massive -= 1
+            self._move_row(self.massive, index)
+            index = self.massive
+        self._move_row(last, index)
+        for values in (self.names, self.colors, self.bodies):
+            values.pop()
+        self.trails.remove_row(last)
+        self.count -= 1
+        removed.system = None
+
+    def record_trails(self):
+        """Store the current positions of every body in the trails"""
+
+        self.trails.record(self.positions)
+
+    def clear_trails(self):
+        self.trails.clear()
+
+    @property
+    def test_particles(self) -> int:
+        """The number of test particles (the rows after the massive bodies)"""
+        return self.count - self.massive
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[CelestialBody]:
+        return iter(self.bodies)
+
+    def __getitem__(self, index: int) -> CelestialBody:
+        return self.bodies[index]
@@ -1,64 +1,104 @@
-from typing import Optional, Tuple
+from typing import Tuple
 from numpy import double, ndarray
-import numpy as np
 import random
 
 # Keep track of used colors to avoid duplicates
 used_colors = set()
 
+def generate_unique_color() -> Tuple[int, int, int]:
+    """Generate a unique RGB color that hasn't been used yet
+
+    Returns:
+        color (Tuple[int, int, int]): The RGB color as a tuple (0...255, 0...255, 0...255)
+    """
+
+    while True:
+        # Generate a random color
+        new_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+        if new_color not in used_colors:
+            # Add the color to the used set and return it
+            used_colors.add(new_color)
+            return new_color
+
 class CelestialBody:
-    """Class that contains all the information and details of celestial bodies (Planets, Stars, Satellites, etc.)"""
-    
-    def __init__(self, name: str, mass: double, position: ndarray, velocity: ndarray, color: Optional[Tuple[int, int, int]] = None):
-        """Initialize the celestial body
+    """Lightweight view of one celestial body (Planets, Stars, Satellites, etc.) stored inside a BodySystem.
+    The state is not owned by the object, every attribute reads/writes the row `index` of the system arrays."""
+
+    __slots__ = ("system", "index")
+
+    def __init__(self, system, index: int):
+        """Initialize the celestial body view
 
         Args:
-            name (str): The Celestial Body name
-            mass (double): The mass of the celestial body
-            position (ndarray): The initial position of the body
-            velocity (ndarray): The initial velocity of the body
-            color (Optional[Tuple[int, int, int]], optional): The color, if not provided is a random color. Defaults to None.
+            system (BodySystem): The system that stores the body
+            index (int): The row of the body inside the system arrays
         """
 
-        self.name = name
-        self.mass = mass
-        self.position = position
-        self.velocity = velocity
-        self.acceleration = np.zeros(position.shape)
-        self.color = color if color is not None else self.generate_unique_color()
-        self.trails_pos = []
+        self.system = system
+        self.index = index
 
-    def update_trail(self, trail_limit: int):
-        """Update the trails list, insert a new position and remove if is beyond the limit
+    @property
+    def name(self) -> str:
+        return self.system.names[self.index]
 
-        Args:
-            trail_limit (int): The number of trails that the body can have
-        """
+    @property
+    def mass(self) -> double:
+        return self.system.masses[self.index]
 
-        self.trails_pos.append((self.position[0], self.position[1]))
-        if len(self.trails_pos) > trail_limit:
-            self.trails_pos.pop(0)
+    @mass.setter
+    def mass(self, value: double):
+        self.system.masses[self.index] = value
 
-    def generate_unique_color(self) -> Tuple[int, int, int]:
-        """Generate a unique RGB color that hasn't been used yet
+    @property
+    def radius(self) -> double:
+        return self.system.radii[self.index]
 
-        Returns:
-            color (Tuple[int, int, int]): The RGB color as a tuple (0...255, 0...255, 0...255)
-        """
+    @radius.setter
+    def radius(self, value: double):
+        self.system.radii[self.index] = value
+
+    @property
+    def position(self) -> ndarray:
+        return self.system.positions[self.index]
+
+    @position.setter
+    def position(self, value: ndarray):
+        self.system.positions[self.index] = value
+
+    @property
+    def velocity(self) -> ndarray:
+        return self.system.velocities[self.index]
+
+    @velocity.setter
+    def velocity(self, value: ndarray):
+        self.system.velocities[self.index] = value
+
+    @property
+    def acceleration(self) -> ndarray:
+        return self.system.accelerations[self.index]
+
+    @property
+    def color(self) -> Tuple[int, int, int]:
+        return self.system.colors[self.index]
+
+    @property
+    def test_particle(self) -> bool:
+        """A test particle feels the gravity of the massive bodies but exerts none (it has no mass)"""
+        return self.index >= self.system.massive
+
+    @property
+    def trails_pos(self) -> ndarray:
+        """The (count, 2) view of the trail from the oldest to the newest position"""
+        return self.system.trails.trail(self.index)
+
+    def generate_unique_color(self) -> Tuple[int, int, int]:
+        return generate_unique_color()
 
-        while True:
-            # Generate a random color
-            new_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-            if new_color not in used_colors:
-                # Add the color to the used set and return it
-                used_colors.add(new_color)
-                return new_color
-            
     def __str__(self):
         """String representation of the object
 
         Returns:
             str: The description of the object
         """
-        
-        return f"CelestialBody(name={self.name}, mass={self.mass}, position={self.position}, velocity={self.velocity}, color={self.color})"
\ No newline at end of file
+
+        return f"CelestialBody(name={self.name}, mass={self.mass}, position={self.position}, velocity={self.velocity}, color={self.color})"
@@ -0,0 +1,65 @@
+import os
+import time
+from typing import Optional
+
+from core.simulation import Simulation
+
+class AutoCheckpoint:
+    """Saves a checkpoint of a simulation periodically (every some steps and/or wall-clock seconds).
+    Only the last checkpoint is kept, it is replaced atomically by Simulation.save_checkpoint."""
+
+    def __init__(self, path: str, every_steps: int = 0, every_seconds: float = 0.0):
+        """Initialize the automatic checkpoint
+
+        Args:
+            path (str): The checkpoint file
+            every_steps (int, optional): Steps between two checkpoints (0 disables). Defaults to 0.
+            every_seconds (float, optional): Wall-clock seconds between two checkpoints (0 disables). Defaults to 0.0.
+        """
+
+        self.path = path
+        self.every_steps = every_steps
+        self.every_seconds = every_seconds
+        self.last_step: Optional[int] = None
+        self.last_time = time.perf_counter()
+        self.saved = 0
+
+    def update(self, simulation: Simulation) -> bool:
+        """Save the simulation if a checkpoint is due (called after every step)
+
+        Args:
+            simulation (Simulation): The simulation
+
+        Returns:
+            bool: True when a checkpoint was written
+        """
+
+        if self.last_step is None or simulation.steps < self.last_step:
+            self.last_step = simulation.steps # First call or the simulation was replaced
+        due = self.every_steps and simulation.steps - self.last_step >= self.every_steps
+        due = due or (self.every_seconds and time.perf_counter() - self.last_time >= self.every_seconds)
+        if due:
+            self.save(simulation)
+        return bool(due)
+
+    def save(self, simulation: Simulation):
+        simulation.save_checkpoint(self.path)
+        self.last_step = simulation.steps
+        self.last_time = time.perf_counter()
+        self.saved += 1
+
+    def resume(self, backend: str = None) -> Optional[Simulation]:
+        """Load the last checkpoint
+
+        Args:
+            backend (str, optional): Override the saved compute backend. Defaults to None.
+
+        Returns:
+            Optional[Simulation]: The restored simulation, None when there is no checkpoint yet
+        """
+
+        if not os.path.exists(self.path):
+            return None
+        simulation = Simulation.load_checkpoint(self.path, backend)
+        self.last_step = simulation.steps
+        return simulation
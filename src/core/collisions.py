@@ -0,0 +1,109 @@
+import numpy as np
+from numpy import ndarray
+
+from core.body_system import BodySystem
+
+def candidate_pairs(positions: ndarray, radii: ndarray) -> tuple[ndarray, ndarray]:
+    """Broad phase (sweep and prune on x): the pairs whose x intervals [x - r, x + r] overlap
+
+    The intervals are sorted by their start, the bodies that overlap interval i are the following ones whose start
+    is before its end, found with one searchsorted, so the cost is O(N log N + candidates) instead of all the pairs.
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        radii (ndarray): The (N,) radii of the bodies
+
+    Returns:
+        tuple[ndarray, ndarray]: The body indices (first, second) of every candidate pair
+    """
+
+    starts = positions[:, 0] - radii
+    order = np.argsort(starts, kind="stable")
+    sorted_starts = starts[order]
+    ends = positions[order, 0] + radii[order]
+    last = np.searchsorted(sorted_starts, ends, side="right") # Every interval after i and before last overlaps it
+    lengths = np.maximum(last - np.arange(len(order)) - 1, 0)
+    if lengths.sum() == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    first = np.repeat(np.arange(len(order)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return order[first], order[first + 1 + offsets]
+
+def find_collisions(positions: ndarray, radii: ndarray) -> tuple[ndarray, ndarray]:
+    """Return the pairs of bodies that touch (distance <= sum of the radii)
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        radii (ndarray): The (N,) radii of the bodies
+
+    Returns:
+        tuple[ndarray, ndarray]: The body indices (first, second) of every colliding pair
+    """
+
+    first, second = candidate_pairs(positions, radii)
+    distance = positions[first] - positions[second]
+    touching = np.einsum("ij,ij->i", distance, distance) <= (radii[first] + radii[second]) ** 2
+    return first[touching], second[touching]
+
+def collision_groups(count: int, first: ndarray, second: ndarray) -> ndarray:
+    """Label the connected groups of colliding bodies (a chain a-b, b-c merges the three)
+
+    Returns:
+        ndarray: The (count,) label of every body, the smallest index of its group
+    """
+
+    labels = np.arange(count)
+    while True:
+        smallest = np.minimum(labels[first], labels[second])
+        updated = labels.copy()
+        np.minimum.at(updated, first, smallest)
+        np.minimum.at(updated, second, smallest)
+        updated = updated[updated] # Jump to the label of the label, halves the remaining iterations
+        if np.array_equal(updated, labels):
+            return labels
+        labels = updated
+
+def merge_collisions(system: BodySystem) -> int:
+    """Merge every group of touching bodies into its most massive member, conserving mass, momentum and the center
+    of mass, the volume (radius³) is added. The other members are removed from the system arrays in place.
+
+    Args:
+        system (BodySystem): The system
+
+    Returns:
+        int: The number of bodies removed
+    """
+
+    if len(system) < 2:
+        return 0
+    first, second = find_collisions(system.positions, system.radii)
+    # A test particle is absorbed by the massive body it hits, two test particles go through each other
+    massive = (first < system.massive) | (second < system.massive)
+    first, second = first[massive], second[massive]
+    if len(first) == 0:
+        return 0
+
+    count = len(system)
+    labels = collision_groups(count, first, second)
+    masses = system.masses
+    group_mass = np.bincount(labels, masses, count)
+    group_position = np.stack([np.bincount(labels, masses * system.positions[:, axis], count) for axis in range(2)], axis=1)
+    group_momentum = np.stack([np.bincount(labels, masses * system.velocities[:, axis], count) for axis in range(2)], axis=1)
+    group_volume = np.bincount(labels, system.radii ** 3, count)
+    group_size = np.bincount(labels, minlength=count)
+
+    # The keeper of every group is its most massive body (it keeps its name and color)
+    merged = np.flatnonzero(group_size > 1)
+    members = np.flatnonzero(group_size[labels] > 1)
+    order = members[np.lexsort((-masses[members], labels[members]))]
+    keepers = order[np.searchsorted(labels[order], merged)]
+
+    system.positions[keepers] = group_position[merged] / group_mass[merged, np.newaxis]
+    system.velocities[keepers] = group_momentum[merged] / group_mass[merged, np.newaxis]
+    system.masses[keepers] = group_mass[merged]
+    system.radii[keepers] = np.cbrt(group_volume[merged])
+
+    removed = np.setdiff1d(members, keepers)
+    for index in removed[::-1]: # From the last row, so the rows moved by the swap-remove are never removed later
+        system.remove(int(index))
+    return len(removed)
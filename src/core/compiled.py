@@ -0,0 +1,103 @@
+# Optional compiled (Numba) kernels for the direct-sum gravity, the Barnes-Hut tree walk and the leapfrog step.
+# The outer loop over the bodies runs with prange, so every core works on a block of targets.
+# They match the NumPy reference (core.gravity.pairwise_accelerations) within COMPILED_RTOL, only the summation
+# order changes, and this is checked when the backend is selected. Without Numba the NumPy path is used.
+
+from functools import lru_cache
+from typing import Optional
+import warnings
+import numpy as np
+from numpy import ndarray
+
+from config import G, NUMBA_MIN_BODIES
+from core.gravity import pairwise_accelerations
+
+# Maximum relative error (per body, against the largest acceleration) allowed against the NumPy reference
+COMPILED_RTOL = 1e-10
+
+@lru_cache(maxsize=None)
+def compiled_kernels():
+    """Import the Numba kernels on the first use (None when Numba is not installed)"""
+
+    try:
+        from core import numba_kernels
+    except ImportError: # Numba is optional
+        return None
+    return numba_kernels
+
+def numba_accelerations(positions: ndarray, masses: ndarray, softening: float = 0.0) -> ndarray:
+    """Compiled equivalent of pairwise_accelerations (always float64)"""
+
+    accelerations = np.empty((positions.shape[0], 2))
+    compiled_kernels().compiled_pairwise_accelerations(np.ascontiguousarray(positions, dtype=np.float64),
+                                                       G * np.asarray(masses, dtype=np.float64), float(softening) ** 2, accelerations)
+    return accelerations
+
+def numba_leapfrog_step(positions: ndarray, velocities: ndarray, accelerations: ndarray, masses: ndarray,
+                        softening: float, delta_t: float):
+    """Compiled kick-drift-kick step, the arrays are updated in place"""
+
+    compiled_kernels().compiled_leapfrog_step(positions, velocities, accelerations, G * np.asarray(masses, dtype=np.float64),
+                                              float(softening) ** 2, float(delta_t))
+
+def numba_tree_walk(tree, theta: float, softening: float, potential: bool) -> ndarray:
+    """Compiled walk of a core.barnes_hut.QuadTree, returns the sorted (N, 2) accelerations or (N, 3) with the potential"""
+
+    result = np.empty((len(tree.masses), 3 if potential else 2))
+    compiled_kernels().compiled_tree_walk(np.ascontiguousarray(tree.positions, dtype=np.float64), G * tree.masses, tree.start, tree.end, tree.size, tree.first_child,
+                                          tree.child_count, tree.center_of_mass, G * tree.mass, float(theta) ** 2,
+                                          float(softening) ** 2, tree.depth, result)
+    return result
+
+def reference_error(bodies: int = 64, seed: int = 0) -> float:
+    """Compare the compiled kernel against the NumPy reference on a random system
+
+    Args:
+        bodies (int, optional): The number of random bodies. Defaults to 64.
+        seed (int, optional): The seed of the random system. Defaults to 0.
+
+    Returns:
+        float: The maximum relative error
+    """
+
+    rng = np.random.default_rng(seed)
+    positions = rng.normal(size=(bodies, 2)) * 1e11
+    masses = rng.uniform(1e20, 1e30, bodies)
+    reference = pairwise_accelerations(positions, masses)
+    return float(np.abs(numba_accelerations(positions, masses) - reference).max() / np.abs(reference).max())
+
+def select_backend(backend: str = "auto", bodies: Optional[int] = None) -> str:
+    """Resolve the compute backend that will be used
+
+    Importing Numba and loading (or compiling) the kernels costs about a second, so auto only picks Numba for systems
+    of at least NUMBA_MIN_BODIES bodies, below that the NumPy path finishes short runs before Numba would be ready.
+
+    Args:
+        backend (str, optional): The requested backend (auto | numba | numpy). Defaults to "auto".
+        bodies (Optional[int], optional): The number of bodies of the system, None skips the size check. Defaults to None.
+
+    Returns:
+        str: "numba" when it was requested (or auto for a large system) and works, otherwise "numpy"
+    """
+
+    if backend not in ("auto", "numba", "numpy"):
+        raise Exception("Sorry, this backend not exist")
+    if backend == "auto" and bodies is not None and bodies < NUMBA_MIN_BODIES:
+        return "numpy"
+    return _working_backend(backend)
+
+@lru_cache(maxsize=None)
+def _working_backend(backend: str) -> str:
+    """Import and check the compiled kernels once per process, falls back to "numpy" when they are not usable"""
+
+    if backend == "numpy":
+        return "numpy"
+    if compiled_kernels() is None:
+        if backend == "numba":
+            warnings.warn("Numba is not installed, using the NumPy backend")
+        return "numpy"
+    error = reference_error()
+    if error > COMPILED_RTOL:
+        warnings.warn(f"Compiled kernels differ from the reference ({error:.2e}), using the NumPy backend")
+        return "numpy"
+    return "numba"
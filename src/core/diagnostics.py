@@ -0,0 +1,129 @@
+from typing import Callable, Optional
+import numpy as np
+from numpy import ndarray
+
+from config import DIAGNOSTICS_CAPACITY, DIAGNOSTICS_INTERVAL
+
+# One sample of the conserved quantities
+DIAGNOSTICS_DTYPE = np.dtype([
+    ("step", "<i8"), ("time", "<f8"), ("kinetic", "<f8"), ("potential", "<f8"), ("energy", "<f8"),
+    ("energy_error", "<f8"), ("momentum", "<f8", (2,)), ("angular_momentum", "<f8"), ("center_of_mass", "<f8", (2,)),
+])
+
+def conserved_quantities(positions: ndarray, velocities: ndarray, masses: ndarray, potential: float) -> tuple:
+    """Calculate the kinetic energy, linear momentum, angular momentum (around the origin) and center of mass
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        velocities (ndarray): The (N, 2) velocities of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        potential (float): The potential energy (J), computed by the force solver of the simulation
+
+    Returns:
+        tuple: (kinetic (J), potential (J), momentum (2,) (kg m/s), angular momentum (kg m²/s), center of mass (2,) (m))
+    """
+
+    kinetic = 0.5 * np.einsum("i,ij,ij->", masses, velocities, velocities)
+    momentum = masses @ velocities
+    angular_momentum = masses @ (positions[:, 0] * velocities[:, 1] - positions[:, 1] * velocities[:, 0])
+    total_mass = masses.sum()
+    center_of_mass = masses @ positions / total_mass if total_mass > 0 else np.zeros(2)
+    return kinetic, potential, momentum, angular_momentum, center_of_mass
+
+class DiagnosticsMonitor:
+    """Samples the conserved quantities of a simulation every `interval` steps into a ring buffer.
+
+    The energy error is relative to the first sample (reset when the bodies change). Every sample can also be
+    appended to a CSV file, the history can be saved as .npy or .csv at any time.
+    """
+
+    def __init__(self, interval: int = DIAGNOSTICS_INTERVAL, capacity: int = DIAGNOSTICS_CAPACITY, sink: Optional[str] = None):
+        """Initialize the monitor
+
+        Args:
+            interval (int, optional): Steps between two samples. Defaults to DIAGNOSTICS_INTERVAL.
+            capacity (int, optional): Number of samples kept in memory. Defaults to DIAGNOSTICS_CAPACITY.
+            sink (Optional[str], optional): CSV file where every sample is appended. Defaults to None.
+        """
+
+        self.interval = max(1, interval)
+        self.samples = np.zeros(max(1, capacity), dtype=DIAGNOSTICS_DTYPE)
+        self.sink = open(sink, "w") if sink is not None else None
+        if self.sink is not None:
+            self.sink.write(",".join(csv_columns()) + "\n")
+        self.reset()
+
+    def reset(self):
+        """Forget the samples (the next one becomes the energy reference)"""
+
+        self.head = 0
+        self.count = 0
+        self.initial_energy: Optional[float] = None
+
+    def update(self, step: int, time: float, positions: ndarray, velocities: ndarray, masses: ndarray,
+               potential_function: Callable[[ndarray, ndarray], float]) -> bool:
+        """Take a sample when `step` is a multiple of the interval (called after every step)
+
+        Args:
+            step (int): The number of steps done
+            time (float): The simulated time (s)
+            positions (ndarray): The (N, 2) positions of the bodies
+            velocities (ndarray): The (N, 2) velocities of the bodies
+            masses (ndarray): The (N,) masses of the bodies
+            potential_function (Callable[[ndarray, ndarray], float]): Computes the potential energy from (positions, masses)
+
+        Returns:
+            bool: True when a sample was taken
+        """
+
+        if step % self.interval != 0 or len(masses) == 0:
+            return False
+        kinetic, potential, momentum, angular_momentum, center_of_mass = conserved_quantities(
+            positions, velocities, masses, potential_function(positions, masses))
+        energy = kinetic + potential
+        if self.initial_energy is None:
+            self.initial_energy = energy
+
+        sample = self.samples[self.head]
+        sample["step"], sample["time"] = step, time
+        sample["kinetic"], sample["potential"], sample["energy"] = kinetic, potential, energy
+        sample["energy_error"] = (energy - self.initial_energy) / abs(self.initial_energy) if self.initial_energy else 0.0
+        sample["momentum"], sample["angular_momentum"], sample["center_of_mass"] = momentum, angular_momentum, center_of_mass
+        self.head = (self.head + 1) % len(self.samples)
+        self.count = min(self.count + 1, len(self.samples))
+        if self.sink is not None:
+            self.sink.write(",".join(map(repr, csv_row(sample))) + "\n")
+        return True
+
+    def history(self) -> ndarray:
+        """Return a copy of the samples from the oldest to the newest"""
+
+        return np.roll(self.samples, -self.head)[len(self.samples) - self.count:]
+
+    def latest(self) -> Optional[np.void]:
+        return self.samples[self.head - 1] if self.count else None
+
+    def save(self, path: str):
+        """Write the history as .npy (structured array) or .csv (by the extension)"""
+
+        history = self.history()
+        if path.endswith(".npy"):
+            np.save(path, history)
+            return
+        with open(path, "w") as file:
+            file.write(",".join(csv_columns()) + "\n")
+            for sample in history:
+                file.write(",".join(map(repr, csv_row(sample))) + "\n")
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+def csv_columns() -> list[str]:
+    return ["step", "time", "kinetic", "potential", "energy", "energy_error", "momentum_x", "momentum_y",
+            "angular_momentum", "center_of_mass_x", "center_of_mass_y"]
+
+def csv_row(sample: np.void) -> list:
+    return [int(sample["step"]), *(float(sample[name]) for name in ("time", "kinetic", "potential", "energy", "energy_error")),
+            *map(float, sample["momentum"]), float(sample["angular_momentum"]), *map(float, sample["center_of_mass"])]
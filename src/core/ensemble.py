@@ -0,0 +1,232 @@
+from typing import Optional, Union
+import numpy as np
+from numpy import double, ndarray
+
+from config import ENSEMBLE_CHECK_INTERVAL, SOFTENING
+from core.body_system import BodySystem
+from core.gravity import batched_accelerations, batched_total_energy
+from core.integrator import YOSHIDA_DRIFTS, YOSHIDA_KICKS
+
+class Ensemble:
+    """B independent systems of N bodies advanced together, stored as (B, N, 2) positions and velocities.
+
+    Every step is one batched force evaluation (per stage) over the members still running, so small systems run at
+    array speed instead of paying the Python overhead of one Simulation each. Every member has its own delta_t and
+    stops when it reaches its end time (finished) or when its state is not finite, its energy error is above
+    max_energy_error or a body is farther than escape_radius from its center of mass (diverged).
+    """
+
+    def __init__(self, positions: ndarray, velocities: ndarray, masses: ndarray, delta_t: Union[double, ndarray] = 60,
+                 method: str = "Leapfrog", softening: double = SOFTENING, end_time: Optional[Union[double, ndarray]] = None,
+                 max_energy_error: Optional[double] = None, escape_radius: Optional[double] = None,
+                 check_interval: int = ENSEMBLE_CHECK_INTERVAL):
+        """Initialize the ensemble
+
+        Args:
+            positions (ndarray): The (B, N, 2) initial positions
+            velocities (ndarray): The (B, N, 2) initial velocities
+            masses (ndarray): The (B, N) masses, or (N,) shared by every member
+            delta_t (Union[double, ndarray], optional): The time step, one for all or (B,) per member. Defaults to 60.
+            method (str, optional): The integration method (Euler | RK4 | Leapfrog | Verlet | Yoshida4). Defaults to "Leapfrog".
+            softening (double, optional): Softening length (m). Defaults to SOFTENING.
+            end_time (Optional[Union[double, ndarray]], optional): Simulated time (s) where a member finishes, one for
+                all or (B,) per member. Defaults to None (never).
+            max_energy_error (Optional[double], optional): Relative energy error that marks a member as diverged. Defaults to None.
+            escape_radius (Optional[double], optional): Distance (m) from the center of mass that marks a member as
+                diverged. Defaults to None.
+            check_interval (int, optional): Steps between two energy/escape checks. Defaults to ENSEMBLE_CHECK_INTERVAL.
+        """
+
+        self.positions = np.array(positions, dtype=np.float64)
+        self.velocities = np.array(velocities, dtype=np.float64)
+        members = self.positions.shape[0]
+        self.masses = np.array(np.broadcast_to(masses, self.positions.shape[:2]), dtype=np.float64)
+        self.delta_t = np.array(np.broadcast_to(delta_t, (members,)), dtype=np.float64)
+        self.end_time = np.array(np.broadcast_to(np.inf if end_time is None else end_time, (members,)), dtype=np.float64)
+        self.softening = softening
+        self.max_energy_error = max_energy_error
+        self.escape_radius = escape_radius
+        self.check_interval = max(1, check_interval)
+        self.choose_method(method)
+
+        self.time = np.zeros(members)
+        self.steps = np.zeros(members, dtype=np.int64)
+        self.finished = np.zeros(members, dtype=bool)
+        self.diverged = np.zeros(members, dtype=bool)
+        self.stop_time = np.full(members, np.nan) # Simulated time when every member stopped
+        self.calls = 0
+        self.initial_energy = batched_total_energy(self.positions, self.velocities, self.masses, softening)
+        self.energy_error = np.zeros(members)
+        self.accelerations = batched_accelerations(self.positions, self.masses, softening) # Reused by the leapfrog
+
+    @classmethod
+    def from_system(cls, system: BodySystem, members: int, position_noise: double = 0.0, velocity_noise: double = 0.0,
+                    seed: int = 0, **kwargs) -> "Ensemble":
+        """Build an ensemble of perturbed copies of a system
+
+        Args:
+            system (BodySystem): The base system
+            members (int): The number of copies
+            position_noise (double, optional): Standard deviation (m) of the gaussian noise added to the positions. Defaults to 0.0.
+            velocity_noise (double, optional): Relative standard deviation of the noise of the velocities. Defaults to 0.0.
+            seed (int, optional): The seed of the noise. Defaults to 0.
+            **kwargs: The other arguments of Ensemble (delta_t, method, end_time, ...)
+
+        Returns:
+            Ensemble: The ensemble
+        """
+
+        rng = np.random.default_rng(seed)
+        shape = (members,) + system.positions.shape
+        positions = system.positions + rng.normal(0, position_noise, shape) if position_noise else np.broadcast_to(system.positions, shape)
+        velocities = np.broadcast_to(system.velocities, shape)
+        if velocity_noise:
+            velocities = velocities * (1 + rng.normal(0, velocity_noise, shape))
+        return cls(positions, velocities, system.masses, **kwargs)
+
+    def __len__(self) -> int:
+        return self.positions.shape[0]
+
+    @property
+    def active(self) -> ndarray:
+        """The (B,) mask of the members still running"""
+        return ~(self.finished | self.diverged)
+
+    def choose_method(self, method: str = "Leapfrog"):
+        """Choose the integration method (the same as Integrator, without the adaptive and block methods)
+
+        Args:
+            method (str, optional): The name of the method to be selected. Defaults to "Leapfrog".
+        """
+
+        if method == "RK4":
+            self.method_implementation = self.rk4_step
+        elif method == "Euler":
+            self.method_implementation = self.euler_step
+        elif method in ("Leapfrog", "Verlet"):
+            self.method_implementation = self.leapfrog_step
+        elif method == "Yoshida4":
+            self.method_implementation = self.yoshida4_step
+        else:
+            raise Exception("Sorry, this method not exist")
+        self.method = method
+
+    def forces(self, positions: ndarray, masses: ndarray) -> ndarray:
+        return batched_accelerations(positions, masses, self.softening)
+
+    def euler_step(self, positions: ndarray, velocities: ndarray, masses: ndarray, accelerations: ndarray, delta_t: ndarray):
+        accelerations = self.forces(positions, masses)
+        positions += velocities * delta_t
+        velocities += accelerations * delta_t
+
+    def rk4_step(self, positions: ndarray, velocities: ndarray, masses: ndarray, accelerations: ndarray, delta_t: ndarray):
+        k1_vel, k1_acc = velocities, self.forces(positions, masses)
+        k2_vel = velocities + 0.5 * delta_t * k1_acc
+        k2_acc = self.forces(positions + 0.5 * delta_t * k1_vel, masses)
+        k3_vel = velocities + 0.5 * delta_t * k2_acc
+        k3_acc = self.forces(positions + 0.5 * delta_t * k2_vel, masses)
+        k4_vel = velocities + delta_t * k3_acc
+        k4_acc = self.forces(positions + delta_t * k3_vel, masses)
+        positions += (delta_t / 6) * (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel)
+        velocities += (delta_t / 6) * (k1_acc + 2 * k2_acc + 2 * k3_acc + k4_acc)
+
+    def leapfrog_step(self, positions: ndarray, velocities: ndarray, masses: ndarray, accelerations: ndarray, delta_t: ndarray):
+        """Kick-drift-kick, the accelerations of the end of the step are written back to reuse them on the next one"""
+
+        velocities += 0.5 * delta_t * accelerations
+        positions += delta_t * velocities
+        accelerations[:] = self.forces(positions, masses)
+        velocities += 0.5 * delta_t * accelerations
+
+    def yoshida4_step(self, positions: ndarray, velocities: ndarray, masses: ndarray, accelerations: ndarray, delta_t: ndarray):
+        for drift, kick in zip(YOSHIDA_DRIFTS, YOSHIDA_KICKS):
+            positions += drift * delta_t * velocities
+            velocities += kick * delta_t * self.forces(positions, masses)
+        positions += YOSHIDA_DRIFTS[-1] * delta_t * velocities
+
+    def step(self) -> int:
+        """Advance every running member by its own delta_t
+
+        Returns:
+            int: The number of members that were advanced
+        """
+
+        running = np.flatnonzero(self.active)
+        if len(running) == 0:
+            return 0
+        if len(running) == len(self):
+            # Every member runs, the arrays are updated in place without gathering them
+            self.method_implementation(self.positions, self.velocities, self.masses, self.accelerations,
+                                       self.delta_t[:, np.newaxis, np.newaxis])
+        else:
+            positions, velocities, accelerations = self.positions[running], self.velocities[running], self.accelerations[running]
+            self.method_implementation(positions, velocities, self.masses[running], accelerations,
+                                       self.delta_t[running, np.newaxis, np.newaxis])
+            self.positions[running], self.velocities[running], self.accelerations[running] = positions, velocities, accelerations
+        self.time[running] += self.delta_t[running]
+        self.steps[running] += 1
+        self.calls += 1
+
+        self.stop(running, self.time[running] >= self.end_time[running] * (1 - 1e-12), self.finished)
+        self.stop(running, ~np.isfinite(self.positions[running]).all(axis=(1, 2)), self.diverged)
+        if self.calls % self.check_interval == 0:
+            self.check(np.flatnonzero(self.active))
+        return len(running)
+
+    def stop(self, members: ndarray, mask: ndarray, status: ndarray):
+        stopped = members[mask & ~(self.finished[members] | self.diverged[members])]
+        status[stopped] = True
+        self.stop_time[stopped] = self.time[stopped]
+
+    def check(self, members: ndarray):
+        """Update the energy error of the members and mark the ones that diverged"""
+
+        if len(members) == 0:
+            return
+        positions, velocities, masses = self.positions[members], self.velocities[members], self.masses[members]
+        energy = batched_total_energy(positions, velocities, masses, self.softening)
+        initial = self.initial_energy[members]
+        self.energy_error[members] = np.abs(energy - initial) / np.where(initial != 0, np.abs(initial), 1.0)
+        if self.max_energy_error is not None:
+            self.stop(members, self.energy_error[members] > self.max_energy_error, self.diverged)
+        if self.escape_radius is not None:
+            center = np.einsum("bi,bij->bj", masses, positions) / masses.sum(axis=1)[:, np.newaxis]
+            distance = np.linalg.norm(positions - center[:, np.newaxis, :], axis=2).max(axis=1)
+            self.stop(members, distance > self.escape_radius, self.diverged)
+
+    def run(self, steps: Optional[int] = None) -> int:
+        """Step until every member stopped or `steps` steps were done
+
+        Args:
+            steps (Optional[int], optional): Maximum number of steps, None runs until every member stopped
+                (it needs end_time or a divergence criterion). Defaults to None.
+
+        Returns:
+            int: The number of steps done
+        """
+
+        if steps is None and np.isinf(self.end_time).any() and self.max_energy_error is None and self.escape_radius is None:
+            raise Exception("Sorry, the ensemble needs steps, an end time or a divergence criterion to stop")
+        done = 0
+        while (steps is None or done < steps) and self.step():
+            done += 1
+        self.check(np.flatnonzero(self.active))
+        return done
+
+    def system(self, member: int, names: Optional[list[str]] = None, colors: Optional[list] = None) -> BodySystem:
+        """Copy one member to a BodySystem (e.g. to open it in the interactive simulation)"""
+
+        system = BodySystem(self.positions.shape[1])
+        system.add_arrays(self.positions[member], self.velocities[member], self.masses[member], names, colors)
+        return system
+
+    def summary(self) -> dict:
+        """Statistics of the ensemble: the fraction of diverged members and the energy error percentiles"""
+
+        errors = self.energy_error[~self.diverged]
+        return {
+            "members": len(self), "running": int(self.active.sum()), "finished": int(self.finished.sum()),
+            "diverged": int(self.diverged.sum()), "diverged_fraction": float(self.diverged.mean()),
+            "energy_error_percentiles": np.percentile(errors, (50, 95, 99)).tolist() if len(errors) else [],
+            "body_steps": int(self.steps.sum() * self.positions.shape[1]),
+        }
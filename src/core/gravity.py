@@ -0,0 +1,221 @@
+from typing import Optional
+import numpy as np
+from numpy import ndarray
+
+from config import G
+
+# Upper bound of pair interactions evaluated at once, keeps the (rows, N, 2) temporaries small
+PAIR_BLOCK_SIZE = 1 << 20
+
+def pairwise_accelerations(positions: ndarray, masses: ndarray, softening: float = 0.0,
+                           dtype: np.dtype = np.float64) -> ndarray:
+    """Calculate the gravitational acceleration of every body due to all the others in one broadcast
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        softening (float, optional): Plummer softening length, avoids the singularity on close approaches. Defaults to 0.0.
+        dtype (np.dtype, optional): Precision used for the pair interactions (float64 | float32). Defaults to np.float64.
+
+    Returns:
+        ndarray: The (N, 2) accelerations of the bodies (always float64)
+    """
+
+    n = positions.shape[0]
+    accelerations = np.zeros((n, 2), dtype=np.float64)
+    if n < 2:
+        return accelerations
+
+    pos = np.asarray(positions, dtype=dtype)
+    x, y = pos[:, 0], pos[:, 1]
+    gm = np.asarray(G * np.asarray(masses, dtype=np.float64), dtype=dtype)
+    softening_sq = np.asarray(softening, dtype=dtype) ** 2
+
+    # Process the targets in blocks of rows so the temporaries stay bounded for large N
+    rows = max(1, PAIR_BLOCK_SIZE // n)
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        dx = x[np.newaxis, :] - x[start:stop, np.newaxis] # x_j - x_i
+        dy = y[np.newaxis, :] - y[start:stop, np.newaxis] # y_j - y_i
+        distance_sq = dx * dx
+        distance_sq += dy * dy
+        distance_sq += softening_sq
+        # Skip the self-interaction and coincident bodies (distance == 0)
+        distance_sq[distance_sq == 0] = np.inf
+        inv_distance = 1 / np.sqrt(distance_sq)
+        # (G * m_j / d) / d / d keeps every intermediate inside the float32 range
+        weight = gm[np.newaxis, :] * inv_distance
+        weight *= inv_distance
+        weight *= inv_distance
+        accelerations[start:stop, 0] = np.einsum("ij,ij->i", weight, dx)
+        accelerations[start:stop, 1] = np.einsum("ij,ij->i", weight, dy)
+
+    return accelerations
+
+def field_accelerations(points: ndarray, positions: ndarray, masses: ndarray, softening: float = 0.0) -> ndarray:
+    """Calculate the gravitational acceleration felt at some points (test particles) due to the bodies, the points
+    attract nothing so the cost is points x bodies
+
+    Args:
+        points (ndarray): The (M, 2) positions where the acceleration is computed
+        positions (ndarray): The (N, 2) positions of the attracting bodies
+        masses (ndarray): The (N,) masses of the attracting bodies
+        softening (float, optional): Plummer softening length. Defaults to 0.0.
+
+    Returns:
+        ndarray: The (M, 2) accelerations
+    """
+
+    m, n = points.shape[0], positions.shape[0]
+    accelerations = np.zeros((m, 2), dtype=np.float64)
+    if n == 0:
+        return accelerations
+    gm = G * np.asarray(masses, dtype=np.float64)
+    rows = max(1, PAIR_BLOCK_SIZE // n)
+    for start in range(0, m, rows):
+        stop = min(start + rows, m)
+        dx = positions[np.newaxis, :, 0] - points[start:stop, 0, np.newaxis]
+        dy = positions[np.newaxis, :, 1] - points[start:stop, 1, np.newaxis]
+        distance_sq = dx * dx + dy * dy + softening ** 2
+        distance_sq[distance_sq == 0] = np.inf # A point on top of a body
+        weight = gm[np.newaxis, :] / (distance_sq * np.sqrt(distance_sq))
+        accelerations[start:stop, 0] = np.einsum("ij,ij->i", weight, dx)
+        accelerations[start:stop, 1] = np.einsum("ij,ij->i", weight, dy)
+    return accelerations
+
+def accelerations_and_jerks(positions: ndarray, velocities: ndarray, masses: ndarray, targets: ndarray,
+                            softening: float = 0.0, sources: Optional[int] = None) -> tuple[ndarray, ndarray]:
+    """Calculate the acceleration and its time derivative (jerk) of the target bodies due to all the others
+
+    Args:
+        positions (ndarray): The (N, 2) positions of all the bodies
+        velocities (ndarray): The (N, 2) velocities of all the bodies
+        masses (ndarray): The (N,) masses of all the bodies
+        targets (ndarray): The (M,) indices of the bodies whose acceleration and jerk are computed
+        softening (float, optional): Plummer softening length. Defaults to 0.0.
+        sources (Optional[int], optional): Only the first sources bodies attract (the massive ones), None is all. Defaults to None.
+
+    Returns:
+        tuple[ndarray, ndarray]: The (M, 2) accelerations and the (M, 2) jerks of the targets
+    """
+
+    n, m = positions.shape[0] if sources is None else sources, len(targets)
+    accelerations = np.zeros((m, 2))
+    jerks = np.zeros((m, 2))
+    gm = G * np.asarray(masses[:n], dtype=np.float64)
+    rows = max(1, PAIR_BLOCK_SIZE // max(n, 1))
+    for start in range(0, m, rows):
+        block = targets[start:start + rows]
+        dr = positions[np.newaxis, :n, :] - positions[block, np.newaxis, :] # r_j - r_i
+        dv = velocities[np.newaxis, :n, :] - velocities[block, np.newaxis, :] # v_j - v_i
+        distance_sq = np.einsum("ijk,ijk->ij", dr, dr) + softening ** 2
+        attracting = block < n
+        distance_sq[np.flatnonzero(attracting), block[attracting]] = np.inf # Self-interaction, even when softened
+        distance_sq[distance_sq == 0] = np.inf
+        inv_distance_sq = 1 / distance_sq
+        weight = gm[np.newaxis, :] * inv_distance_sq * np.sqrt(inv_distance_sq) # G m_j / d³
+        radial = 3 * np.einsum("ijk,ijk->ij", dr, dv) * inv_distance_sq # 3 (r · v) / d²
+        accelerations[start:start + rows] = np.einsum("ij,ijk->ik", weight, dr)
+        jerks[start:start + rows] = np.einsum("ij,ijk->ik", weight, dv) - np.einsum("ij,ijk->ik", weight * radial, dr)
+    return accelerations, jerks
+
+def potential_energy(positions: ndarray, masses: ndarray, softening: float = 0.0) -> float:
+    """Calculate the total gravitational potential energy of the system (sum over every pair)
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        softening (float, optional): Plummer softening length, the same used by the accelerations. Defaults to 0.0.
+
+    Returns:
+        float: The potential energy (J)
+    """
+
+    n = positions.shape[0]
+    x, y = positions[:, 0], positions[:, 1]
+    energy = 0.0
+    rows = max(1, PAIR_BLOCK_SIZE // max(n, 1))
+    for start in range(0, n, rows):
+        stop = min(start + rows, n)
+        dx = x[np.newaxis, :] - x[start:stop, np.newaxis]
+        dy = y[np.newaxis, :] - y[start:stop, np.newaxis]
+        distance_sq = dx * dx + dy * dy + softening ** 2
+        distance_sq[np.arange(stop - start), np.arange(start, stop)] = np.inf # Self-interaction, even when softened
+        distance_sq[distance_sq == 0] = np.inf
+        energy -= G * np.einsum("i,ij,j->", masses[start:stop], 1 / np.sqrt(distance_sq), masses)
+    return energy / 2 # Every pair was counted twice
+
+def total_energy(positions: ndarray, velocities: ndarray, masses: ndarray, softening: float = 0.0) -> float:
+    """Calculate the total (kinetic + potential) energy of the system
+
+    Args:
+        positions (ndarray): The (N, 2) positions of the bodies
+        velocities (ndarray): The (N, 2) velocities of the bodies
+        masses (ndarray): The (N,) masses of the bodies
+        softening (float, optional): Plummer softening length. Defaults to 0.0.
+
+    Returns:
+        float: The total energy (J)
+    """
+
+    kinetic = 0.5 * np.einsum("i,ij,ij->", masses, velocities, velocities)
+    return kinetic + potential_energy(positions, masses, softening)
+
+def batched_distances(positions: ndarray, softening: float) -> tuple[ndarray, ndarray, ndarray]:
+    """The (B, N, N) x_j - x_i, y_j - y_i and squared distances of B independent systems, the diagonal is infinite"""
+
+    dx = positions[:, np.newaxis, :, 0] - positions[:, :, np.newaxis, 0]
+    dy = positions[:, np.newaxis, :, 1] - positions[:, :, np.newaxis, 1]
+    distance_sq = dx * dx + dy * dy + softening ** 2
+    diagonal = np.arange(positions.shape[1])
+    distance_sq[:, diagonal, diagonal] = np.inf # Self-interaction, even when softened
+    distance_sq[distance_sq == 0] = np.inf
+    return dx, dy, distance_sq
+
+def batched_accelerations(positions: ndarray, masses: ndarray, softening: float = 0.0) -> ndarray:
+    """Calculate the gravitational accelerations of B independent systems of N bodies at once
+
+    Args:
+        positions (ndarray): The (B, N, 2) positions of the bodies of every system
+        masses (ndarray): The (B, N) masses of the bodies of every system
+        softening (float, optional): Plummer softening length. Defaults to 0.0.
+
+    Returns:
+        ndarray: The (B, N, 2) accelerations
+    """
+
+    members, n = positions.shape[:2]
+    accelerations = np.zeros(positions.shape, dtype=np.float64)
+    if n < 2:
+        return accelerations
+    # Process the systems in blocks so the (members, N, N) temporaries stay bounded
+    rows = max(1, PAIR_BLOCK_SIZE // (n * n))
+    for start in range(0, members, rows):
+        stop = min(start + rows, members)
+        dx, dy, distance_sq = batched_distances(positions[start:stop], softening)
+        weight = G * masses[start:stop, np.newaxis, :] / (distance_sq * np.sqrt(distance_sq))
+        accelerations[start:stop, :, 0] = np.einsum("bij,bij->bi", weight, dx)
+        accelerations[start:stop, :, 1] = np.einsum("bij,bij->bi", weight, dy)
+    return accelerations
+
+def batched_total_energy(positions: ndarray, velocities: ndarray, masses: ndarray, softening: float = 0.0) -> ndarray:
+    """Calculate the total (kinetic + potential) energy of B independent systems
+
+    Args:
+        positions (ndarray): The (B, N, 2) positions
+        velocities (ndarray): The (B, N, 2) velocities
+        masses (ndarray): The (B, N) masses
+        softening (float, optional): Plummer softening length. Defaults to 0.0.
+
+    Returns:
+        ndarray: The (B,) energies (J)
+    """
+
+    members, n = positions.shape[:2]
+    energies = 0.5 * np.einsum("bi,bij,bij->b", masses, velocities, velocities)
+    rows = max(1, PAIR_BLOCK_SIZE // max(n * n, 1))
+    for start in range(0, members, rows):
+        stop = min(start + rows, members)
+        _, _, distance_sq = batched_distances(positions[start:stop], softening)
+        energies[start:stop] -= G / 2 * np.einsum("bi,bij,bj->b", masses[start:stop], 1 / np.sqrt(distance_sq), masses[start:stop])
+    return energies
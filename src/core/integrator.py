@@ -1,20 +1,149 @@
+from typing import Tuple, Union
 import numpy as np
+from numpy import ndarray
 
-from core.celestial_body import CelestialBody
+from config import ADAPTIVE_ATOL, ADAPTIVE_RTOL, BLOCK_ETA, BLOCK_MAX_LEVEL
+
+# Yoshida 4th order coefficients (composition of three leapfrog steps)
+YOSHIDA_W1 = 1 / (2 - 2 ** (1 / 3))
+YOSHIDA_W0 = -2 ** (1 / 3) / (2 - 2 ** (1 / 3))
+YOSHIDA_DRIFTS = (YOSHIDA_W1 / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, (YOSHIDA_W0 + YOSHIDA_W1) / 2, YOSHIDA_W1 / 2)
+YOSHIDA_KICKS = (YOSHIDA_W1, YOSHIDA_W0, YOSHIDA_W1)
+
+# Dormand-Prince 5(4) tableau, the last stage is evaluated at the new state (FSAL)
+DOPRI_C = np.array([0, 1 / 5, 3 / 10, 4 / 5, 8 / 9, 1, 1])
+DOPRI_A = (
+    (),
+    (1 / 5,),
+    (3 / 40, 9 / 40),
+    (44 / 45, -56 / 15, 32 / 9),
+    (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+    (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656),
+    (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84),
+)
+DOPRI_B = np.array([35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84, 0])
+DOPRI_E = np.array([-71 / 57600, 0, 71 / 16695, -71 / 1920, 17253 / 339200, -22 / 525, 1 / 40]) # 5th - 4th order weights
+# Coefficients of the 4th order continuous extension (dense output) in powers of theta
+DOPRI_P = np.array([
+    [1, -8048581381 / 2820520608, 8663915743 / 2820520608, -12715105075 / 11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200 / 32700410799, -68118460800 / 10900136933, 87487479700 / 32700410799],
+    [0, -1754552775 / 470086768, 14199869525 / 1410260304, -10690763975 / 1880347072],
+    [0, 127303824393 / 49829197408, -318862633887 / 49829197408, 701980252875 / 199316789632],
+    [0, -282668133 / 205662961, 2019193451 / 616988883, -1453857185 / 822651844],
+    [0, 40617522 / 29380423, -110615467 / 29380423, 69997945 / 29380423],
+])
+ADAPTIVE_SAFETY = 0.9
+ADAPTIVE_MIN_FACTOR = 0.2
+ADAPTIVE_MAX_FACTOR = 10.0
+BLOCK_START_ETA = 0.01 # Accuracy parameter of the first block step (only the acceleration and jerk are known)
 
 class Integrator():
     """The Integrator class contains the methods for the integration algorithms that update the position and velocity of the bodies"""
 
-    def __init__(self, method: str = "RK4", derivative_function = None):
+    def __init__(self, method: str = "RK4", derivative_function = None, rtol: float = ADAPTIVE_RTOL,
+                 atol: Union[float, Tuple[float, float]] = ADAPTIVE_ATOL, jerk_function = None, eta: float = BLOCK_ETA,
+                 max_level: int = BLOCK_MAX_LEVEL):
         """Initialize the Integrator
 
         Args:
-            method (str, optional): The name of the method to be selected (RK4 | Euler). Defaults to "RK4".
-            derivative_function (Function, optional): The function that will be used in the integrator. Defaults to None.
+            method (str, optional): The name of the method to be selected (RK4 | Euler | Leapfrog | Verlet | Yoshida4 | DOPRI5 | Block). Defaults to "RK4".
+            derivative_function (Function, optional): The function f(t, positions, velocities) -> (velocities, accelerations)
+                that will be used in the integrator. Defaults to None.
+            rtol (float, optional): Relative tolerance of the adaptive method. Defaults to ADAPTIVE_RTOL.
+            atol (Union[float, Tuple[float, float]], optional): Absolute tolerance of the adaptive method, a single value
+                or one for the positions and one for the velocities. Defaults to ADAPTIVE_ATOL.
+            jerk_function (Function, optional): The function (positions, velocities, targets) -> (accelerations, jerks) of
+                the target bodies, used by the block method. Defaults to None.
+            eta (float, optional): Accuracy parameter of the block time steps. Defaults to BLOCK_ETA.
+            max_level (int, optional): Deepest level of the block time steps. Defaults to BLOCK_MAX_LEVEL.
         """
-        
+
         self.choose_method(method)
         self.derivative_function = derivative_function
+        self.jerk_function = jerk_function
+        self.eta = eta
+        self.max_level = max_level
+        self.rtol = rtol
+        self.atol = np.broadcast_to(np.asarray(atol, dtype=np.float64), (2,)).reshape(2, 1, 1)
+        self.accepted_steps = 0
+        self.rejected_steps = 0
+        self.reset()
+
+    def reset(self):
+        """Forget any state kept between steps (must be called when the bodies change)"""
+
+        # Accelerations at the end of the last step, reused by the kick-drift-kick methods
+        self._cached_positions = None
+        self._cached_accelerations = None
+
+        # Adaptive solver state, its time and state can be ahead of the output written to the arrays
+        self._adaptive_time = 0.0
+        self._adaptive_state = None
+        self._adaptive_derivative = None
+        self._adaptive_step = None
+        self._dense_output = None
+        self._output_time = 0.0
+        self._output_state = None
+
+        # Block time steps state: level, acceleration and jerk of every body, and the state they belong to
+        self._block_levels = None
+        self._block_accelerations = None
+        self._block_jerks = None
+        self._block_state = None
+
+    def get_state(self) -> dict:
+        """Return the state kept between steps (method, counters, caches and adaptive solver) as arrays
+
+        Returns:
+            dict: The arrays by name, the missing entries were not set (None)
+        """
+
+        state = {
+            "method": np.array(self.method), "rtol": np.array(self.rtol), "atol": self.atol.ravel(),
+            "steps": np.array([self.accepted_steps, self.rejected_steps]),
+            "adaptive_times": np.array([self._adaptive_time, self._output_time]),
+        }
+        arrays = {
+            "cached_positions": self._cached_positions, "cached_accelerations": self._cached_accelerations,
+            "adaptive_state": self._adaptive_state, "adaptive_derivative": self._adaptive_derivative,
+            "output_state": self._output_state, "block_levels": self._block_levels,
+            "block_accelerations": self._block_accelerations, "block_jerks": self._block_jerks, "block_state": self._block_state,
+            "adaptive_step": None if self._adaptive_step is None else np.array(self._adaptive_step),
+        }
+        if self._dense_output is not None:
+            t_old, h, y_old, coefficients = self._dense_output
+            arrays.update(dense_times=np.array([t_old, h]), dense_state=y_old, dense_coefficients=coefficients)
+        state.update({name: np.asarray(value) for name, value in arrays.items() if value is not None})
+        return state
+
+    def set_state(self, state: dict):
+        """Restore the state returned by get_state
+
+        Args:
+            state (dict): The arrays by name
+        """
+
+        self.choose_method(str(state["method"]))
+        self.rtol = float(state["rtol"])
+        self.atol = np.array(state["atol"], dtype=np.float64).reshape(2, 1, 1)
+        self.accepted_steps, self.rejected_steps = (int(value) for value in state["steps"])
+        self.reset()
+        self._adaptive_time, self._output_time = (float(value) for value in state["adaptive_times"])
+        self._cached_positions = state.get("cached_positions")
+        self._cached_accelerations = state.get("cached_accelerations")
+        self._adaptive_state = state.get("adaptive_state")
+        self._adaptive_derivative = state.get("adaptive_derivative")
+        self._output_state = state.get("output_state")
+        self._block_levels = state.get("block_levels")
+        self._block_accelerations = state.get("block_accelerations")
+        self._block_jerks = state.get("block_jerks")
+        self._block_state = state.get("block_state")
+        if "adaptive_step" in state:
+            self._adaptive_step = float(state["adaptive_step"])
+        if "dense_times" in state:
+            t_old, h = (float(value) for value in state["dense_times"])
+            self._dense_output = (t_old, h, state["dense_state"], state["dense_coefficients"])
 
     def choose_method(self, method: str = "RK4"):
         """Choose the integration method
@@ -23,69 +152,294 @@ class Integrator():
             method (str, optional): The name of the method to be selected. Defaults to "RK4".
         """
 
-        self.method = method
-        if self.method == "RK4":
+        if method == "RK4":
             self.method_implementation = self.rk4_step
-        elif self.method == "Euler": 
+        elif method == "Euler":
             self.method_implementation = self.euler_step
+        elif method in ("Leapfrog", "Verlet"):
+            self.method_implementation = self.leapfrog_step
+        elif method == "Yoshida4":
+            self.method_implementation = self.yoshida4_step
+        elif method in ("DOPRI5", "RK45"):
+            self.method_implementation = self.adaptive_step
+        elif method in ("Block", "Hermite"):
+            self.method_implementation = self.block_step
         else:
             raise Exception("Sorry, this method not exist")
+        self.method = method
 
-    def integrate(self, body, delta_t):
-        self.method_implementation(body, delta_t)
+    def integrate(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Advance the whole system by one step, the arrays are updated in place
 
-    def euler_step(self, body: CelestialBody, delta_t: np.double):
-        """Calculate and update the position and velocity of the body using Euler Method
+        Args:
+            positions (ndarray): The (N, 2) positions of all the bodies
+            velocities (ndarray): The (N, 2) velocities of all the bodies
+            delta_t (np.double): The time steps
+        """
+
+        self.method_implementation(positions, velocities, delta_t)
+
+    def euler_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Calculate and update the position and velocity of the bodies using Euler Method
 
         Args:
-            body (CelestialBody): The body that will be updated
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
             delta_t (np.double): The time steps
         """
 
-        velocity, acceleration = self.derivative_function(body, 0, body.position, body.velocity)
-        body.position += velocity * delta_t
-        body.velocity += acceleration * delta_t
+        velocity, acceleration = self.derivative_function(0, positions, velocities)
+        positions += velocity * delta_t
+        velocities += acceleration * delta_t
 
-    def rk4_step(self, body: CelestialBody, delta_t: np.double):
-        """Calculate the k-values and update the position and velocity of the body using RK4 method
+    def rk4_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Calculate the k-values and update the position and velocity of the bodies using RK4 method.
+        Every stage is evaluated for the whole system, so all the bodies advance synchronously.
 
         Args:
-            body (CelestialBody): The body that will be updated
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
             delta_t (np.double): The time steps
         """
 
         # Initial State
         t = 0 # In this simulation, I'm not taking time into consideration
-        initial_position = np.copy(body.position)
-        initial_velocity = np.copy(body.velocity)
-        
+        initial_position = np.copy(positions)
+        initial_velocity = np.copy(velocities)
+
         # k1
-        k1_vel, k1_acc = self.derivative_function(body, t, initial_position, initial_velocity)
+        k1_vel, k1_acc = self.derivative_function(t, initial_position, initial_velocity)
 
         # k2: halfway step
         k2_vel, k2_acc = self.derivative_function(
-            body, t + 0.5 * delta_t,
+            t + 0.5 * delta_t,
             initial_position + 0.5 * delta_t * k1_vel,
             initial_velocity + 0.5 * delta_t * k1_acc
         )
 
         # k3: another halfway step
         k3_vel, k3_acc = self.derivative_function(
-            body, t + 0.5 * delta_t,
+            t + 0.5 * delta_t,
             initial_position + 0.5 * delta_t * k2_vel,
             initial_velocity + 0.5 * delta_t * k2_acc
         )
 
         # k4: full step
         k4_vel, k4_acc = self.derivative_function(
-            body, t + delta_t,
+            t + delta_t,
             initial_position + delta_t * k3_vel,
             initial_velocity + delta_t * k3_acc
         )
 
         # Update position and velocity using the RK4 weighted average
-        body.position += (delta_t / 6) * (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel)
-        body.velocity += (delta_t / 6) * (k1_acc + 2 * k2_acc + 2 * k3_acc + k4_acc)
+        positions += (delta_t / 6) * (k1_vel + 2 * k2_vel + 2 * k3_vel + k4_vel)
+        velocities += (delta_t / 6) * (k1_acc + 2 * k2_acc + 2 * k3_acc + k4_acc)
+
+    def accelerations_at(self, positions: ndarray, velocities: ndarray) -> ndarray:
+        """Return the accelerations for the positions, reusing the ones of the last step when the state is unchanged
+
+        Args:
+            positions (ndarray): The (N, 2) positions of the bodies
+            velocities (ndarray): The (N, 2) velocities of the bodies
+
+        Returns:
+            ndarray: The (N, 2) accelerations
+        """
+
+        if self._cached_positions is not None and self._cached_positions.shape == positions.shape \
+                and np.array_equal(self._cached_positions, positions):
+            return self._cached_accelerations
+        return self.derivative_function(0, positions, velocities)[1]
+
+    def cache_accelerations(self, positions: ndarray, accelerations: ndarray):
+        self._cached_positions = np.copy(positions)
+        self._cached_accelerations = accelerations
+
+    def leapfrog_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Update the position and velocity of the bodies using the kick-drift-kick leapfrog (velocity Verlet).
+        It is symplectic, so the energy error stays bounded, and the final accelerations are reused on the next step,
+        which means one force evaluation per step.
+
+        Args:
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
+            delta_t (np.double): The time steps
+        """
+
+        acceleration = self.accelerations_at(positions, velocities)
+        velocities += 0.5 * delta_t * acceleration # Kick
+        positions += delta_t * velocities # Drift
+        acceleration = self.derivative_function(delta_t, positions, velocities)[1]
+        velocities += 0.5 * delta_t * acceleration # Kick
+        self.cache_accelerations(positions, acceleration)
+
+    def yoshida4_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Update the position and velocity of the bodies using the 4th order symplectic Yoshida method
+        (three force evaluations per step).
+
+        Args:
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
+            delta_t (np.double): The time steps
+        """
+
+        t = 0
+        for drift, kick in zip(YOSHIDA_DRIFTS, YOSHIDA_KICKS):
+            positions += drift * delta_t * velocities
+            t += drift * delta_t
+            velocities += kick * delta_t * self.derivative_function(t, positions, velocities)[1]
+        positions += YOSHIDA_DRIFTS[-1] * delta_t * velocities
+
+    def adaptive_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Advance the bodies by delta_t using the Dormand-Prince 5(4) method with error control.
+        The solver takes as many internal steps as the tolerances require (keeping its own step size between calls)
+        and the state at the requested time is sampled with the dense output, so delta_t only sets the output rate.
+
+        Args:
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
+            delta_t (np.double): The time between the outputs
+        """
+
+        state = np.stack((positions, velocities))
+        if self._output_state is None or self._output_state.shape != state.shape \
+                or not np.array_equal(self._output_state, state):
+            # The bodies were changed outside of the integrator, restart the solver from them
+            self._output_time = self._adaptive_time = 0.0
+            self._adaptive_state = state
+            self._adaptive_derivative = self.state_derivative(0.0, state)
+            self._adaptive_step = self._adaptive_step or delta_t
+            self._dense_output = None
+
+        target_time = self._output_time + delta_t
+        while self._adaptive_time < target_time:
+            self.dormand_prince_step()
+
+        state = self.dense_output(target_time)
+        positions[:] = state[0]
+        velocities[:] = state[1]
+        self._output_time = target_time
+        self._output_state = np.stack((positions, velocities))
+
+    def state_derivative(self, t: np.double, state: ndarray) -> ndarray:
+        return np.stack(self.derivative_function(t, state[0], state[1]))
+
+    def dormand_prince_step(self):
+        """Take one accepted Dormand-Prince step (retrying with smaller steps while the error is too large)"""
+
+        t, y, h = self._adaptive_time, self._adaptive_state, self._adaptive_step
+        k = np.empty((7,) + y.shape)
+        k[0] = self._adaptive_derivative
+        while True:
+            for stage in range(1, 7):
+                y_stage = y + h * np.tensordot(DOPRI_A[stage], k[:stage], axes=1)
+                k[stage] = self.state_derivative(t + DOPRI_C[stage] * h, y_stage)
+            y_new = y_stage # The 7th stage is evaluated at the 5th order solution
+
+            scale = self.atol + self.rtol * np.maximum(np.abs(y), np.abs(y_new))
+            error = np.sqrt(np.mean((h * np.tensordot(DOPRI_E, k, axes=1) / scale) ** 2))
+            if error <= 1:
+                factor = ADAPTIVE_MAX_FACTOR if error == 0 else ADAPTIVE_SAFETY * error ** -0.2
+                break
+            self.rejected_steps += 1
+            h *= max(ADAPTIVE_MIN_FACTOR, ADAPTIVE_SAFETY * error ** -0.2)
+
+        self.accepted_steps += 1
+        self._dense_output = (t, h, y, np.tensordot(DOPRI_P, k, axes=(0, 0)))
+        self._adaptive_time = t + h
+        self._adaptive_state = y_new
+        self._adaptive_derivative = k[6]
+        self._adaptive_step = h * min(ADAPTIVE_MAX_FACTOR, max(ADAPTIVE_MIN_FACTOR, factor))
+
+    def dense_output(self, t: np.double) -> ndarray:
+        """Interpolate the state inside the last accepted step
+
+        Args:
+            t (np.double): The time, between the start and the end of the last step
+
+        Returns:
+            ndarray: The (2, N, 2) state (positions, velocities)
+        """
+
+        if self._dense_output is None:
+            return np.copy(self._adaptive_state)
+        t_old, h, y_old, coefficients = self._dense_output
+        theta = (t - t_old) / h
+        powers = theta ** np.arange(1, coefficients.shape[0] + 1)
+        return y_old + h * np.tensordot(powers, coefficients, axes=1)
+
+    def block_step(self, positions: ndarray, velocities: ndarray, delta_t: np.double):
+        """Advance the bodies by delta_t with the 4th order Hermite predictor-corrector on hierarchical block time steps.
+        Every body steps by delta_t / 2^level, with its level chosen from its acceleration and derivatives (Aarseth
+        criterion). The bodies whose steps end together form a block: only they get new forces on each substep, the
+        others are just predicted, and all of them are synchronized again at the end of delta_t.
+
+        Args:
+            positions (ndarray): The (N, 2) positions that will be updated
+            velocities (ndarray): The (N, 2) velocities that will be updated
+            delta_t (np.double): The time steps (the largest step of a body)
+        """
+
+        if self.jerk_function is None:
+            raise Exception("Sorry, the block method needs the jerk function")
+        state = np.stack((positions, velocities))
+        if self._block_state is None or self._block_state.shape != state.shape or not np.array_equal(self._block_state, state):
+            # First step or the bodies were changed outside of the integrator, start the levels from them
+            self._block_accelerations, self._block_jerks = self.jerk_function(positions, velocities, np.arange(len(positions)))
+            step = self.eta_step(self._block_accelerations, self._block_jerks, None, None, BLOCK_START_ETA)
+            self._block_levels = self.step_levels(step, delta_t, np.zeros(len(positions), dtype=np.int64), 0)
+
+        # The time is counted in ticks of the smallest step, a body of level k steps 2^(max_level - k) ticks
+        end, tick = 1 << self.max_level, delta_t / (1 << self.max_level)
+        times = np.zeros(len(positions), dtype=np.int64)
+        accelerations, jerks, levels = self._block_accelerations, self._block_jerks, self._block_levels
+        now = 0
+        while now < end:
+            ends = times + np.left_shift(1, self.max_level - levels)
+            now = ends.min()
+            active = np.flatnonzero(ends == now)
+
+            # Predict every body to now with its Taylor series, the forces of the active block use the predicted state
+            dt = ((now - times) * tick)[:, np.newaxis]
+            predicted_positions = positions + dt * (velocities + dt * (accelerations / 2 + dt * jerks / 6))
+            predicted_velocities = velocities + dt * (accelerations + dt * jerks / 2)
+            new_accelerations, new_jerks = self.jerk_function(predicted_positions, predicted_velocities, active)
+
+            # Hermite corrector of the active bodies
+            h = dt[active]
+            old_accelerations, old_jerks = accelerations[active], jerks[active]
+            new_velocities = velocities[active] + h / 2 * (old_accelerations + new_accelerations) + h * h / 12 * (old_jerks - new_jerks)
+            positions[active] += h / 2 * (velocities[active] + new_velocities) + h * h / 12 * (old_accelerations - new_accelerations)
+            velocities[active] = new_velocities
+
+            # Snap and crackle of the Hermite interpolation (at the end of the step) give the next step size
+            crackle = (12 * (old_accelerations - new_accelerations) + 6 * h * (old_jerks + new_jerks)) / h ** 3
+            snap = (-6 * (old_accelerations - new_accelerations) - h * (4 * old_jerks + 2 * new_jerks)) / h ** 2 + h * crackle
+            accelerations[active], jerks[active], times[active] = new_accelerations, new_jerks, now
+            step = self.eta_step(new_accelerations, new_jerks, snap, crackle, self.eta)
+            levels[active] = self.step_levels(step, delta_t, levels[active], now)
+            self.accepted_steps += len(active)
+
+        self._block_state = np.stack((positions, velocities))
+
+    def eta_step(self, accelerations: ndarray, jerks: ndarray, snaps: ndarray, crackles: ndarray, eta: float) -> ndarray:
+        """The Aarseth step sqrt(eta (|a| |s| + |j|²) / (|j| |c| + |s|²)), or eta |a| / |j| without snap and crackle"""
 
+        a, j = np.linalg.norm(accelerations, axis=1), np.linalg.norm(jerks, axis=1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if snaps is None:
+                step = eta * a / j
+            else:
+                s, c = np.linalg.norm(snaps, axis=1), np.linalg.norm(crackles, axis=1)
+                step = np.sqrt(eta * (a * s + j * j) / (j * c + s * s))
+        return np.nan_to_num(step, nan=np.inf) # A body without forces takes the largest step
 
+    def step_levels(self, steps: ndarray, delta_t: np.double, levels: ndarray, now: int) -> ndarray:
+        """Quantize the wanted steps to levels (delta_t / 2^level <= step). A step can shrink at any time, but it can only
+        double when now is on the grid of the doubled step, so the blocks stay nested"""
 
+        with np.errstate(divide="ignore"):
+            wanted = np.clip(np.ceil(np.log2(delta_t / steps)), 0, self.max_level).astype(np.int64)
+        doubled = np.maximum(levels - 1, 0)
+        aligned = now % np.left_shift(1, self.max_level - doubled) == 0
+        return np.where(wanted < levels, np.where(aligned, doubled, levels), wanted)
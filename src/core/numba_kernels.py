@@ -0,0 +1,100 @@
+# Numba kernels of core.compiled, in their own module so Numba is only imported when the backend is selected
+# (importing it takes longer than the rest of the core).
+
+import numpy as np
+from numpy import ndarray
+from numba import njit, prange
+
+@njit(parallel=True, cache=True)
+def compiled_pairwise_accelerations(positions: ndarray, gm: ndarray, softening_sq: float, accelerations: ndarray):
+    """Write the acceleration of every body (G * m already applied to gm) into accelerations"""
+
+    n = positions.shape[0]
+    for i in prange(n):
+        xi = positions[i, 0]
+        yi = positions[i, 1]
+        ax = 0.0
+        ay = 0.0
+        for j in range(n):
+            dx = positions[j, 0] - xi
+            dy = positions[j, 1] - yi
+            distance_sq = dx * dx + dy * dy + softening_sq
+            if distance_sq > 0 and j != i:
+                inv_distance = 1.0 / np.sqrt(distance_sq)
+                weight = gm[j] * inv_distance * inv_distance * inv_distance
+                ax += weight * dx
+                ay += weight * dy
+        accelerations[i, 0] = ax
+        accelerations[i, 1] = ay
+
+@njit(parallel=True, cache=True)
+def compiled_leapfrog_step(positions: ndarray, velocities: ndarray, accelerations: ndarray, gm: ndarray,
+                           softening_sq: float, delta_t: float):
+    """Kick-drift-kick step of the whole system, accelerations must hold the ones of the current positions
+    and are replaced by the ones of the new positions"""
+
+    n = positions.shape[0]
+    for i in prange(n):
+        for axis in range(2):
+            velocities[i, axis] += 0.5 * delta_t * accelerations[i, axis] # Kick
+            positions[i, axis] += delta_t * velocities[i, axis] # Drift
+    compiled_pairwise_accelerations(positions, gm, softening_sq, accelerations)
+    for i in prange(n):
+        for axis in range(2):
+            velocities[i, axis] += 0.5 * delta_t * accelerations[i, axis] # Kick
+
+@njit(parallel=True, cache=True)
+def compiled_tree_walk(positions: ndarray, gm: ndarray, start: ndarray, end: ndarray, size: ndarray, first_child: ndarray,
+                       child_count: ndarray, center_of_mass: ndarray, node_gm: ndarray, theta_sq: float,
+                       softening_sq: float, max_depth: int, result: ndarray):
+    """Barnes-Hut walk of every (Morton sorted) body with its own stack, same opening rule as QuadTree.walk.
+    Writes the accelerations into result (N, 2), or with a (N, 3) result also the potential per unit mass"""
+
+    n = positions.shape[0]
+    potential = result.shape[1] > 2
+    for body in prange(n):
+        stack = np.empty(4 * (max_depth + 1) + 1, dtype=np.int64) # At most 4 children pushed per level
+        stack[0] = 0
+        top = 1
+        ax = 0.0
+        ay = 0.0
+        phi = 0.0
+        xi = positions[body, 0]
+        yi = positions[body, 1]
+        while top > 0:
+            top -= 1
+            node = stack[top]
+            dx = center_of_mass[node, 0] - xi
+            dy = center_of_mass[node, 1] - yi
+            distance_sq = dx * dx + dy * dy
+            inside = start[node] <= body and body < end[node]
+            leaf = first_child[node] < 0
+            if (not inside and size[node] * size[node] < theta_sq * distance_sq) \
+                    or (leaf and not inside and end[node] - start[node] == 1):
+                distance_sq += softening_sq
+                if distance_sq > 0:
+                    inv_distance = 1.0 / np.sqrt(distance_sq)
+                    weight = node_gm[node] * inv_distance * inv_distance * inv_distance
+                    ax += weight * dx
+                    ay += weight * dy
+                    phi -= node_gm[node] * inv_distance
+            elif leaf:
+                for j in range(start[node], end[node]):
+                    if j != body:
+                        dx = positions[j, 0] - xi
+                        dy = positions[j, 1] - yi
+                        distance_sq = dx * dx + dy * dy + softening_sq
+                        if distance_sq > 0:
+                            inv_distance = 1.0 / np.sqrt(distance_sq)
+                            weight = gm[j] * inv_distance * inv_distance * inv_distance
+                            ax += weight * dx
+                            ay += weight * dy
+                            phi -= gm[j] * inv_distance
+            else:
+                for child in range(first_child[node], first_child[node] + child_count[node]):
+                    stack[top] = child
+                    top += 1
+        result[body, 0] = ax
+        result[body, 1] = ay
+        if potential:
+            result[body, 2] = phi
@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+import numpy as np
+
+from config import PROFILE_TRACE_LIMIT, PROFILE_WINDOW
+
+class DisabledPhase:
+    """Returned by phase() while the profiler is disabled, entering and leaving it does nothing"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        return None
+
+DISABLED_PHASE = DisabledPhase()
+
+class Phase:
+    """Context manager timing one execution of a named phase"""
+
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *_):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns() - self.start)
+
+class Profiler:
+    """Per-phase timings (physics, trails, draw, ui, ...) with rolling percentiles and a Chrome trace export.
+
+    Every phase keeps its last `window` durations in a ring buffer, the trace keeps the last `trace_limit` events of
+    every thread in its own ring, so a busy stepper thread never pushes the render thread out of the export.
+    The exported file is the Chrome trace event format, it opens in chrome://tracing, Perfetto and speedscope.
+    """
+
+    def __init__(self, enabled: bool = False, window: int = PROFILE_WINDOW, trace_limit: int = PROFILE_TRACE_LIMIT):
+        """Initialize the profiler
+
+        Args:
+            enabled (bool, optional): Start recording right away. Defaults to False.
+            window (int, optional): Number of durations per phase used by the percentiles. Defaults to PROFILE_WINDOW.
+            trace_limit (int, optional): Number of events kept per thread for the trace export. Defaults to PROFILE_TRACE_LIMIT.
+        """
+
+        self.enabled = enabled
+        self.window = max(1, window)
+        self.lock = threading.Lock()
+        self.durations: dict[str, np.ndarray] = {}
+        self.heads: dict[str, int] = {}
+        self.counts: dict[str, int] = {}
+        self.trace_limit = trace_limit
+        self.events: dict[int, deque] = {} # Events of every thread, by thread id
+        self.thread_names: dict[int, str] = {}
+        self.origin = time.perf_counter_ns()
+
+    def phase(self, name: str):
+        """Time the block `with profiler.phase(name):` (does nothing while disabled)"""
+
+        return Phase(self, name) if self.enabled else DISABLED_PHASE
+
+    def record(self, name: str, start: int, duration: int):
+        """Store one duration (ns) of a phase that started at start (perf_counter_ns)"""
+
+        with self.lock:
+            durations = self.durations.get(name)
+            if durations is None:
+                durations = self.durations[name] = np.zeros(self.window)
+                self.heads[name] = self.counts[name] = 0
+            durations[self.heads[name]] = duration * 1e-6 # ms
+            self.heads[name] = (self.heads[name] + 1) % self.window
+            self.counts[name] = min(self.counts[name] + 1, self.window)
+            thread = threading.get_ident()
+            events = self.events.get(thread)
+            if events is None:
+                events = self.events[thread] = deque(maxlen=self.trace_limit)
+                self.thread_names[thread] = threading.current_thread().name
+            events.append((name, start, duration, thread))
+
+    def toggle(self) -> bool:
+        self.enabled = not self.enabled
+        if self.enabled:
+            self.reset()
+        return self.enabled
+
+    def reset(self):
+        with self.lock:
+            self.durations.clear()
+            self.heads.clear()
+            self.counts.clear()
+            self.events.clear()
+            self.origin = time.perf_counter_ns()
+
+    def percentiles(self, percentiles: tuple = (50, 95, 99)) -> dict[str, tuple]:
+        """Return the percentiles (ms) of the last durations of every phase
+
+        Args:
+            percentiles (tuple, optional): The percentiles to compute. Defaults to (50, 95, 99).
+
+        Returns:
+            dict[str, tuple]: The percentiles of every phase, by name
+        """
+
+        with self.lock:
+            samples = {name: durations[:self.counts[name]].copy() for name, durations in self.durations.items()}
+        return {name: tuple(np.percentile(values, percentiles)) for name, values in samples.items() if len(values)}
+
+    def export_trace(self, path: str) -> int:
+        """Write the recorded events as a Chrome trace (complete "X" events, times in microseconds)
+
+        Args:
+            path (str): The JSON file
+
+        Returns:
+            int: The number of events written
+        """
+
+        with self.lock:
+            events = sorted((event for thread_events in self.events.values() for event in thread_events),
+                            key=lambda event: event[1])
+        threads = {thread: index for index, thread in enumerate(dict.fromkeys(event[3] for event in events))}
+        trace = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": index,
+                  "args": {"name": self.thread_names.get(thread, f"thread-{index}")}} for thread, index in threads.items()]
+        trace += [{"name": name, "ph": "X", "ts": (start - self.origin) / 1e3, "dur": duration / 1e3, "pid": os.getpid(),
+                   "tid": threads[thread]} for name, start, duration, thread in events]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, file)
+        return len(events)
@@ -0,0 +1,158 @@
+import json
+import os
+import struct
+from typing import Optional
+import numpy as np
+from numpy import ndarray
+
+from core.body_system import BodySystem
+
+RECORDING_MAGIC = b"CBOSTRJ1"
+RECORDING_ALIGNMENT = 4096 # The frames start at a multiple of this offset, so they can be memory-mapped
+
+def frame_dtype(bodies: int) -> np.dtype:
+    """The fixed-size record of one frame (simulated time, positions and velocities of every body)"""
+
+    return np.dtype([("time", "<f8"), ("positions", "<f8", (bodies, 2)), ("velocities", "<f8", (bodies, 2))])
+
+class TrajectoryRecorder:
+    """Streams full state snapshots into an append-only binary file.
+
+    Layout: magic, header length (uint64), JSON header (body count, names, colors, masses, chunk size) padded to
+    RECORDING_ALIGNMENT, then fixed-size frames. Frames are buffered in memory and written one chunk at a time.
+    """
+
+    def __init__(self, path: str, system: BodySystem, chunk_frames: int = 256, every: int = 1):
+        """Create the recording file
+
+        Args:
+            path (str): The file that will be written (overwritten if it exists)
+            system (BodySystem): The recorded system, its bodies must not change during the recording
+            chunk_frames (int, optional): Number of frames buffered before each write. Defaults to 256.
+            every (int, optional): Record one of every `every` calls to record. Defaults to 1.
+        """
+
+        self.path = path
+        self.bodies = len(system)
+        self.every = max(1, every)
+        self.calls = 0
+        header = json.dumps({
+            "bodies": self.bodies, "chunk_frames": chunk_frames, "names": list(system.names),
+            "colors": [list(map(int, color)) for color in system.colors], "masses": system.masses.tolist(),
+        }).encode()
+        prefix = RECORDING_MAGIC + struct.pack("<Q", len(header)) + header
+        padding = -len(prefix) % RECORDING_ALIGNMENT
+
+        self.file = open(path, "wb")
+        self.file.write(prefix + b"\0" * padding)
+        self.chunk = np.zeros(max(1, chunk_frames), dtype=frame_dtype(self.bodies))
+        self.buffered = 0
+        self.frames = 0
+
+    def record(self, time: float, positions: ndarray, velocities: ndarray):
+        """Append a frame (respecting `every`)
+
+        Args:
+            time (float): The simulated time (s)
+            positions (ndarray): The (N, 2) positions
+            velocities (ndarray): The (N, 2) velocities
+        """
+
+        self.calls += 1
+        if (self.calls - 1) % self.every != 0:
+            return
+        if positions.shape[0] != self.bodies:
+            raise Exception("Sorry, the number of bodies changed during the recording")
+        frame = self.chunk[self.buffered]
+        frame["time"] = time
+        frame["positions"] = positions
+        frame["velocities"] = velocities
+        self.buffered += 1
+        self.frames += 1
+        if self.buffered == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        if self.buffered:
+            self.file.write(self.chunk[:self.buffered].tobytes())
+            self.buffered = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+class TrajectoryReader:
+    """Reads a recording through np.memmap, so only the frames that are accessed are loaded from disk"""
+
+    def __init__(self, path: str):
+        """Open a recording
+
+        Args:
+            path (str): The file written by TrajectoryRecorder
+        """
+
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(RECORDING_MAGIC)) != RECORDING_MAGIC:
+                raise Exception(f"Sorry, '{path}' is not a trajectory recording")
+            (header_length,) = struct.unpack("<Q", file.read(8))
+            self.header = json.loads(file.read(header_length))
+        self.offset = len(RECORDING_MAGIC) + 8 + header_length
+        self.offset += -self.offset % RECORDING_ALIGNMENT
+        self.names: list[str] = self.header["names"]
+        self.colors: list[tuple] = [tuple(color) for color in self.header["colors"]]
+        self.masses = np.array(self.header["masses"])
+        self.dtype = frame_dtype(self.header["bodies"])
+        self.frames: Optional[np.memmap] = None
+        self.refresh()
+
+    def refresh(self):
+        """Map the file again to see the frames appended since it was opened"""
+
+        count = max(0, (os.path.getsize(self.path) - self.offset) // self.dtype.itemsize)
+        self.frames = np.memmap(self.path, dtype=self.dtype, mode="r", offset=self.offset, shape=(count,)) if count else None
+        chunk = max(1, self.header["chunk_frames"])
+        # Coarse time index (first time of every chunk), read with one strided access
+        self.chunk_times = np.array(self.frames["time"][::chunk]) if count else np.zeros(0)
+
+    def __len__(self) -> int:
+        return 0 if self.frames is None else len(self.frames)
+
+    @property
+    def times(self) -> ndarray:
+        return self.frames["time"]
+
+    @property
+    def positions(self) -> ndarray:
+        """The (frames, N, 2) memory-mapped positions"""
+        return self.frames["positions"]
+
+    @property
+    def velocities(self) -> ndarray:
+        """The (frames, N, 2) memory-mapped velocities"""
+        return self.frames["velocities"]
+
+    def frame_at_time(self, time: float) -> int:
+        """Return the index of the last frame recorded at or before the simulated time
+
+        Args:
+            time (float): The simulated time (s)
+
+        Returns:
+            int: The frame index (0 when the time is before the first frame)
+        """
+
+        if len(self) == 0:
+            return 0
+        chunk = max(1, self.header["chunk_frames"])
+        start = max(0, int(np.searchsorted(self.chunk_times, time, side="right")) - 1) * chunk
+        stop = min(start + chunk, len(self))
+        return max(0, start + int(np.searchsorted(self.frames["time"][start:stop], time, side="right")) - 1)
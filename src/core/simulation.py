@@ -1,58 +1,233 @@
-from typing import Tuple
+import os
+from typing import Optional, Tuple
 from numpy import double, ndarray
 import numpy as np
+from core.body_system import BodySystem
 from core.celestial_body import CelestialBody
-from config import G
+from config import BARNES_HUT_THETA, CHECKPOINT_VERSION, COLLISIONS, COMPUTE_BACKEND, FORCE_SOLVER, SOFTENING, USE_FLOAT32
+from core.barnes_hut import barnes_hut_accelerations, barnes_hut_potential_energy
+from core.collisions import merge_collisions
+from core.compiled import numba_accelerations, numba_leapfrog_step, select_backend
+from core.diagnostics import DiagnosticsMonitor
+from core.gravity import accelerations_and_jerks, field_accelerations, pairwise_accelerations, potential_energy
 from core.integrator import Integrator
 
 class Simulation:
     """Class responsible for handling the simulation and the calculations involving it"""
 
-    def __init__(self, bodies: list[CelestialBody], delta_t: double = 60, method: str = "RK4"):
+    def __init__(self, system: BodySystem, delta_t: double = 60, method: str = "RK4",
+                 softening: double = SOFTENING, use_float32: bool = USE_FLOAT32, force_solver: str = FORCE_SOLVER,
+                 theta: double = BARNES_HUT_THETA, backend: str = COMPUTE_BACKEND, collisions: bool = COLLISIONS):
         """Initialize the Simulation
 
         Args:
-            bodies (list[CelestialBody]): All the bodies on the simulation
+            system (BodySystem): The storage of all the bodies on the simulation
             delta_t (double, optional): Time steps (how much each iteration advance in time). Defaults to 60.
-            method (str, optional): The name of the method to be selected (RK4 | Euler). Defaults to "RK4".
+            method (str, optional): The name of the method to be selected (RK4 | Euler | Leapfrog | Verlet | Yoshida4 | DOPRI5 | Block). Defaults to "RK4".
+            softening (double, optional): Softening length (m) used on the pair interactions. Defaults to SOFTENING.
+            use_float32 (bool, optional): Compute the pair interactions in single precision. Defaults to USE_FLOAT32.
+            force_solver (str, optional): The gravity solver (direct | barnes_hut). Defaults to FORCE_SOLVER.
+            theta (double, optional): Opening angle of the Barnes-Hut solver. Defaults to BARNES_HUT_THETA.
+            backend (str, optional): The backend of the direct-sum kernels (auto | numba | numpy). Defaults to COMPUTE_BACKEND.
+            collisions (bool, optional): Merge the bodies that touch (see BodySystem.radii) after every step. Defaults to COLLISIONS.
         """
 
-        self.bodies = bodies
         self.delta_t = delta_t
         self.method = method
-        self.integrator = Integrator(method, self.f)
+        self.softening = softening
+        self.dtype = np.float32 if use_float32 else np.float64
+        self.requested_backend = backend
+        self.backend = self.resolve_backend(len(system))
+        self.choose_force_solver(force_solver, theta)
+        self.integrator = Integrator(method, self.f, jerk_function=self.jerks)
+        self.diagnostics: Optional[DiagnosticsMonitor] = None # Conserved quantities, sampled by run when set
+        self.collisions = collisions
+        self.merged_bodies = 0
+        self.change_bodies(system)
 
-    def change_bodies(self, bodies: list[CelestialBody]):
-        self.bodies = bodies
+    def change_bodies(self, system: BodySystem):
+        backend = self.resolve_backend(len(system))
+        if backend != self.backend: # Auto picks the backend by the size of the system
+            self.backend = backend
+            self.choose_force_solver(self.force_solver, self.theta)
+        self.system = system
+        self.time = 0.0 # Simulated time (s)
+        self.steps = 0
+        self.integrator.reset()
+        if self.diagnostics is not None:
+            self.diagnostics.reset()
 
-    def f(self, body: CelestialBody, t: double, position: ndarray, velocity: ndarray) -> Tuple[ndarray, ndarray]:
-        """Calculate the derivatives (velocity and acceleration) for a given body at a given time and state.
+    def resolve_backend(self, bodies: int) -> str:
+        # The compiled kernels are float64 only, the float32 mode keeps the NumPy path
+        return select_backend(self.requested_backend, bodies) if self.dtype == np.float64 else "numpy"
+
+    def choose_force_solver(self, force_solver: str = "direct", theta: double = BARNES_HUT_THETA):
+        """Choose the algorithm that computes the gravitational accelerations
 
         Args:
-            body (CelestialBody): The body that will be calculated
-            t (double): The timestep
-            position (ndarray): The current position of the body
-            velocity (ndarray): The current velocity of the body
+            force_solver (str, optional): The name of the solver (direct | barnes_hut). Defaults to "direct".
+            theta (double, optional): Opening angle of the Barnes-Hut solver. Defaults to BARNES_HUT_THETA.
+        """
+
+        # The potential energy (diagnostics only) uses the same approximation as the forces
+        self.potential_function = lambda positions, masses: potential_energy(positions, masses, self.softening)
+        if force_solver == "direct" and self.backend == "numba":
+            self.acceleration_function = lambda positions, masses: numba_accelerations(positions, masses, self.softening)
+        elif force_solver == "direct":
+            self.acceleration_function = lambda positions, masses: pairwise_accelerations(positions, masses, self.softening, self.dtype)
+        elif force_solver == "barnes_hut":
+            self.acceleration_function = lambda positions, masses: barnes_hut_accelerations(positions, masses, theta, self.softening,
+                                                                                            backend=self.backend)
+            self.potential_function = lambda positions, masses: barnes_hut_potential_energy(positions, masses, theta, self.softening,
+                                                                                            backend=self.backend)
+        else:
+            raise Exception("Sorry, this force solver not exist")
+        self.force_solver = force_solver
+        self.theta = theta
+
+    @property
+    def bodies(self) -> list[CelestialBody]:
+        return self.system.bodies
+
+    def save_checkpoint(self, path: str):
+        """Write the complete state (bodies, trails, time, parameters and integrator state) to an uncompressed .npz file.
+        The file is written next to the destination and renamed, so a crash never leaves a truncated checkpoint.
+
+        Args:
+            path (str): The checkpoint file
+        """
+
+        system, trails = self.system, self.system.trails
+        kept = int(trails.counts[:trails.rows].max(initial=0)) # Only the valid part of the trails is saved
+        arrays = {
+            "version": np.array(CHECKPOINT_VERSION), "time": np.array(self.time), "steps": np.array(self.steps),
+            "delta_t": np.array(self.delta_t), "softening": np.array(self.softening),
+            "use_float32": np.array(self.dtype == np.float32), "force_solver": np.array(self.force_solver),
+            "theta": np.array(self.theta), "backend": np.array(self.backend),
+            "names": np.array(system.names, dtype=str), "colors": np.array(system.colors, dtype=np.uint8).reshape(-1, 3),
+            "masses": system.masses, "radii": system.radii, "positions": system.positions, "velocities": system.velocities,
+            "collisions": np.array([self.collisions, self.merged_bodies]),
+            "trail_settings": np.array([trails.limit, trails.stride, trails.calls]),
+            "trail_window": trails.window()[:, trails.limit - kept:], "trail_counts": trails.counts[:trails.rows],
+            "massive": np.array(system.massive),
+        }
+        arrays.update({f"integrator_{name}": value for name, value in self.integrator.get_state().items()})
+
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as file:
+            np.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+
+    @classmethod
+    def load_checkpoint(cls, path: str, backend: str = None) -> "Simulation":
+        """Rebuild a simulation from a file written by save_checkpoint, it continues exactly where it stopped
+
+        Args:
+            path (str): The checkpoint file
+            backend (str, optional): Override the saved compute backend. Defaults to None.
 
         Returns:
-            Tuple[ndarray, ndarray]: A tuple (velocity, acceleration) containing the deri vatives of the body
+            Simulation: The restored simulation
         """
 
-        acceleration = np.zeros(2)
+        with np.load(path, allow_pickle=False) as data:
+            arrays = {name: data[name] for name in data.files}
+        version = int(arrays["version"])
+        if version not in (CHECKPOINT_VERSION - 1, CHECKPOINT_VERSION):
+            raise Exception("Sorry, this checkpoint version not supported")
+
+        limit, stride, calls = (int(value) for value in arrays["trail_settings"])
+        system = BodySystem(len(arrays["masses"]), limit, stride)
+        names = [str(name) for name in arrays["names"]]
+        colors = [tuple(int(channel) for channel in color) for color in arrays["colors"]]
+        # The rows after the massive bodies are test particles, the files of the previous version have none
+        massive = int(arrays["massive"]) if version == CHECKPOINT_VERSION else len(names)
+        for rows, test_particles in ((slice(0, massive), False), (slice(massive, None), True)):
+            system.add_arrays(arrays["positions"][rows], arrays["velocities"][rows], arrays["masses"][rows], names[rows],
+                              colors[rows], arrays["radii"][rows], test_particles)
+        system.trails.restore(arrays["trail_window"], arrays["trail_counts"], calls)
 
-        # Calculate the gravitational force from other bodies
-        for other_body in self.bodies:
-            if other_body != body:
-                distance_vector = other_body.position - position
-                distance = np.linalg.norm(distance_vector)
-                if distance > 0:
-                    force_magnitude = G * body.mass * other_body.mass / distance ** 2
-                    force_vector = force_magnitude * (distance_vector / distance) # Normalize
-                    acceleration += force_vector / body.mass
+        integrator_state = {name[len("integrator_"):]: value for name, value in arrays.items() if name.startswith("integrator_")}
+        simulation = cls(system, float(arrays["delta_t"]), str(integrator_state["method"]), float(arrays["softening"]),
+                         bool(arrays["use_float32"]), str(arrays["force_solver"]), float(arrays["theta"]),
+                         backend or str(arrays["backend"]), bool(arrays["collisions"][0]))
+        simulation.integrator.set_state(integrator_state)
+        simulation.time = float(arrays["time"])
+        simulation.steps = int(arrays["steps"])
+        simulation.merged_bodies = int(arrays["collisions"][1])
+        return simulation
+
+    def f(self, t: double, positions: ndarray, velocities: ndarray) -> Tuple[ndarray, ndarray]:
+        """Calculate the derivatives (velocity and acceleration) of the whole system at a given time and state.
+
+        Args:
+            t (double): The timestep
+            positions (ndarray): The (N, 2) positions of the bodies
+            velocities (ndarray): The (N, 2) velocities of the bodies
+
+        Returns:
+            Tuple[ndarray, ndarray]: A tuple (velocities, accelerations) containing the derivatives of the bodies
+        """
+
+        massive = self.system.massive
+        if massive == len(positions):
+            accelerations = self.acceleration_function(positions, self.system.masses)
+        else:
+            # Restricted problem: the solver only sees the massive bodies, the test particles feel their field
+            accelerations = np.empty((len(positions), 2))
+            accelerations[:massive] = self.acceleration_function(positions[:massive], self.system.masses[:massive]) \
+                if massive else 0.0
+            accelerations[massive:] = field_accelerations(positions[massive:], positions[:massive],
+                                                          self.system.masses[:massive], self.softening)
 
         # Return the derivative of position (velocity) and the derivative of velocity (acceleration)
-        return velocity, acceleration
+        return velocities, accelerations
+
+    def jerks(self, positions: ndarray, velocities: ndarray, targets: ndarray) -> Tuple[ndarray, ndarray]:
+        """Calculate the accelerations and jerks of the target bodies (used by the block method).
+        They are always a direct sum over all the massive bodies, whatever the force solver.
+
+        Args:
+            positions (ndarray): The (N, 2) positions of the bodies
+            velocities (ndarray): The (N, 2) velocities of the bodies
+            targets (ndarray): The (M,) indices of the bodies that are updated
+
+        Returns:
+            Tuple[ndarray, ndarray]: The (M, 2) accelerations and (M, 2) jerks of the targets
+        """
+
+        return accelerations_and_jerks(positions, velocities, self.system.masses, targets, self.softening, self.system.massive)
+
+    def sample_diagnostics(self) -> bool:
+        """Give the current state to the diagnostics monitor (it samples only on its interval)"""
+
+        system, massive = self.system, self.system.massive # The test particles carry no energy nor momentum
+        return self.diagnostics.update(self.steps, self.time, system.positions[:massive], system.velocities[:massive],
+                                       system.masses[:massive], self.potential_function)
 
     def run(self):
-        for body in self.bodies:
-            self.integrator.integrate(body, self.delta_t)
+        if len(self.system) == 0:
+            return
+
+        system = self.system
+        if self.diagnostics is not None and self.diagnostics.count == 0:
+            self.sample_diagnostics() # The first sample is the energy reference
+        if self.backend == "numba" and self.force_solver == "direct" and self.integrator.method in ("Leapfrog", "Verlet") \
+                and system.massive == len(system):
+            # Fused compiled step, the accelerations of the last step are kept by the integrator cache
+            accelerations = np.array(self.integrator.accelerations_at(system.positions, system.velocities))
+            numba_leapfrog_step(system.positions, system.velocities, accelerations, system.masses, self.softening, self.delta_t)
+            self.integrator.cache_accelerations(system.positions, accelerations)
+        else:
+            self.integrator.integrate(system.positions, system.velocities, self.delta_t)
+        if self.collisions:
+            merged = merge_collisions(system)
+            if merged:
+                self.merged_bodies += merged
+                self.integrator.reset() # The cached accelerations and adaptive state belong to the old bodies
+        self.time += self.delta_t
+        self.steps += 1
+        if self.diagnostics is not None:
+            self.sample_diagnostics()
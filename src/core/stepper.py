@@ -0,0 +1,194 @@
+import threading
+import time
+from collections import namedtuple
+from typing import Optional
+import numpy as np
+from numpy import ndarray
+
+from config import CHECKPOINT_INTERVAL, CHECKPOINT_PATH, MAX_FRAME_STEP_TIME, MAX_STEP_BACKLOG, SIMULATION_THREAD, STEPS_PER_SECOND
+from core.checkpoint import AutoCheckpoint
+from core.profiler import Profiler
+from core.recording import TrajectoryRecorder
+from core.simulation import Simulation
+
+# State published after a step, read by the renderer
+Snapshot = namedtuple("Snapshot", ["time", "wall_time", "positions"])
+
+class SimulationStepper:
+    """Advances a simulation at its own rate, decoupled from the render frame rate.
+
+    The simulation runs `STEPS_PER_SECOND * speed` steps per wall-clock second using a fixed-timestep accumulator,
+    or as fast as possible when the speed is None. In threaded mode a worker thread does the stepping, otherwise
+    `advance` is called once per frame. After every step the positions are published in a double buffer
+    (previous/current), so the renderer can interpolate between the two last steps without touching the live state,
+    and the state is appended to the recorder when there is one (checkpoints are saved the same way).
+    Anything that mutates the simulation from another thread must hold `lock`.
+    """
+
+    def __init__(self, simulation: Simulation, threaded: bool = SIMULATION_THREAD, steps_per_second: float = STEPS_PER_SECOND,
+                 profiler: Optional[Profiler] = None):
+        """Initialize the stepper
+
+        Args:
+            simulation (Simulation): The simulation that will be advanced
+            threaded (bool, optional): Step on a background thread. Defaults to SIMULATION_THREAD.
+            steps_per_second (float, optional): The number of steps per second at speed 1. Defaults to STEPS_PER_SECOND.
+            profiler (Optional[Profiler], optional): Times the physics and trails phases. Defaults to a disabled one.
+        """
+
+        self.profiler = profiler if profiler is not None else Profiler()
+        self.lock = threading.RLock()
+        self.threaded = threaded
+        self.steps_per_second = steps_per_second
+        self.speed: Optional[float] = 1.0
+        self.paused = False
+        self._accumulator = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+        self.recorder: Optional[TrajectoryRecorder] = None
+        self.checkpoint = AutoCheckpoint(CHECKPOINT_PATH, every_seconds=CHECKPOINT_INTERVAL) if CHECKPOINT_INTERVAL else None
+        self.set_simulation(simulation)
+
+    def set_simulation(self, simulation: Simulation):
+        """Replace the simulation (or its bodies were replaced) and restart the snapshots from its state"""
+
+        with self.lock:
+            self.stop_recording() # The recorded bodies are gone
+            self.simulation = simulation
+            positions = np.copy(simulation.system.positions)
+            self._current = Snapshot(simulation.time, time.perf_counter(), positions)
+            self._previous = self._current
+            self._accumulator = 0.0
+
+    def start_recording(self, path: str, every: int = 1):
+        """Record every step of the simulation into a trajectory file"""
+
+        with self.lock:
+            self.stop_recording()
+            self.recorder = TrajectoryRecorder(path, self.simulation.system, every=every)
+
+    def stop_recording(self) -> Optional[int]:
+        """Stop the recording, returning the number of frames written (None when there was no recording)"""
+
+        with self.lock:
+            if self.recorder is None:
+                return None
+            self.recorder.close()
+            frames, self.recorder = self.recorder.frames, None
+            return frames
+
+    def set_speed(self, speed: Optional[float]):
+        """Change the speed multiplier, None runs as fast as possible"""
+
+        self.speed = speed
+        self._accumulator = 0.0
+
+    def toggle_pause(self) -> bool:
+        self.paused = not self.paused
+        self._accumulator = 0.0
+        return self.paused
+
+    def step(self):
+        """Run one step of the simulation, record the trails and publish the new positions"""
+
+        profiler = self.profiler
+        with self.lock:
+            simulation = self.simulation
+            if profiler.enabled:
+                with profiler.phase("physics"):
+                    simulation.run()
+                with profiler.phase("trails"):
+                    simulation.system.record_trails()
+            else: # The hot path skips the instrumentation entirely
+                simulation.run()
+                simulation.system.record_trails()
+            positions = simulation.system.positions
+            if self.recorder is not None or self.checkpoint is not None:
+                with profiler.phase("recording"):
+                    if self.recorder is not None and self.recorder.bodies != len(positions):
+                        self.stop_recording() # Bodies were merged, the frames have a fixed size
+                    if self.recorder is not None:
+                        self.recorder.record(simulation.time, positions, simulation.system.velocities)
+                    if self.checkpoint is not None:
+                        self.checkpoint.update(simulation)
+            # Reuse the buffer of the oldest snapshot when the number of bodies did not change
+            buffer = self._previous.positions
+            if buffer is self._current.positions or buffer.shape != positions.shape:
+                buffer = np.empty_like(positions)
+            np.copyto(buffer, positions)
+            self._previous = self._current
+            self._current = Snapshot(simulation.time, time.perf_counter(), buffer)
+
+    def advance(self, frame_time: float):
+        """Run the steps owed for frame_time seconds of wall-clock time (used when not threaded)
+
+        Args:
+            frame_time (float): The wall-clock time of the last frame (s)
+        """
+
+        if self.threaded or self.paused:
+            return
+        if self.speed is None:
+            # As fast as possible while keeping the frame responsive
+            deadline = time.perf_counter() + MAX_FRAME_STEP_TIME
+            while time.perf_counter() < deadline:
+                self.step()
+            return
+
+        rate = self.steps_per_second * self.speed
+        self._accumulator = min(self._accumulator + frame_time * rate, rate * MAX_STEP_BACKLOG + 1)
+        while self._accumulator >= 1:
+            self.step()
+            self._accumulator -= 1
+
+    def interpolated_positions(self) -> ndarray:
+        """Return the positions to draw, interpolated between the two last published steps
+
+        Returns:
+            ndarray: A (N, 2) copy of the positions
+        """
+
+        previous, current = self._previous, self._current
+        if previous.positions.shape != current.positions.shape or current.wall_time <= previous.wall_time:
+            return np.copy(current.positions)
+        if self.threaded:
+            alpha = (time.perf_counter() - current.wall_time) / (current.wall_time - previous.wall_time)
+        else:
+            alpha = self._accumulator
+        alpha = min(max(alpha, 0.0), 1.0)
+        return previous.positions + alpha * (current.positions - previous.positions)
+
+    def start(self):
+        if self.threaded and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="simulation-stepper", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self):
+        """Worker thread: fixed-timestep accumulator on its own clock"""
+
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            if self.paused:
+                time.sleep(0.01)
+                continue
+            if self.speed is None:
+                self.step()
+                time.sleep(0) # Let the render thread take the lock
+                continue
+
+            rate = self.steps_per_second * self.speed
+            self._accumulator = min(self._accumulator + elapsed * rate, rate * MAX_STEP_BACKLOG + 1)
+            while self._accumulator >= 1 and not self._stop.is_set():
+                self.step()
+                self._accumulator -= 1
+                time.sleep(0)
+            time.sleep(max(0.0, (1 - self._accumulator) / rate))
@@ -0,0 +1,160 @@
+import numpy as np
+from numpy import ndarray
+
+class TrailBuffer:
+    """Ring buffer with the last `limit` positions of every body, stored in one (rows, 2 * limit, 2) array.
+
+    Every sample is written twice (at `head` and `head + limit`), so the window [head, head + limit) always holds
+    the samples from the oldest to the newest and the ordered trails are returned as views, without copies.
+    All the bodies share the write head, `counts` keeps how many valid samples each row has.
+    Samples are stored in float32, they are only used for display and charts.
+    """
+
+    def __init__(self, rows: int = 16, limit: int = 200, stride: int = 1):
+        """Initialize the trail buffer
+
+        Args:
+            rows (int, optional): The number of rows (bodies) allocated. Defaults to 16.
+            limit (int, optional): The number of samples kept per body. Defaults to 200.
+            stride (int, optional): Only one of every `stride` calls to record stores a sample. Defaults to 1.
+        """
+
+        self.limit = max(1, limit)
+        self.stride = max(1, stride)
+        self.rows = 0
+        self.head = 0
+        self.calls = 0
+        self.samples = 0 # Samples stored since the creation, only grows
+        self.version = 0 # Changes whenever stored samples are moved or dropped (everything but record)
+        self.buffer = np.zeros((max(1, rows), 2 * self.limit, 2), dtype=np.float32)
+        self.counts = np.zeros(max(1, rows), dtype=np.int64)
+
+    def reserve(self, rows: int):
+        """Make sure there is storage for at least `rows` bodies (grows geometrically)"""
+
+        if rows <= self.buffer.shape[0]:
+            return
+        new_rows = max(rows, 2 * self.buffer.shape[0])
+        buffer = np.zeros((new_rows,) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+        buffer[:self.rows] = self.buffer[:self.rows]
+        counts = np.zeros(new_rows, dtype=np.int64)
+        counts[:self.rows] = self.counts[:self.rows]
+        self.buffer, self.counts = buffer, counts
+
+    def add_rows(self, amount: int = 1):
+        """Append empty trails for new bodies"""
+
+        self.reserve(self.rows + amount)
+        self.counts[self.rows:self.rows + amount] = 0
+        self.rows += amount
+
+    def remove_row(self, index: int):
+        """Remove the trail of a body moving the last row into its slot (mirrors BodySystem.remove)"""
+
+        self.move_row(self.rows - 1, index)
+        self.rows -= 1
+        self.version += 1
+
+    def move_row(self, source: int, target: int):
+        """Copy the trail of the row source over the row target"""
+
+        if source != target:
+            self.buffer[target] = self.buffer[source]
+            self.counts[target] = self.counts[source]
+            self.version += 1
+
+    def permute(self, order: ndarray):
+        """Reorder the rows, the row i takes the trail of the row order[i]"""
+
+        self.buffer[:self.rows] = self.buffer[order]
+        self.counts[:self.rows] = self.counts[order]
+        self.version += 1
+
+    def record(self, positions: ndarray):
+        """Store the current positions of all the bodies (respecting the stride)
+
+        Args:
+            positions (ndarray): The (rows, 2) positions of the bodies
+        """
+
+        self.calls += 1
+        if (self.calls - 1) % self.stride != 0 or self.rows == 0:
+            return
+        self.buffer[:self.rows, self.head] = positions
+        self.buffer[:self.rows, self.head + self.limit] = positions
+        self.head = (self.head + 1) % self.limit
+        self.samples += 1
+        np.minimum(self.counts[:self.rows] + 1, self.limit, out=self.counts[:self.rows])
+
+    def trail(self, index: int) -> ndarray:
+        """Return the trail of one body from the oldest to the newest sample
+
+        Args:
+            index (int): The row of the body
+
+        Returns:
+            ndarray: A (count, 2) view of the buffer
+        """
+
+        end = self.head + self.limit
+        return self.buffer[index, end - self.counts[index]:end]
+
+    def window(self) -> ndarray:
+        """Return the (rows, limit, 2) ordered view of every trail, only the last counts[i] samples of a row are valid"""
+
+        return self.buffer[:self.rows, self.head:self.head + self.limit]
+
+    def valid_mask(self) -> ndarray:
+        """Return the (rows, limit) mask of the valid samples of window()"""
+
+        return np.arange(self.limit)[np.newaxis, :] >= (self.limit - self.counts[:self.rows])[:, np.newaxis]
+
+    def resize(self, limit: int):
+        """Change the number of samples kept per body, keeping the newest ones
+
+        Args:
+            limit (int): The new limit
+        """
+
+        limit = max(1, limit)
+        if limit == self.limit:
+            return
+        kept = min(limit, self.limit)
+        newest = self.window()[:, self.limit - kept:]
+        buffer = np.zeros((self.buffer.shape[0], 2 * limit, 2), dtype=self.buffer.dtype)
+        buffer[:self.rows, limit - kept:limit] = newest
+        buffer[:self.rows, 2 * limit - kept:] = newest
+        self.buffer = buffer
+        self.limit = limit
+        self.head = 0
+        self.version += 1
+        np.minimum(self.counts, limit, out=self.counts)
+
+    def restore(self, window: ndarray, counts: ndarray, calls: int = 0):
+        """Replace every trail by saved ones (see window() and counts)
+
+        Args:
+            window (ndarray): The (rows, K, 2) ordered samples, the newest last (K <= limit)
+            counts (ndarray): The (rows,) number of valid samples of each row
+            calls (int, optional): The number of calls to record already made (keeps the stride phase). Defaults to 0.
+        """
+
+        rows, kept = window.shape[0], min(window.shape[1], self.limit)
+        self.rows = 0
+        self.add_rows(rows)
+        self.buffer[:rows] = 0
+        self.buffer[:rows, self.limit - kept:self.limit] = window[:, window.shape[1] - kept:]
+        self.buffer[:rows, 2 * self.limit - kept:] = window[:, window.shape[1] - kept:]
+        self.head = 0
+        self.calls = calls
+        self.version += 1
+        self.counts[:rows] = np.minimum(counts, kept)
+
+    def clear(self, index: int = None):
+        """Forget the samples of one body, or of every body when index is not provided"""
+
+        if index is None:
+            self.counts[:] = 0
+        else:
+            self.counts[index] = 0
+        self.version += 1
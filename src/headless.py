@@ -0,0 +1,160 @@
+import argparse
+import os
+import time
+import numpy as np
+
+from config import BARNES_HUT_THETA, COLLISIONS, COMPUTE_BACKEND, DELTA_T, DIAGNOSTICS_INTERVAL, FORCE_SOLVER
+from core.checkpoint import AutoCheckpoint
+from core.diagnostics import DiagnosticsMonitor
+from core.recording import TrajectoryRecorder
+from core.simulation import Simulation
+from utils.template_loader import TemplateLoader
+
+class HeadlessRunner:
+    """Runs a simulation as fast as possible without any display (pygame is never imported)"""
+
+    def __init__(self, simulation: Simulation, output_dir: str = None, snapshot_every: int = 0,
+                 recorder: TrajectoryRecorder = None, checkpoint: AutoCheckpoint = None):
+        """Initialize the runner
+
+        Args:
+            simulation (Simulation): The simulation that will be advanced
+            output_dir (str, optional): Directory of the snapshots, if not provided nothing is written. Defaults to None.
+            snapshot_every (int, optional): Steps between the snapshots (0 writes only the final state). Defaults to 0.
+            recorder (TrajectoryRecorder, optional): Records the trajectory of every step. Defaults to None.
+            checkpoint (AutoCheckpoint, optional): Saves periodic checkpoints (and one at the end). Defaults to None.
+        """
+
+        self.simulation = simulation
+        self.recorder = recorder
+        self.checkpoint = checkpoint
+        self.output_dir = output_dir
+        self.snapshot_every = snapshot_every
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def write_snapshot(self):
+        """Write the current state of the system as snapshot_<step>.npz inside the output directory"""
+
+        if self.output_dir is None:
+            return
+        system = self.simulation.system
+        np.savez(os.path.join(self.output_dir, f"snapshot_{self.simulation.steps:010d}.npz"),
+                 time=self.simulation.time, step=self.simulation.steps, names=np.array(system.names),
+                 masses=system.masses, positions=system.positions, velocities=system.velocities)
+
+    def stop_recording(self):
+        self.recorder.close()
+        print(f"Recording stopped after {self.recorder.frames} frames: the number of bodies changed (collisions)")
+        self.recorder = None
+
+    def run(self, steps: int = None, until_time: float = None) -> dict:
+        """Advance the simulation by a number of steps or until a simulated time
+
+        Args:
+            steps (int, optional): The number of steps to run. Defaults to None.
+            until_time (float, optional): The simulated time (s) to reach when steps is not provided. Defaults to None.
+
+        Returns:
+            dict: Summary of the run (steps, simulated time, wall time, steps per second and energy error when monitored)
+        """
+
+        simulation = self.simulation
+        if steps is None:
+            steps = int(np.ceil(max(0.0, until_time - simulation.time) / simulation.delta_t))
+
+        system = simulation.system
+        if self.recorder is not None and self.recorder.calls == 0: # The first frame is the starting state, resumed or not
+            self.recorder.record(simulation.time, system.positions, system.velocities)
+
+        start = time.perf_counter()
+        for _ in range(steps):
+            simulation.run()
+            if self.recorder is not None and self.recorder.bodies != len(system):
+                self.stop_recording() # Bodies were merged, the frames have a fixed size
+            if self.recorder is not None:
+                self.recorder.record(simulation.time, system.positions, system.velocities)
+            if self.checkpoint is not None:
+                self.checkpoint.update(simulation)
+            if self.snapshot_every and simulation.steps % self.snapshot_every == 0:
+                self.write_snapshot()
+        wall_time = time.perf_counter() - start
+        if self.recorder is not None:
+            self.recorder.flush()
+        if self.checkpoint is not None:
+            self.checkpoint.save(simulation)
+        if not self.snapshot_every or simulation.steps % self.snapshot_every != 0:
+            self.write_snapshot()
+
+        summary = {
+            "steps": steps, "bodies": len(simulation.system), "merged_bodies": simulation.merged_bodies, "simulated_time": simulation.time,
+            "wall_time": wall_time, "steps_per_second": steps / wall_time if wall_time > 0 else float("inf"),
+        }
+        if simulation.diagnostics is not None and simulation.diagnostics.count:
+            summary["energy_error"] = float(simulation.diagnostics.latest()["energy_error"])
+        return summary
+
+def parse_arguments(argv: list[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a celestial body simulation without a display")
+    parser.add_argument("--template", default="solar_system", help="Name of the template to load")
+    parser.add_argument("--templates-file", default="templates.json", help="Template file inside src/utils")
+    parser.add_argument("--method", default="RK4", help="Integration method (Euler, RK4, Leapfrog, Verlet, Yoshida4, DOPRI5, Block)")
+    parser.add_argument("--delta-t", type=float, default=DELTA_T, help="Time step (s)")
+    parser.add_argument("--solver", default=FORCE_SOLVER, help="Force solver (direct, barnes_hut)")
+    parser.add_argument("--theta", type=float, default=BARNES_HUT_THETA, help="Barnes-Hut opening angle")
+    parser.add_argument("--backend", default=COMPUTE_BACKEND, help="Direct-sum backend (auto, numba, numpy)")
+    parser.add_argument("--collisions", action="store_true", default=COLLISIONS, help="Merge the bodies that touch")
+    length = parser.add_mutually_exclusive_group(required=True)
+    length.add_argument("--steps", type=int, help="Number of steps to run")
+    length.add_argument("--time", type=float, help="Simulated time (s) to reach")
+    parser.add_argument("--output", default=None, help="Directory where the snapshots are written")
+    parser.add_argument("--snapshot-every", type=int, default=0, help="Steps between snapshots (0 writes only the final state)")
+    parser.add_argument("--record", default=None, help="Trajectory file (memory-mappable, replay with /replay)")
+    parser.add_argument("--record-every", type=int, default=1, help="Steps between two recorded frames")
+    parser.add_argument("--diagnostics", default=None,
+                        help="Conserved quantities file (.csv is appended on every sample, .npy is written at the end)")
+    parser.add_argument("--diagnostics-every", type=int, default=DIAGNOSTICS_INTERVAL, help="Steps between two diagnostics samples")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file, rewritten periodically and at the end")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="Steps between two checkpoints")
+    parser.add_argument("--checkpoint-seconds", type=float, default=0.0, help="Wall-clock seconds between two checkpoints")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue from the checkpoint when it exists (--steps then counts the steps already done)")
+    return parser.parse_args(argv)
+
+def main(argv: list[str] = None):
+    args = parse_arguments(argv)
+    checkpoint = AutoCheckpoint(args.checkpoint, args.checkpoint_every, args.checkpoint_seconds) if args.checkpoint else None
+    if args.resume and checkpoint is None:
+        raise SystemExit("--resume needs --checkpoint")
+    simulation = checkpoint.resume(args.backend) if args.resume else None
+    if simulation is None:
+        template_loader = TemplateLoader(args.templates_file, args.template)
+        simulation = Simulation(template_loader.get_template(args.template), args.delta_t, args.method,
+                                force_solver=args.solver, theta=args.theta, backend=args.backend, collisions=args.collisions)
+    else:
+        if args.record and os.path.exists(args.record):
+            # The recorder starts a new file, it would replace the trajectory of the runs before the checkpoint
+            raise SystemExit(f"--record {args.record} already exists, record the resumed run to another file")
+        print(f"Resumed from step {simulation.steps} ({simulation.time:.6g} s simulated)")
+    if args.diagnostics:
+        sink = args.diagnostics if args.diagnostics.endswith(".csv") else None
+        simulation.diagnostics = DiagnosticsMonitor(args.diagnostics_every, sink=sink)
+    recorder = TrajectoryRecorder(args.record, simulation.system, every=args.record_every) if args.record else None
+    runner = HeadlessRunner(simulation, args.output, args.snapshot_every, recorder, checkpoint)
+    steps = None if args.steps is None else max(0, args.steps - simulation.steps)
+    summary = runner.run(steps, args.time)
+    if recorder is not None:
+        recorder.close()
+    if simulation.diagnostics is not None:
+        if not args.diagnostics.endswith(".csv"):
+            simulation.diagnostics.save(args.diagnostics)
+        simulation.diagnostics.close()
+    print(f"{summary['steps']} steps of {summary['bodies']} bodies, {summary['simulated_time']:.6g} s simulated "
+          f"in {summary['wall_time']:.3f} s ({summary['steps_per_second']:.1f} steps/s)")
+    if summary["merged_bodies"]:
+        print(f"{summary['merged_bodies']} bodies merged by collisions")
+    if "energy_error" in summary:
+        print(f"Relative energy error: {summary['energy_error']:.3e}")
+
+if __name__ == "__main__":
+    main()
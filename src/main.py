@@ -1,4 +1,5 @@
 from ui.pygame_manager import PygameManager
 
-pygame_manager = PygameManager()
-pygame_manager.run()
\ No newline at end of file
+if __name__ == "__main__": # The chart workers are spawned and import this module again
+    pygame_manager = PygameManager()
+    pygame_manager.run()
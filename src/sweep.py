@@ -0,0 +1,4 @@
+from utils.sweep import main
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,19 @@
 import sys
+from typing import Optional
+import numpy as np
 import pygame
 
-from config import CENTER, DELTA_T, SCALE, SCREEN_SIZE, WORLD_SIZE, FUNCTIONS_MANAGER
+from config import CHECKPOINT_PATH, DELTA_T, SCREEN_SIZE, STEPS_PER_SECOND, TRAIL_LIMIT, TRAIL_STRIDE, WORLD_SIZE, FUNCTIONS_MANAGER
+from core.diagnostics import DiagnosticsMonitor
+from core.profiler import Profiler
+from core.recording import TrajectoryReader
 from core.simulation import Simulation
+from core.stepper import SimulationStepper
 from utils.template_loader import TemplateLoader
+from ui.renderer import TRAIL_POLYLINE_MAX_BODIES, TrailLayer, dirty_tiles, draw_points, draw_trail_pixels, draw_trail_polylines, \
+    on_screen, rect_tiles, tile_rects, world_to_screen
 from ui.ui_manager import UIManager
-from utils.visualization import Visualization
+from utils.visualization import ChartRenderer
 
 class PygameManager:
     """This classs handles the render and pygame interaction"""
@@ -14,8 +22,9 @@ class PygameManager:
         pygame.init()
         
         self.screen = pygame.display.set_mode((SCREEN_SIZE[0], SCREEN_SIZE[1]))
-        self.trail_surface = pygame.Surface((SCREEN_SIZE[0], SCREEN_SIZE[1]), pygame.SRCALPHA)  # Allow transparency
-        self.trail_surface.set_alpha(30)
+        self.trail_layer = TrailLayer((SCREEN_SIZE[0], SCREEN_SIZE[1]))
+        self.view = None # Zoom, camera and trail mode of the last frame
+        self.overlay = np.zeros(0, dtype=np.int64) # Tiles of the last frame drawn over the trails (bodies, UI, HUD)
         self.clock = pygame.time.Clock()
 
         funcs = FUNCTIONS_MANAGER(refresh_simulation=self.initialize_simulation, 
@@ -23,19 +32,42 @@ class PygameManager:
                                   change_method=self.change_method,
                                   toggle_trails=self.toggle_trails, clear_trails=self.clear_trails,
                                   generate_chart=self.generate_chart,
+                                  get_integrator_stats=self.get_integrator_stats,
+                                  change_force_solver=self.change_force_solver,
+                                  change_trails_stride=self.change_trails_stride,
+                                  change_speed=self.change_speed, toggle_pause=self.toggle_pause,
+                                  start_recording=self.start_recording, stop_recording=self.stop_recording,
+                                  start_replay=self.start_replay, stop_replay=self.stop_replay,
+                                  save_checkpoint=self.save_checkpoint, load_checkpoint=self.load_checkpoint,
+                                  toggle_perf=self.toggle_perf, export_perf=self.export_perf,
+                                  toggle_collisions=self.toggle_collisions,
                                   change_saved_trails_limit=self.change_saved_trails_limit)
         self.ui_manager = UIManager(funcs)
         self.template_loader = TemplateLoader("templates.json", "solar_system")
-        self.visualization = Visualization()
+        self.charts = ChartRenderer()
 
+        self.profiler = Profiler()
+        self.hud_font = None
+        self.stepper = None
+        self.replay: Optional[TrajectoryReader] = None
+        self.replay_frame = 0.0
+        self.replay_paused = False
+        self.stepper_paused = False
         self.initialize_simulation()
 
     def clear_trails(self):
-        for body in self.simulation.bodies:
-            body.trails_pos = []
+        with self.stepper.lock:
+            self.simulation.system.clear_trails()
     
     def initialize_simulation(self):
-        self.simulation = Simulation(self.template_loader.get_template(self.template_loader.template_name), DELTA_T)
+        self.stop_replay()
+        loader = self.template_loader
+        self.simulation = Simulation(loader.get_template(loader.template_name, loader.template_parameters), DELTA_T)
+        self.simulation.diagnostics = DiagnosticsMonitor()
+        if self.stepper is None:
+            self.stepper = SimulationStepper(self.simulation, profiler=self.profiler)
+        else:
+            self.stepper.set_simulation(self.simulation)
         
         # Initial variabels
         self.zoom = 1
@@ -44,23 +76,173 @@ class PygameManager:
         self.is_running = True
         self.is_trail_actived = True
         self.last_mouse_pos = None
-        self.trail_limit = 200
+        self.trail_limit = TRAIL_LIMIT
+        self.trail_stride = TRAIL_STRIDE
     
     def change_saved_trails_limit(self, num: int):
         self.trail_limit = num
+        with self.stepper.lock:
+            self.simulation.system.trails.resize(num)
+
+    def change_trails_stride(self, num: int):
+        self.trail_stride = num
+        with self.stepper.lock:
+            self.simulation.system.trails.stride = num
+
+    def change_speed(self, speed: float):
+        self.stepper.set_speed(speed)
+
+    def toggle_pause(self) -> bool:
+        if self.replay is not None:
+            self.replay_paused = not self.replay_paused
+            return self.replay_paused
+        return self.stepper.toggle_pause()
+
+    def start_recording(self, path: str):
+        self.stepper.start_recording(path)
+
+    def stop_recording(self) -> Optional[int]:
+        return self.stepper.stop_recording()
+
+    def toggle_collisions(self) -> bool:
+        with self.stepper.lock:
+            self.simulation.collisions = not self.simulation.collisions
+            return self.simulation.collisions
+
+    def toggle_perf(self) -> bool:
+        return self.profiler.toggle()
+
+    def export_perf(self, path: str) -> int:
+        """Write the recorded phases as a Chrome trace, returns the number of events"""
+
+        return self.profiler.export_trace(path)
+
+    def draw_perf_hud(self) -> pygame.Rect:
+        """Overlay the percentiles of every phase on the top left corner, returns the region drawn"""
+
+        if self.hud_font is None:
+            self.hud_font = pygame.font.Font(None, 18)
+        lines = [f"{self.clock.get_fps():5.1f} fps     p50     p95     p99 (ms)"]
+        for name, (p50, p95, p99) in sorted(self.profiler.percentiles().items()):
+            lines.append(f"{name:<12}{p50:8.2f}{p95:8.2f}{p99:8.2f}")
+        rects = [self.screen.blit(self.hud_font.render(line, True, (0, 255, 0), (0, 0, 0)), (5, 5 + 15 * row))
+                 for row, line in enumerate(lines)]
+        return rects[0].unionall(rects[1:])
+
+    def save_checkpoint(self, path: str = CHECKPOINT_PATH):
+        with self.stepper.lock:
+            self.simulation.save_checkpoint(path)
+
+    def load_checkpoint(self, path: str = CHECKPOINT_PATH):
+        """Continue the simulation saved in a checkpoint (its trails and settings included)"""
+
+        simulation = Simulation.load_checkpoint(path)
+        simulation.diagnostics = DiagnosticsMonitor()
+        self.stop_replay()
+        with self.stepper.lock:
+            self.simulation = simulation
+            self.stepper.set_simulation(simulation)
+        self.trail_limit = simulation.system.trails.limit
+        self.trail_stride = simulation.system.trails.stride
+
+    def start_replay(self, path: str) -> int:
+        """Replay a recording instead of the live simulation (which is paused meanwhile)
+
+        Args:
+            path (str): The trajectory file
+
+        Returns:
+            int: The number of recorded frames
+        """
+
+        replay = TrajectoryReader(path)
+        if len(replay) == 0:
+            raise Exception(f"Sorry, the recording '{path}' is empty")
+        if self.replay is None:
+            self.stepper_paused = self.stepper.paused
+            self.stepper.paused = True
+        self.replay = replay
+        self.replay_frame = 0.0
+        self.replay_paused = False
+        return len(replay)
+
+    def stop_replay(self):
+        if self.replay is not None:
+            self.replay = None
+            self.stepper.paused = self.stepper_paused
+
+    def seek_replay(self, frames: float):
+        """Move the replay by a number of frames (clamped to the recording)"""
+
+        self.replay_frame = min(max(self.replay_frame + frames, 0.0), len(self.replay) - 1.0)
+
+    def replay_state(self) -> tuple:
+        """Read the positions, colors and trails of the current replay frame from the memory-mapped recording
+
+        Returns:
+            tuple: The (N, 2) positions, the colors and the (N, K, 2) trails window
+        """
+
+        replay = self.replay
+        frame = int(self.replay_frame)
+        positions = np.array(replay.positions[frame])
+        if frame + 1 < len(replay): # Interpolate between the recorded frames
+            alpha = self.replay_frame - frame
+            positions += alpha * (replay.positions[frame + 1] - positions)
+        # Only the trail_limit frames that end at the current one are read (every trail_stride frames)
+        start = max(frame - (self.trail_limit - 1) * self.trail_stride, frame % self.trail_stride)
+        window = np.array(replay.positions[start:frame + 1:self.trail_stride])
+        return positions, replay.colors, window.transpose(1, 0, 2)
 
     def toggle_trails(self) -> bool:
         self.is_trail_actived = not self.is_trail_actived
         return self.is_trail_actived
 
-    def generate_chart(self, type: str):
-        if type == "trajectory" or type == "1":
-            self.visualization.plot_orbital_trajectories(self.simulation.bodies)
-        else:
-            self.visualization.plot_orbital_trajectories(self.simulation.bodies)
+    def chart_snapshot(self) -> dict:
+        """Copy what the charts need (the trails, their times and the diagnostics) while the stepper waits"""
+
+        with self.stepper.lock:
+            system, trails = self.simulation.system, self.simulation.system.trails
+            window = np.copy(trails.window())
+            # The newest sample was stored (calls - 1) % stride calls ago, the older ones every stride calls before it
+            offset = (trails.calls - 1) % trails.stride if trails.calls else 0
+            times = self.simulation.time - (offset + np.arange(trails.limit - 1, -1, -1) * trails.stride) * self.simulation.delta_t
+            return {"names": list(system.names), "colors": list(system.colors), "masses": np.copy(system.masses),
+                    "window": window, "counts": np.copy(trails.counts[:len(system)]), "times": times,
+                    "history": self.simulation.diagnostics.history()}
+
+    def generate_chart(self, type: str, output: str = "png") -> Optional[str]:
+        """Queue a chart, it is drawn by a worker process and reported by poll_charts
+
+        Args:
+            type (str): trajectory (1), energy (2), distance (3) or phase (4)
+            output (str, optional): png, svg or window. Defaults to "png".
+
+        Returns:
+            Optional[str]: The file that will be written (None for a window)
+        """
 
-    def load_template(self, template_name: str):
-        self.simulation.change_bodies(self.template_loader.get_template(template_name))
+        kind = {"1": "trajectory", "2": "energy", "3": "distance", "4": "phase"}.get(type, type)
+        snapshot = self.chart_snapshot()
+        if kind == "energy" and len(snapshot["history"]) < 2:
+            raise ValueError("Not enough energy samples yet, let the simulation run.")
+        return self.charts.submit(kind, snapshot, output)
+
+    def poll_charts(self):
+        for kind, path, error in self.charts.poll():
+            if error is not None:
+                self.ui_manager.set_feedback(f"Chart '{kind}' failed: {error}")
+            elif path is not None:
+                self.ui_manager.set_feedback(f"Chart saved to {path}")
+
+    def load_template(self, template_name: str, parameters: dict = None):
+        system = self.template_loader.get_template(template_name, parameters)
+        system.trails.resize(self.trail_limit)
+        system.trails.stride = self.trail_stride
+        self.stop_replay()
+        with self.stepper.lock:
+            self.simulation.change_bodies(system)
+            self.stepper.set_simulation(self.simulation)
         
         # Reset variable values
         self.zoom = 1
@@ -69,10 +251,25 @@ class PygameManager:
         self.last_mouse_pos = None
     
     def change_method(self, method_name: str):
-        self.simulation.integrator.choose_method(method_name)
+        with self.stepper.lock:
+            self.simulation.integrator.choose_method(method_name)
+
+    def change_force_solver(self, solver_name: str, theta: float):
+        with self.stepper.lock:
+            self.simulation.choose_force_solver(solver_name, theta)
+
+    def get_integrator_stats(self) -> tuple[str, int, int]:
+        with self.stepper.lock:
+            integrator = self.simulation.integrator
+            return integrator.method, integrator.accepted_steps, integrator.rejected_steps
 
     def draw(self):
-        """Draw Simulation elements on the pygame screen"""
+        """Draw Simulation elements on the pygame screen
+
+        The trails live on a persistent layer that only receives the samples recorded since the last frame. Unless the
+        view changed, only the regions that changed (the bodies before and after moving, the new trail segments, the UI
+        and the HUD) are composited again and sent to the display.
+        """
 
         # Center the camera in the world bounds
         half_screen_width = self.screen.get_width() / (2 * self.zoom)
@@ -80,30 +277,94 @@ class PygameManager:
         self.camera_pos[0] = max(-WORLD_SIZE[0] + half_screen_width, min(self.camera_pos[0], WORLD_SIZE[0] - half_screen_width))
         self.camera_pos[1] = max(-WORLD_SIZE[1] + half_screen_height, min(self.camera_pos[1], WORLD_SIZE[1] - half_screen_height))
 
-        self.screen.fill((0, 0, 0)) # Clear screen
-        self.trail_surface.fill((0, 0, 0)) # Clear screen
+        profiler = self.profiler
+        size = self.screen.get_size()
+        view = (self.zoom, tuple(self.camera_pos), self.is_trail_actived)
+        full = view != self.view or self.replay is not None
+        self.view = view
+        new = None
 
-        for body in self.simulation.bodies:
-            body.update_trail(self.trail_limit)
-            x = int((body.position[0] / SCALE - self.camera_pos[0])  * self.zoom + CENTER[0])
-            y = int((body.position[1] / SCALE - self.camera_pos[1])  * self.zoom + CENTER[1])
-            pygame.draw.circle(self.screen, body.color, (x, y), 8 * self.zoom)
+        with profiler.phase("snapshot"):
+            if self.replay is not None:
+                positions, colors, window = self.replay_state()
+                massive = len(positions)
+                trails, valid = list(window), np.ones(window.shape[:2], dtype=bool)
+                self.trail_layer.prepare(None, 0, 0) # The replay can jump anywhere, its trails are drawn again
+            else:
+                # Copy what is drawn while holding the lock, the stepper keeps running during the drawing
+                with self.stepper.lock:
+                    system = self.simulation.system
+                    positions = self.stepper.interpolated_positions()
+                    colors = list(system.colors[:len(positions)])
+                    massive = system.massive
+                    if self.is_trail_actived:
+                        buffer, polylines = system.trails, len(system) <= TRAIL_POLYLINE_MAX_BODIES
+                        new = self.trail_layer.prepare((view, id(buffer), buffer.version, polylines), buffer.samples, buffer.limit)
+                        if polylines and new != 0:
+                            # The new segments start at the last sample already drawn
+                            kept = buffer.limit if new is None else new + 1
+                            trails = [np.copy(buffer.trail(index)[-kept:]) for index in range(len(system))]
+                        elif new != 0:
+                            kept = buffer.limit if new is None else new
+                            window = np.copy(buffer.window()[:, buffer.limit - kept:])
+                            valid = buffer.valid_mask()[:, buffer.limit - kept:]
+        full = full or (self.is_trail_actived and new is None)
 
-            if self.is_trail_actived:
-                for trail_pos in body.trails_pos:
-                    trail_x = int((trail_pos[0] / SCALE - self.camera_pos[0]) * self.zoom + CENTER[0])
-                    trail_y = int((trail_pos[1] / SCALE - self.camera_pos[1]) * self.zoom + CENTER[1])
-                    pygame.draw.circle(self.trail_surface, body.color, (trail_x, trail_y), 2 * self.zoom)
+        with profiler.phase("draw_trails"):
+            changed = np.zeros(0, dtype=np.int64)
+            if self.is_trail_actived and new != 0:
+                if len(colors) <= TRAIL_POLYLINE_MAX_BODIES:
+                    rects = draw_trail_polylines(self.trail_layer.surface, trails, colors, self.camera_pos, self.zoom)
+                    changed = rect_tiles(rects, size)
+                else:
+                    pixels = draw_trail_pixels(self.trail_layer.surface, window, valid, np.array(colors, dtype=np.uint8),
+                                               self.camera_pos, self.zoom)
+                    changed = dirty_tiles(pixels, 0, size)
+
+        radius = 8 * self.zoom
+        screen_positions = world_to_screen(positions, self.camera_pos, self.zoom)
+        visible = np.flatnonzero(on_screen(screen_positions, size, radius))
+        overlay = np.union1d(dirty_tiles(screen_positions[visible], radius, size), rect_tiles(self.ui_manager.dirty_rects(), size))
+        if full:
+            dirty = [self.screen.get_rect()]
+        else:
+            # Where the bodies were, the new trail segments and where the bodies are, every tile once so the
+            # translucent trail layer is not blended twice
+            dirty = tile_rects(np.union1d(np.union1d(self.overlay, changed), overlay), size)
 
-        self.screen.blit(self.trail_surface, (0, 0))
+        with profiler.phase("draw_bodies"):
+            for rect in dirty:
+                self.screen.fill((0, 0, 0), rect) # Clear screen
+            for index in visible[visible < massive]:
+                pygame.draw.circle(self.screen, colors[index], screen_positions[index].astype(int), radius)
+            if massive < len(positions): # The test particles are points
+                draw_points(self.screen, screen_positions[massive:], np.array(colors[massive:], dtype=np.uint8))
+
+        with profiler.phase("blit_trails"):
+            if self.is_trail_actived:
+                for rect in dirty:
+                    self.screen.blit(self.trail_layer.surface, rect, rect)
 
-        self.ui_manager.draw(self.screen)
+        with profiler.phase("ui_draw"):
+            self.ui_manager.draw(self.screen)
+        if profiler.enabled:
+            hud = self.draw_perf_hud()
+            overlay = np.union1d(overlay, rect_tiles([hud], size))
+            dirty.append(hud)
+        self.overlay = overlay
 
-        pygame.display.flip()
+        with profiler.phase("flip"):
+            if full:
+                pygame.display.flip()
+            else:
+                pygame.display.update(dirty)
 
     def handle_mouse_events(self, event: pygame.Event):
         if event.type == pygame.QUIT:
             self.is_running = False
+            self.stepper.stop()
+            self.stepper.stop_recording()
+            self.charts.shutdown()
             sys.exit()
         elif event.type == pygame.MOUSEWHEEL: # Handle Zoom
             if(event.y > 0): # Zoom in
@@ -117,15 +378,27 @@ class PygameManager:
         elif event.type == pygame.MOUSEBUTTONUP: # Stop dragging
             if event.button == 1:
                 self.is_dragging = False
+        elif event.type == pygame.KEYDOWN and self.replay is not None and not self.ui_manager.input_active: # Scrub
+            step = max(1, len(self.replay) // 100)
+            if event.key == pygame.K_LEFT:
+                self.seek_replay(-step)
+            elif event.key == pygame.K_RIGHT:
+                self.seek_replay(step)
+            elif event.key == pygame.K_HOME:
+                self.seek_replay(-len(self.replay))
+            elif event.key == pygame.K_END:
+                self.seek_replay(len(self.replay))
     
     def run(self):
         """Main Render Loop"""
         self.is_running = True
+        self.stepper.start()
         while self.is_running:
             delta_time = self.clock.tick(60) / 1000.0
-            for event in pygame.event.get():
-                self.handle_mouse_events(event)
-                self.ui_manager.handle_event(event)
+            with self.profiler.phase("events"):
+                for event in pygame.event.get():
+                    self.handle_mouse_events(event)
+                    self.ui_manager.handle_event(event)
                 
             if self.is_dragging: # Handle panning
                 mouse_x, mouse_y = pygame.mouse.get_pos()
@@ -136,8 +409,17 @@ class PygameManager:
                     self.camera_pos[1] -= dy
                     self.last_mouse_pos = (mouse_x, mouse_y)
             
-            self.ui_manager.manager.update(delta_time)
-            self.simulation.run()  # Update simulation state
-            self.draw()
+            with self.profiler.phase("ui_update"):
+                self.ui_manager.update(delta_time)
+            self.poll_charts()
+            self.stepper.advance(delta_time)  # Update simulation state (no-op when it runs on its own thread)
+            if self.replay is not None and not self.replay_paused:
+                # Same pace as the live simulation when every step was recorded ("max" plays 100x)
+                self.seek_replay(delta_time * STEPS_PER_SECOND * (self.stepper.speed or 100))
+            with self.profiler.phase("draw"):
+                self.draw()
 
+        self.stepper.stop()
+        self.stepper.stop_recording()
+        self.charts.shutdown()
         pygame.quit()
@@ -0,0 +1,186 @@
+from typing import Optional, Sequence, Tuple
+import numpy as np
+from numpy import ndarray
+import pygame
+
+from config import CENTER, SCALE, TRAIL_OVERDRAW
+
+# Above this number of bodies the trails are written pixel by pixel instead of one polyline per body
+TRAIL_POLYLINE_MAX_BODIES = 256
+# Side (pixels) of the tiles sent to the display when the bodies or trail points moved
+DIRTY_TILE = 64
+
+def world_to_screen(positions: ndarray, camera_pos: Sequence[float], zoom: float) -> ndarray:
+    """Convert world positions (m) of any shape (..., 2) to screen pixels in one array operation"""
+
+    return (positions / SCALE - np.asarray(camera_pos, dtype=np.float64)) * zoom + CENTER
+
+def on_screen(points: ndarray, size: Tuple[int, int], margin: float = 0) -> ndarray:
+    """Return the mask of the screen points that fall inside the surface (extended by margin pixels)"""
+
+    return (points[..., 0] >= -margin) & (points[..., 0] < size[0] + margin) \
+        & (points[..., 1] >= -margin) & (points[..., 1] < size[1] + margin)
+
+def collapse_polyline(points: ndarray, size: Tuple[int, int]) -> list[ndarray]:
+    """Prepare a trail to be drawn as polylines: round to pixels, drop consecutive points on the same pixel and
+    cut the parts that are off screen (the points next to the border are kept so the segments still cross it)
+
+    Args:
+        points (ndarray): The (K, 2) screen points from the oldest to the newest
+        size (Tuple[int, int]): The surface size
+
+    Returns:
+        list[ndarray]: The (M, 2) integer runs that must be drawn
+    """
+
+    pixels = np.rint(points).astype(np.int64)
+    if len(pixels) == 0:
+        return []
+    changed = np.ones(len(pixels), dtype=bool)
+    changed[1:] = np.any(pixels[1:] != pixels[:-1], axis=1)
+    pixels = pixels[changed]
+
+    visible = on_screen(pixels, size)
+    keep = visible.copy()
+    keep[1:] |= visible[:-1]
+    keep[:-1] |= visible[1:]
+    if not keep.any():
+        return []
+
+    # Split the polyline wherever points were removed
+    indices = np.flatnonzero(keep)
+    breaks = np.flatnonzero(np.diff(indices) > 1) + 1
+    return [pixels[run] for run in np.split(indices, breaks)]
+
+def draw_trail_polylines(surface: pygame.Surface, trails: list[ndarray], colors: list, camera_pos: Sequence[float],
+                         zoom: float) -> list[pygame.Rect]:
+    """Draw every trail as polylines, one pygame call per visible run, returns the rectangles that were drawn"""
+
+    size = surface.get_size()
+    width = max(1, int(round(2 * zoom)))
+    rects = []
+    for trail, color in zip(trails, colors):
+        for run in collapse_polyline(world_to_screen(trail, camera_pos, zoom), size):
+            if len(run) == 1:
+                surface.set_at(tuple(run[0]), color)
+                rects.append(pygame.Rect(tuple(run[0]), (1, 1)))
+            else:
+                rects.append(pygame.draw.lines(surface, color, False, run, width))
+    return rects
+
+def draw_trail_pixels(surface: pygame.Surface, window: ndarray, valid: ndarray, colors: ndarray,
+                      camera_pos: Sequence[float], zoom: float) -> ndarray:
+    """Write every trail point of every body straight into the surface pixels (for very large systems)
+
+    Args:
+        surface (pygame.Surface): The surface with per-pixel alpha
+        window (ndarray): The (N, limit, 2) ordered trails
+        valid (ndarray): The (N, limit) mask of the valid samples
+        colors (ndarray): The (N, 3) colors of the bodies
+        camera_pos (Sequence[float]): The camera position
+        zoom (float): The zoom
+
+    Returns:
+        ndarray: The (M, 2) pixels that were written
+    """
+
+    size = surface.get_size()
+    points = world_to_screen(window, camera_pos, zoom)
+    mask = valid & on_screen(points, size)
+    pixels = points[mask].astype(np.int64)
+    body = np.broadcast_to(np.arange(window.shape[0])[:, np.newaxis], mask.shape)[mask]
+
+    # Keep one point per pixel (the newest body index wins, like the drawing order)
+    linear = pixels[:, 0] * size[1] + pixels[:, 1]
+    linear, first = np.unique(linear[::-1], return_index=True)
+    body = body[::-1][first]
+
+    rgb = pygame.surfarray.pixels3d(surface)
+    alpha = pygame.surfarray.pixels_alpha(surface)
+    x, y = np.divmod(linear, size[1])
+    rgb[x, y] = colors[body]
+    alpha[x, y] = 255
+    del rgb, alpha # Unlock the surface
+    return np.column_stack((x, y))
+
+def draw_points(surface: pygame.Surface, points: ndarray, colors: ndarray):
+    """Write one pixel per point (the test particles) straight into the surface
+
+    Args:
+        surface (pygame.Surface): The surface
+        points (ndarray): The (M, 2) screen points
+        colors (ndarray): The (M, 3) colors
+    """
+
+    visible = on_screen(points, surface.get_size())
+    pixels = points[visible].astype(np.int64)
+    rgb = pygame.surfarray.pixels3d(surface)
+    rgb[pixels[:, 0], pixels[:, 1]] = colors[visible]
+    del rgb # Unlock the surface
+
+def dirty_tiles(points: ndarray, margin: float, size: Tuple[int, int]) -> ndarray:
+    """Return the ids of the DIRTY_TILE tiles touched by the squares of half side margin around the screen points"""
+
+    columns, rows = -(-size[0] // DIRTY_TILE), -(-size[1] // DIRTY_TILE)
+    # Corners (and points in between when the margin is larger than a tile) of every square
+    offsets = np.linspace(-margin, margin, 2 + int(2 * margin // DIRTY_TILE))
+    corners = points[:, np.newaxis, np.newaxis, :] + np.stack(np.meshgrid(offsets, offsets), axis=-1)
+    tiles = np.clip(np.floor(corners / DIRTY_TILE).astype(np.int64), 0, [columns - 1, rows - 1])
+    return np.unique(tiles[..., 0] * rows + tiles[..., 1])
+
+def rect_tiles(rects: list[pygame.Rect], size: Tuple[int, int]) -> ndarray:
+    """Return the ids of the DIRTY_TILE tiles covered by the rectangles"""
+
+    rows = -(-size[1] // DIRTY_TILE)
+    tiles = [np.add.outer(np.arange(rect.left // DIRTY_TILE, (rect.right - 1) // DIRTY_TILE + 1) * rows,
+                          np.arange(rect.top // DIRTY_TILE, (rect.bottom - 1) // DIRTY_TILE + 1)).ravel()
+             for rect in (rect.clip(pygame.Rect((0, 0), size)) for rect in rects) if rect.width and rect.height]
+    return np.unique(np.concatenate(tiles)) if tiles else np.zeros(0, dtype=np.int64)
+
+def tile_rects(tiles: ndarray, size: Tuple[int, int]) -> list[pygame.Rect]:
+    rows = -(-size[1] // DIRTY_TILE)
+    screen = pygame.Rect((0, 0), size)
+    return [pygame.Rect(int(tile // rows) * DIRTY_TILE, int(tile % rows) * DIRTY_TILE, DIRTY_TILE, DIRTY_TILE).clip(screen)
+            for tile in tiles]
+
+class TrailLayer:
+    """Persistent surface with the trails drawn so far, a frame only draws the samples recorded since the last one.
+
+    The layer is rebuilt from the whole trail buffer when the view or the trail buffer changes (see prepare) and
+    every TRAIL_OVERDRAW * limit appended samples: the samples that left the buffer stay drawn until then, so the
+    trails are up to that fraction longer than the limit. The cost of a frame grows with the bodies instead of the
+    bodies times the trail length.
+    """
+
+    def __init__(self, size: Tuple[int, int]):
+        self.surface = pygame.Surface(size, pygame.SRCALPHA)  # Allow transparency
+        self.surface.set_alpha(30)
+        self.key = None
+        self.samples = 0 # TrailBuffer.samples already drawn
+        self.appended = 0 # Samples appended since the last rebuild
+
+    def invalidate(self):
+        self.key = None
+
+    def prepare(self, key: Optional[tuple], samples: int, limit: int) -> Optional[int]:
+        """Check what must be drawn on the layer, clears it when it has to be rebuilt
+
+        Args:
+            key (Optional[tuple]): The view and trail buffer the samples belong to (zoom, camera, TrailBuffer.version, ...),
+                None always rebuilds
+            samples (int): The samples recorded by the trail buffer so far (TrailBuffer.samples)
+            limit (int): The trail limit
+
+        Returns:
+            Optional[int]: The number of newest samples per body to append, None when every trail must be drawn again
+        """
+
+        new = samples - self.samples
+        rebuild = key is None or key != self.key or new < 0 or self.appended + new > TRAIL_OVERDRAW * limit
+        self.key, self.samples = key, samples
+        if rebuild:
+            self.surface.fill((0, 0, 0))
+            self.appended = 0
+            return None
+        self.appended += new
+        return new
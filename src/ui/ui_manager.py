@@ -2,8 +2,8 @@ import os
 import time
 from typing import List
 import pygame
-import pygame_gui
-from config import SCREEN_SIZE, FUNCTIONS_MANAGER
+from config import BARNES_HUT_THETA, CHECKPOINT_PATH, SCREEN_SIZE, FUNCTIONS_MANAGER
+from utils.generators import GENERATORS, parse_parameters
 
 class UIManager:
     """This class handles all UI interaction"""
@@ -12,20 +12,9 @@ class UIManager:
         """Initialize the UI Manager"""
 
         self.funcs = funcs
-        theme_path = os.path.join(os.path.dirname(__file__), "theme.json")
-        self.manager = pygame_gui.UIManager((SCREEN_SIZE[0], SCREEN_SIZE[1]), theme_path)
-        self.text_entry = pygame_gui.elements.UITextEntryLine(
-            relative_rect=pygame.Rect((0, SCREEN_SIZE[0] - 30), (SCREEN_SIZE[1], 30)), manager=self.manager)
-        self.text_entry.set_text("")
-        self.text_entry.hide()
-
-        self.feedback_box = pygame_gui.elements.ui_text_box.UITextBox(
-            html_text="",
-            relative_rect=pygame.Rect((0, SCREEN_SIZE[0] - 150), (SCREEN_SIZE[1], 150)),
-            manager=self.manager,
-            object_id='#text_box',
-            visible = 0
-        )
+        self.manager = None # Built by build() the first time the UI is shown
+        self.text_entry = None
+        self.feedback_box = None
 
         self.input_active = False
         self.feedback_timer = None
@@ -41,8 +30,18 @@ class UIManager:
             "method": self.change_method,
             "toggle_trails": self.toggle_trails,
             "change_trails_limit": self.change_saved_trails_limit,
+            "change_trails_stride": self.change_trails_stride,
             "generate_chart": self.generate_chart,
             "clear_trails": self.clear_trails,
+            "stats": self.show_integrator_stats,
+            "solver": self.change_force_solver,
+            "speed": self.change_speed,
+            "pause": self.toggle_pause,
+            "record": self.record,
+            "replay": self.replay,
+            "checkpoint": self.checkpoint,
+            "perf": self.perf,
+            "collisions": self.toggle_collisions,
             "help": self.show_help,
         }
     
@@ -66,16 +65,32 @@ class UIManager:
         else:
             self.set_feedback("Please specify a limit. Usage: /change_trails_limit [limit]")
 
+    def change_trails_stride(self, args: List[str]):
+        if args:
+            try:
+                stride = int(args[0])
+                if 1 <= stride <= 100:
+                    self.funcs.change_trails_stride(stride)
+                    self.set_feedback(f"Trails stride set to {stride}.")
+                else:
+                    self.set_feedback("Stride must be between 1 and 100.")
+            except ValueError:
+                self.set_feedback("Invalid input. Please provide a valid number.")
+        else:
+            self.set_feedback("Please specify a stride. Usage: /change_trails_stride [frames]")
+
     def generate_chart(self, args: List[str]):
         if args:
             try:
                 chart_type = args[0]
-                self.funcs.generate_chart(chart_type)
-                self.set_feedback(f"Chart '{chart_type}' generated.")
+                path = self.funcs.generate_chart(chart_type, args[1] if len(args) > 1 else "png")
+                self.set_feedback(f"Rendering chart '{chart_type}' " + (f"to {path}..." if path else "in a window..."))
+            except ValueError as error:
+                self.set_feedback(str(error))
             except Exception:
                 self.set_feedback(f"Chart '{chart_type}' not exist.")
         else:
-            self.set_feedback("Please specify a chart type. Usage: /generate_chart [chart_type]")
+            self.set_feedback("Please specify a chart type. Usage: /generate_chart [chart_type] [png|svg|window]")
 
     def change_method(self, args: List[str]):
         if args:
@@ -88,6 +103,101 @@ class UIManager:
         else:
             self.set_feedback("Please specify a method name. Usage: /method [method_name]")
 
+    def change_force_solver(self, args: List[str]):
+        if args:
+            solver_name = args[0]
+            try:
+                theta = float(args[1]) if len(args) > 1 else BARNES_HUT_THETA
+                self.funcs.change_force_solver(solver_name, theta)
+                self.set_feedback(f"Force solver changed to '{solver_name}'.")
+            except ValueError:
+                self.set_feedback("Invalid input. Please provide a valid theta.")
+            except Exception:
+                self.set_feedback(f"Force solver '{solver_name}' not exist.")
+        else:
+            self.set_feedback("Please specify a solver name. Usage: /solver [direct|barnes_hut] [theta]")
+
+    def change_speed(self, args: List[str]):
+        if args:
+            try:
+                speed = None if args[0] == "max" else float(args[0])
+                if speed is None or 0 < speed <= 1000:
+                    self.funcs.change_speed(speed)
+                    self.set_feedback(f"Speed set to {args[0]}.")
+                else:
+                    self.set_feedback("Speed must be between 0 and 1000 (or max).")
+            except ValueError:
+                self.set_feedback("Invalid input. Please provide a valid number or max.")
+        else:
+            self.set_feedback("Please specify a speed. Usage: /speed [multiplier|max]")
+
+    def toggle_pause(self, _):
+        self.set_feedback(f"Simulation {'paused' if self.funcs.toggle_pause() else 'resumed'}!")
+
+    def record(self, args: List[str]):
+        if args and args[0] == "stop":
+            frames = self.funcs.stop_recording()
+            self.set_feedback("No recording in progress." if frames is None else f"Recording stopped ({frames} frames).")
+            return
+        path = args[0] if args else "recording.traj"
+        try:
+            self.funcs.start_recording(path)
+            self.set_feedback(f"Recording to '{path}'.")
+        except OSError:
+            self.set_feedback(f"Could not write '{path}'.")
+
+    def replay(self, args: List[str]):
+        if args and args[0] == "stop":
+            self.funcs.stop_replay()
+            self.set_feedback("Replay stopped, back to the simulation.")
+            return
+        path = args[0] if args else "recording.traj"
+        try:
+            frames = self.funcs.start_replay(path)
+            self.set_feedback(f"Replaying '{path}' ({frames} frames). Use LEFT/RIGHT to scrub.")
+        except OSError:
+            self.set_feedback(f"Recording '{path}' not exist.")
+        except Exception:
+            self.set_feedback(f"'{path}' is not a valid recording.")
+
+    def checkpoint(self, args: List[str]):
+        if not args or args[0] not in ("save", "load"):
+            self.set_feedback("Please specify an action. Usage: /checkpoint [save|load] [file]")
+            return
+        path = args[1] if len(args) > 1 else CHECKPOINT_PATH
+        try:
+            if args[0] == "save":
+                self.funcs.save_checkpoint(path)
+                self.set_feedback(f"Checkpoint saved to '{path}'.")
+            else:
+                self.funcs.load_checkpoint(path)
+                self.set_feedback(f"Checkpoint '{path}' loaded.")
+        except OSError:
+            self.set_feedback(f"Could not {args[0]} '{path}'.")
+        except Exception:
+            self.set_feedback(f"'{path}' is not a valid checkpoint.")
+
+    def toggle_collisions(self, _):
+        self.set_feedback(f"Collisions is {'actived' if self.funcs.toggle_collisions() else 'desactived'}!")
+
+    def perf(self, args: List[str]):
+        if args and args[0] == "export":
+            path = args[1] if len(args) > 1 else "trace.json"
+            try:
+                events = self.funcs.export_perf(path)
+                self.set_feedback(f"{events} events exported to '{path}' (chrome://tracing or speedscope).")
+            except OSError:
+                self.set_feedback(f"Could not write '{path}'.")
+            return
+        self.set_feedback(f"Performance overlay {'actived' if self.funcs.toggle_perf() else 'desactived'}!")
+
+    def show_integrator_stats(self, _):
+        method, accepted, rejected = self.funcs.get_integrator_stats()
+        if method in ("Block", "Hermite"):
+            self.set_feedback(f"Method '{method}': {accepted} body steps (forces evaluated for the active bodies only).")
+            return
+        self.set_feedback(f"Method '{method}': {accepted} accepted / {rejected} rejected adaptive steps.")
+
     def restart_simulation(self, _):        
         self.funcs.refresh_simulation()
         self.set_feedback("Simulation restarted!")
@@ -96,12 +206,15 @@ class UIManager:
     def set_feedback(self, message: str, duration: int = 5):
         """Set the feedback message and display it for a specified duration."""
 
+        self.build()
         self.feedback_box.set_text(message)
         self.feedback_box.show()
         self.feedback_timer = time.time() + duration
 
     def clear_feedback(self):
         """Clear and Hide the feedback box"""
+        if self.manager is None:
+            return
         self.feedback_box.hide()
         self.feedback_box.set_text("")
         self.feedback_timer = None
@@ -109,6 +222,7 @@ class UIManager:
     def toggle_text_input(self):
         """Toggles the visibility of the text input box"""
 
+        self.build()
         self.input_active = not self.input_active
         if self.input_active:
             self.text_entry.show()
@@ -136,40 +250,96 @@ class UIManager:
     
     def change_template(self, args: List[str]):
         if args:
+            template_name = self.templates_number.get(args[0]) or args[0]
             try:
-                template_name = self.templates_number.get(args[0]) or args[0]
-                self.funcs.load_template(template_name)
+                if template_name in GENERATORS:
+                    parameters = parse_parameters(template_name, dict(arg.partition("=")[::2] for arg in args[1:]))
+                    self.funcs.load_template(template_name, parameters)
+                else:
+                    self.funcs.load_template(template_name)
                 self.set_feedback(f"Template changed to '{template_name}'.")
-            except TypeError:
-                self.set_feedback(f"Template '{template_name}' not exist.")
+            except ValueError:
+                self.set_feedback("Invalid input. Parameters must be numbers, e.g. count=20000 seed=3")
+            except Exception as error:
+                self.set_feedback(str(error))
         else:
-            self.set_feedback("Please specify a template name. Usage: /template [template_name]")
+            self.set_feedback("Please specify a template name. Usage: /template [template_name] [parameter=value ...]")
 
     def show_help(self, _):
         """Displays all available commands."""
 
         self.set_feedback(
             "Available commands:\n"
-            "/template [name] - Change template\n"
-            "/method [name] - Change integration method(Euler, RK4)\n"
+            "/template [name|file.csv|file.npy|file.npz] - Change template or load a body list\n"
+            "/template [generator] [parameter=value ...] - Generate asteroid_belt, protoplanetary_disk, plummer_cluster\n"
+            "    or galaxy_collision (count=10000 seed=0 ...)\n"
+            "/method [name] - Change integration method(Euler, RK4, Leapfrog, Verlet, Yoshida4, DOPRI5, Block)\n"
+            "/stats - Show the accepted/rejected steps of the adaptive method (body steps of Block)\n"
+            "/solver [name] [theta] - Change force solver(direct, barnes_hut)\n"
+            "/speed [multiplier|max] - Change the simulation steps per second\n"
+            "/pause - Pause or resume the simulation\n"
+            "/record [file|stop] - Record the trajectories to a file\n"
+            "/replay [file|stop] - Replay a recording (LEFT/RIGHT/HOME/END to scrub)\n"
+            "/checkpoint [save|load] [file] - Save or continue the complete simulation state\n"
+            "/perf [export file] - Toggle the timings overlay or export them as a Chrome trace\n"
             "/toggle_trails - Enable or Disable trail visualization\n"
+            "/collisions - Enable or Disable merging the bodies that touch\n"
             "/restart - restart the current template\n"
-            "/positions_size [number] - Change The limit of positions to save\n"
-            "/generate_chart [name] - Generate a graph with the lasts positions\n"
+            "/change_trails_limit [number] - Change The limit of positions to save\n"
+            "/change_trails_stride [number] - Save one position every [number] frames\n"
+            "/generate_chart [trajectory|energy|distance|phase] [png|svg|window] - Chart the trails, the energy/momentum\n"
+            "    drift, the distances or the phase plot (saved to charts/ without blocking the simulation)\n"
             "/help - Show commands list"
         )
     
+    def build(self):
+        """Create the pygame_gui manager, theme and widgets. Nothing is visible until the first command or feedback,
+        so importing pygame_gui and loading the theme is left out of the startup."""
+
+        if self.manager is not None:
+            return
+        import pygame_gui
+
+        theme_path = os.path.join(os.path.dirname(__file__), "theme.json")
+        self.manager = pygame_gui.UIManager((SCREEN_SIZE[0], SCREEN_SIZE[1]), theme_path)
+        self.text_entry = pygame_gui.elements.UITextEntryLine(
+            relative_rect=pygame.Rect((0, SCREEN_SIZE[0] - 30), (SCREEN_SIZE[1], 30)), manager=self.manager)
+        self.text_entry.set_text("")
+        self.text_entry.hide()
+
+        self.feedback_box = pygame_gui.elements.ui_text_box.UITextBox(
+            html_text="",
+            relative_rect=pygame.Rect((0, SCREEN_SIZE[0] - 150), (SCREEN_SIZE[1], 150)),
+            manager=self.manager,
+            object_id='#text_box',
+            visible = 0
+        )
+
+    def update(self, delta_time: float):
+        if self.manager is not None:
+            self.manager.update(delta_time)
+
     def draw(self, screen: pygame.Surface):
         """Draws the UI elements onto the given screen surface."""
 
+        if self.manager is None:
+            return
         if self.feedback_timer and time.time() > self.feedback_timer:
             self.clear_feedback()
         self.manager.draw_ui(screen)
     
+    def dirty_rects(self) -> list[pygame.Rect]:
+        """The regions drawn by draw (the widgets, shown or hidden)"""
+
+        if self.manager is None:
+            return []
+        return [self.text_entry.rect, self.feedback_box.rect]
+
     def handle_event(self, event: pygame.Event):
         """Processes UI inputs events."""
 
-        self.manager.process_events(event)
+        if self.manager is not None:
+            self.manager.process_events(event)
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_RETURN:
                 if self.input_active:
@@ -0,0 +1,254 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Optional
+import numpy as np
+
+from core.body_system import BodySystem
+from core.simulation import Simulation
+from utils.generators import GENERATORS, generate
+from utils.template_loader import TemplateLoader
+
+BENCHMARK_SCENARIOS = ("disk", "plummer", "solar_system")
+# Short names of the generators used by the benchmark (every generator name is accepted too)
+BENCHMARK_GENERATORS = {"disk": "protoplanetary_disk", "plummer": "plummer_cluster"}
+# Code run in a fresh interpreter by the startup report, "interactive" is the time to the first frame of src/main.py
+STARTUP_TARGETS = {
+    "core": "import core.simulation, core.stepper",
+    "headless": "import headless",
+    "interactive": "from ui.pygame_manager import PygameManager; PygameManager().draw()",
+}
+# Modules that must only be imported when they are used
+HEAVY_MODULES = ("numba", "matplotlib", "pygame", "pygame_gui")
+
+def build_scenario(scenario: str, count: int, seed: int = 0) -> BodySystem:
+    """Build a benchmark system, the generated ones have about count bodies, the templates keep their own"""
+
+    name = BENCHMARK_GENERATORS.get(scenario, scenario)
+    if name in GENERATORS:
+        return generate(name, {"count": count, "seed": seed})
+    return TemplateLoader("templates.json", scenario).get_template(scenario)
+
+def measure(function: Callable[[], None], min_time: float) -> tuple[float, float]:
+    """Call function until min_time seconds passed (at least twice, the first call is a warm up)
+
+    Returns:
+        tuple[float, float]: The mean seconds per call and the peak memory (bytes) allocated during the warm up
+    """
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls, start = 0, time.perf_counter()
+    while calls == 0 or time.perf_counter() - start < min_time:
+        function()
+        calls += 1
+    return (time.perf_counter() - start) / calls, peak
+
+def benchmark_forces(system: BodySystem, solver: str, backend: str, min_time: float) -> dict:
+    """Time one evaluation of Simulation.f (the force solver), the cost per pair for the direct sum and per body for
+    the O(N log N) Barnes-Hut solver"""
+
+    simulation = Simulation(system, force_solver=solver, backend=backend)
+    seconds, peak = measure(lambda: simulation.f(0.0, system.positions, system.velocities), min_time)
+    if solver == "direct":
+        cost = {"ns_per_pair": seconds / max(1, len(system) * (len(system) - 1)) * 1e9}
+    else:
+        cost = {"ns_per_body": seconds / max(1, len(system)) * 1e9}
+    return {"seconds_per_call": seconds, **cost, "peak_memory": peak, "backend": simulation.backend}
+
+def benchmark_steps(system: BodySystem, solver: str, backend: str, method: str, delta_t: float, min_time: float) -> dict:
+    """Time Simulation.run (the integrator step) on a copy of the system"""
+
+    copy = BodySystem(len(system), trail_limit=1)
+    copy.add_arrays(system.positions, system.velocities, system.masses, list(system.names), list(system.colors), system.radii)
+    simulation = Simulation(copy, delta_t, method, force_solver=solver, backend=backend)
+    seconds, peak = measure(simulation.run, min_time)
+    return {"steps_per_second": 1 / seconds, "peak_memory": peak, "backend": simulation.backend}
+
+def benchmark_render(systems: list[BodySystem], trail_limits: list[int], min_time: float) -> list[dict]:
+    """Time PygameManager.draw with full trails on the dummy SDL video driver: frame_time records one new trail sample
+    per frame (the trail layer only draws it), rebuild_time draws every trail again"""
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    from ui.pygame_manager import PygameManager # pygame is only imported by the render benchmark
+
+    manager = PygameManager()
+    manager.stepper.paused = True
+    results = []
+    for system in systems:
+        for limit in trail_limits:
+            system.trails.resize(limit)
+            # Fill the trails with a slow rotation so every sample lands on a different pixel
+            positions = system.positions.copy()
+            for sample in range(limit):
+                angle = 0.5 * sample / limit
+                system.trails.record(positions @ np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]]))
+            with manager.stepper.lock:
+                manager.simulation.change_bodies(system)
+                manager.stepper.set_simulation(manager.simulation)
+            manager.zoom = 0.2 # Everything on screen
+            rotation = np.array([[np.cos(0.5 / limit), np.sin(0.5 / limit)], [-np.sin(0.5 / limit), np.cos(0.5 / limit)]])
+
+            def frame():
+                positions[:] = positions @ rotation
+                system.trails.record(positions)
+                manager.draw()
+
+            def rebuild():
+                manager.trail_layer.invalidate()
+                manager.draw()
+
+            seconds, _ = measure(frame, min_time)
+            rebuild_seconds, _ = measure(rebuild, min_time)
+            results.append({"kind": "render", "bodies": len(system), "trail_limit": limit, "frame_time": seconds,
+                            "rebuild_time": rebuild_seconds})
+    return results
+
+def benchmark_startup(target: str, code: str) -> dict:
+    """Run code in a fresh interpreter with -X importtime (dummy SDL drivers)
+
+    Returns:
+        dict: The wall time of the process, the import time (s) by top-level package and the heavy modules loaded
+    """
+
+    script = f"{code}\nimport json, sys\nprint(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))"
+    environment = dict(os.environ, SDL_VIDEODRIVER="dummy", SDL_AUDIODRIVER="dummy", PYGAME_HIDE_SUPPORT_PROMPT="1")
+    start = time.perf_counter()
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(__file__)), env=environment)
+    wall_time = time.perf_counter() - start
+
+    packages = {}
+    for line in process.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        package = fields[2].strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(fields[0]) * 1e-6 # Self time, so nothing is counted twice
+    return {"kind": "startup", "target": target, "wall_time": wall_time, "import_time": sum(packages.values()),
+            "packages": dict(sorted(packages.items(), key=lambda item: -item[1])[:10]),
+            "heavy_modules": json.loads(process.stdout.strip().splitlines()[-1])}
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(__file__)).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def result_key(result: dict) -> str:
+    return json.dumps({key: value for key, value in result.items() if isinstance(value, str) or key in ("bodies", "trail_limit")},
+                      sort_keys=True)
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2) -> list[str]:
+    """List the results that got slower than the baseline by more than tolerance (0.2 = 20%)"""
+
+    previous = {result_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        old = previous.get(result_key(result))
+        if old is None:
+            continue
+        for metric, higher_is_better in (("steps_per_second", True), ("seconds_per_call", False), ("frame_time", False),
+                                         ("rebuild_time", False), ("wall_time", False)):
+            if metric not in result or metric not in old:
+                continue
+            ratio = result[metric] / old[metric] if higher_is_better else old[metric] / result[metric]
+            if ratio < 1 - tolerance:
+                regressions.append(f"{result_key(result)} {metric}: {old[metric]:.4g} -> {result[metric]:.4g}")
+    return regressions
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    results = []
+    for scenario in args.scenarios:
+        sizes = args.sizes if BENCHMARK_GENERATORS.get(scenario, scenario) in GENERATORS else [None]
+        for size in sizes:
+            system = build_scenario(scenario, size or 0, args.seed)
+            count = len(system)
+            for solver in args.solvers:
+                if solver == "direct" and count > args.max_direct_bodies:
+                    continue
+                entry = {"scenario": scenario, "bodies": count, "solver": solver}
+                forces = benchmark_forces(system, solver, args.backend, args.min_time)
+                results.append({"kind": "forces", **entry, **forces})
+                cost = f"{forces['ns_per_pair']:.2f} ns/pair" if "ns_per_pair" in forces else f"{forces['ns_per_body']:.1f} ns/body"
+                print(f"forces {scenario} N={count} {solver}: {forces['seconds_per_call'] * 1e3:.3f} ms ({cost})", file=sys.stderr)
+                if count > args.max_step_bodies:
+                    continue
+                for method in args.methods:
+                    steps = benchmark_steps(system, solver, args.backend, method, args.delta_t, args.min_time)
+                    results.append({"kind": "steps", **entry, "method": method, **steps})
+                    print(f"steps {scenario} N={count} {solver} {method}: {steps['steps_per_second']:.1f} steps/s",
+                          file=sys.stderr)
+
+    if args.render_bodies and args.trail_limits:
+        systems = [build_scenario("disk", count, args.seed) for count in args.render_bodies]
+        for result in benchmark_render(systems, args.trail_limits, args.min_time):
+            results.append(result)
+            print(f"render N={result['bodies']} trail limit {result['trail_limit']}: {result['frame_time'] * 1e3:.2f} ms "
+                  f"(rebuild {result['rebuild_time'] * 1e3:.2f} ms)", file=sys.stderr)
+
+    for target in args.startup_targets:
+        if target not in STARTUP_TARGETS:
+            raise Exception(f"Sorry, the startup target '{target}' not exist")
+        result = benchmark_startup(target, STARTUP_TARGETS[target])
+        results.append(result)
+        breakdown = ", ".join(f"{package} {seconds * 1e3:.0f}" for package, seconds in list(result["packages"].items())[:5])
+        print(f"startup {target}: {result['wall_time'] * 1e3:.0f} ms, imports {result['import_time'] * 1e3:.0f} ms ({breakdown}), "
+              f"heavy modules: {', '.join(result['heavy_modules']) or 'none'}", file=sys.stderr)
+
+    return {
+        "commit": git_commit(), "python": platform.python_version(), "numpy": np.__version__,
+        "platform": platform.platform(), "processor": platform.processor(), "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+def parse_list(cast: Callable) -> Callable[[str], list]:
+    return lambda text: [cast(float(value)) if cast is int else cast(value) for value in text.split(",") if value]
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the force solvers, integrators and renderer")
+    parser.add_argument("--scenarios", type=parse_list(str), default=list(BENCHMARK_SCENARIOS),
+                        help="Comma separated scenarios (disk, plummer, a generator or a template name)")
+    parser.add_argument("--sizes", type=parse_list(int), default=[10, 100, 1000, 10000, 100000],
+                        help="Comma separated number of bodies of the generated scenarios")
+    parser.add_argument("--solvers", type=parse_list(str), default=["direct", "barnes_hut"], help="Comma separated force solvers")
+    parser.add_argument("--methods", type=parse_list(str), default=["Euler", "RK4", "Leapfrog"], help="Comma separated integration methods")
+    parser.add_argument("--backend", default="auto", help="Direct-sum backend (auto, numba, numpy)")
+    parser.add_argument("--delta-t", type=float, default=3600.0, help="Time step (s) of the step benchmarks")
+    parser.add_argument("--max-direct-bodies", type=int, default=20000, help="Largest N timed with the direct solver")
+    parser.add_argument("--max-step-bodies", type=int, default=10000, help="Largest N timed through the integrators")
+    parser.add_argument("--trail-limits", type=parse_list(int), default=[200, 1000, 5000], help="Comma separated trail limits")
+    parser.add_argument("--render-bodies", type=parse_list(int), default=[10, 1000], help="Comma separated N of the render benchmark")
+    parser.add_argument("--startup-targets", type=parse_list(str), default=list(STARTUP_TARGETS),
+                        help="Comma separated startup reports (core, headless, interactive), empty disables them")
+    parser.add_argument("--min-time", type=float, default=0.5, help="Minimum seconds spent on each measurement")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated scenarios")
+    parser.add_argument("--output", default=None, help="JSON file of the results (printed when not provided)")
+    parser.add_argument("--compare", default=None, help="Baseline JSON, exits with 1 when a result is slower")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before a regression (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args)
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare is not None:
+        with open(args.compare, "r") as file:
+            regressions = compare(json.load(file), report, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,241 @@
+import inspect
+from typing import Callable, Optional
+import numpy as np
+from numpy import ndarray
+
+from config import G
+from core.body_system import BodySystem
+from core.gravity import potential_energy
+
+SOLAR_MASS = 1.989e30
+JUPITER_MASS = 1.898e27
+ASTRONOMICAL_UNIT = 1.496e11
+VIRIAL_SAMPLE = 2000 # Bodies used to estimate the potential energy of the generated clusters
+
+def random_colors(rng: np.random.Generator, count: int, base: tuple, spread: int = 40) -> list[tuple]:
+    """count colors scattered around base, drawn in one call"""
+
+    colors = np.clip(np.array(base) + rng.integers(-spread, spread + 1, (count, 3)), 0, 255)
+    return [tuple(color) for color in colors.tolist()]
+
+def circular_velocities(positions: ndarray, central_mass: ndarray) -> ndarray:
+    """Velocities of circular (counter-clockwise) orbits around the origin, central_mass is the mass inside each orbit"""
+
+    radius = np.linalg.norm(positions, axis=1)
+    speed = np.sqrt(G * central_mass / np.maximum(radius, 1.0))
+    return (speed / np.maximum(radius, 1.0))[:, np.newaxis] * positions[:, ::-1] * [-1, 1]
+
+def ring(rng: np.random.Generator, count: int, inner: float, outer: float, power: float = 1.0) -> ndarray:
+    """Sample count positions on an annulus with surface density proportional to r^-power (power < 2)"""
+
+    exponent = 2 - power
+    radius = (rng.uniform(inner ** exponent, outer ** exponent, count)) ** (1 / exponent)
+    angle = rng.uniform(0, 2 * np.pi, count)
+    return radius[:, np.newaxis] * np.column_stack((np.cos(angle), np.sin(angle)))
+
+def asteroid_belt(count: int = 5000, seed: int = 0, inner: float = 2.2, outer: float = 3.3, jupiter: bool = True,
+                  eccentricity: float = 0.1, test_particles: bool = False) -> BodySystem:
+    """The Sun, optionally Jupiter, and count asteroids between inner and outer (AU) on slightly eccentric orbits
+
+    Args:
+        count (int, optional): The number of asteroids. Defaults to 5000.
+        seed (int, optional): The seed of the generator. Defaults to 0.
+        inner (float, optional): Inner radius of the belt (AU). Defaults to 2.2.
+        outer (float, optional): Outer radius of the belt (AU). Defaults to 3.3.
+        jupiter (bool, optional): Add Jupiter at 5.2 AU. Defaults to True.
+        eccentricity (float, optional): Maximum relative deviation of the orbital speed. Defaults to 0.1.
+        test_particles (bool, optional): The asteroids are massless test particles. Defaults to False.
+
+    Returns:
+        BodySystem: The system
+    """
+
+    rng = np.random.default_rng(seed)
+    count = int(count)
+    positions = ring(rng, count, inner * ASTRONOMICAL_UNIT, outer * ASTRONOMICAL_UNIT, 0.0)
+    velocities = circular_velocities(positions, SOLAR_MASS) * rng.uniform(1 - eccentricity, 1 + eccentricity, (count, 1))
+    masses = 10 ** rng.uniform(14, 19, count) # 10^14 to 10^19 kg
+
+    system = BodySystem(count + 2)
+    system.add("Sun", SOLAR_MASS, np.zeros(2), np.zeros(2), (255, 204, 0), 6.96e8)
+    if jupiter:
+        position = np.array([5.2 * ASTRONOMICAL_UNIT, 0.0])
+        system.add("Jupiter", JUPITER_MASS, position, circular_velocities(position[np.newaxis], SOLAR_MASS)[0],
+                   (210, 180, 140), 6.99e7)
+    system.add_arrays(positions, velocities, masses, [f"Asteroid {i}" for i in range(count)],
+                      random_colors(rng, count, (150, 150, 150)), test_particles=test_particles)
+    return system
+
+def protoplanetary_disk(count: int = 10000, seed: int = 0, inner: float = 0.1, outer: float = 5.0, disk_mass: float = 0.01,
+                        star_mass: float = 1.0) -> BodySystem:
+    """A star surrounded by a disk of count planetesimals with surface density ~ 1/r, on circular orbits around the
+    mass enclosed by each orbit
+
+    Args:
+        count (int, optional): The number of planetesimals. Defaults to 10000.
+        seed (int, optional): The seed of the generator. Defaults to 0.
+        inner (float, optional): Inner radius of the disk (AU). Defaults to 0.1.
+        outer (float, optional): Outer radius of the disk (AU). Defaults to 5.0.
+        disk_mass (float, optional): Mass of the disk (star masses). Defaults to 0.01.
+        star_mass (float, optional): Mass of the star (solar masses). Defaults to 1.0.
+
+    Returns:
+        BodySystem: The system
+    """
+
+    rng = np.random.default_rng(seed)
+    count = int(count)
+    star = star_mass * SOLAR_MASS
+    positions = ring(rng, count, inner * ASTRONOMICAL_UNIT, outer * ASTRONOMICAL_UNIT, 1.0)
+    masses = np.full(count, disk_mass * star / max(count, 1))
+    order = np.argsort(np.linalg.norm(positions, axis=1))
+    enclosed = np.empty(count)
+    enclosed[order] = star + np.cumsum(masses[order]) - masses[order] # Star and the planetesimals inside each orbit
+    velocities = circular_velocities(positions, enclosed)
+
+    system = BodySystem(count + 1)
+    system.add("Star", star, np.zeros(2), np.zeros(2), (255, 230, 150), 6.96e8 * star_mass ** 0.8)
+    system.add_arrays(positions, velocities, masses, [f"Planetesimal {i}" for i in range(count)],
+                      random_colors(rng, count, (200, 120, 60)))
+    return system
+
+def plummer_positions_velocities(rng: np.random.Generator, count: int, radius: float, mass: float) -> tuple[ndarray, ndarray]:
+    """Sample a 3D Plummer sphere in equilibrium (Aarseth, Hénon & Wielen 1974) and project it on the plane"""
+
+    r = radius / np.sqrt(rng.uniform(1e-6, 1 - 1e-6, count) ** (-2 / 3) - 1)
+    r = np.minimum(r, 20 * radius) # Cut the far tail, it only slows the tree down
+
+    # Speeds as a fraction q of the escape speed, rejection sampling of g(q) = q²(1 - q²)^3.5 (max < 0.1)
+    q = np.empty(count)
+    pending = np.arange(count)
+    while len(pending):
+        candidate = rng.uniform(0, 1, len(pending))
+        accepted = rng.uniform(0, 0.1, len(pending)) < candidate ** 2 * (1 - candidate ** 2) ** 3.5
+        q[pending[accepted]] = candidate[accepted]
+        pending = pending[~accepted]
+    speed = q * np.sqrt(2 * G * mass / np.sqrt(r ** 2 + radius ** 2))
+
+    def isotropic(length: ndarray) -> ndarray:
+        direction = rng.normal(size=(count, 3))
+        return (length / np.linalg.norm(direction, axis=1))[:, np.newaxis] * direction
+
+    return isotropic(r)[:, :2], isotropic(speed)[:, :2]
+
+def plummer_cluster(count: int = 10000, seed: int = 0, radius: float = 2.0, mass: float = 1000.0) -> BodySystem:
+    """count equal-mass stars following a (projected) Plummer profile, with the speeds scaled to virial equilibrium
+
+    Args:
+        count (int, optional): The number of stars. Defaults to 10000.
+        seed (int, optional): The seed of the generator. Defaults to 0.
+        radius (float, optional): Scale radius of the profile (AU). Defaults to 2.0.
+        mass (float, optional): Total mass (solar masses). Defaults to 1000.0.
+
+    Returns:
+        BodySystem: The system
+    """
+
+    rng = np.random.default_rng(seed)
+    count = int(count)
+    positions, velocities = plummer_positions_velocities(rng, count, radius * ASTRONOMICAL_UNIT, mass * SOLAR_MASS)
+    velocities -= velocities.mean(axis=0) # The cluster stays in place
+    masses = np.full(count, mass * SOLAR_MASS / max(count, 1))
+
+    # The projection breaks the 3D equilibrium, scale the speeds so the plane system is virialized (2K = -W).
+    # W is estimated on a random subset of at most VIRIAL_SAMPLE bodies, rescaled by the ratio of the pair counts
+    if count > 1:
+        sample = rng.choice(count, min(count, VIRIAL_SAMPLE), replace=False)
+        pairs_ratio = count * (count - 1) / (len(sample) * (len(sample) - 1))
+        potential = potential_energy(positions[sample], masses[sample]) * pairs_ratio
+        kinetic = 0.5 * np.einsum("i,ij,ij->", masses, velocities, velocities)
+        velocities *= np.sqrt(-potential / (2 * kinetic))
+
+    system = BodySystem(count)
+    system.add_arrays(positions, velocities, masses,
+                      [f"Star {i}" for i in range(count)], random_colors(rng, count, (220, 220, 255), 35))
+    return system
+
+def galaxy_collision(count: int = 10000, seed: int = 0, separation: float = 40.0, core_mass: float = 1e4,
+                     disk_radius: float = 12.0, impact: float = 10.0, test_particles: bool = False) -> BodySystem:
+    """Two disk galaxies (a massive core with count / 2 light stars each) on a parabolic encounter, with massless
+    stars it is the restricted encounter of Toomre & Toomre (1972)
+
+    Args:
+        count (int, optional): The total number of disk stars. Defaults to 10000.
+        seed (int, optional): The seed of the generator. Defaults to 0.
+        separation (float, optional): Initial distance between the cores (AU). Defaults to 40.0.
+        core_mass (float, optional): Mass of each core (solar masses). Defaults to 1e4.
+        disk_radius (float, optional): Radius of each disk (AU). Defaults to 12.0.
+        impact (float, optional): Impact parameter of the encounter (AU). Defaults to 10.0.
+        test_particles (bool, optional): The disk stars are massless test particles. Defaults to False.
+
+    Returns:
+        BodySystem: The system
+    """
+
+    rng = np.random.default_rng(seed)
+    count = int(count)
+    core = core_mass * SOLAR_MASS
+    half_separation = np.array([separation, impact]) * ASTRONOMICAL_UNIT / 2
+    # Parabolic relative speed for the initial distance, split between the two cores
+    relative_speed = np.sqrt(2 * G * 2 * core / np.linalg.norm(2 * half_separation))
+    core_velocity = np.array([relative_speed / 2, 0.0])
+
+    system = BodySystem(count + 2)
+    for index, (sign, color, spin) in enumerate(((-1, (120, 170, 255), 1), (1, (255, 170, 120), -1))):
+        center, velocity = sign * half_separation, -sign * core_velocity
+        members = count // 2 + (index < count % 2)
+        positions = ring(rng, members, 0.1 * disk_radius * ASTRONOMICAL_UNIT, disk_radius * ASTRONOMICAL_UNIT, 1.0)
+        velocities = spin * circular_velocities(positions, core) # The second galaxy rotates the other way
+        system.add(f"Core {index + 1}", core, center, velocity, (255, 255, 255), 7e8)
+        system.add_arrays(positions + center, velocities + velocity, np.full(members, 1e20),
+                          [f"Star {index + 1}.{i}" for i in range(members)], random_colors(rng, members, color),
+                          test_particles=test_particles)
+    return system
+
+# Generators callable from /template (and TemplateLoader.get_template) with their parameters
+GENERATORS: dict[str, Callable[..., BodySystem]] = {
+    "asteroid_belt": asteroid_belt,
+    "protoplanetary_disk": protoplanetary_disk,
+    "plummer_cluster": plummer_cluster,
+    "galaxy_collision": galaxy_collision,
+}
+
+def parse_parameters(name: str, parameters: dict[str, str]) -> dict:
+    """Convert text parameters (e.g. from "/template plummer_cluster count=20000 seed=3") to the types of the defaults
+
+    Args:
+        name (str): The generator name
+        parameters (dict[str, str]): The parameter values as text
+
+    Returns:
+        dict: The typed parameters
+    """
+
+    signature = inspect.signature(GENERATORS[name]).parameters
+    parsed = {}
+    for key, text in parameters.items():
+        if key not in signature:
+            raise Exception(f"Sorry, the parameter '{key}' not exist")
+        default = signature[key].default
+        if isinstance(default, bool):
+            parsed[key] = text.lower() in ("1", "true", "yes", "on")
+        elif isinstance(default, int):
+            parsed[key] = int(float(text))
+        else:
+            parsed[key] = float(text)
+    return parsed
+
+def generate(name: str, parameters: Optional[dict] = None) -> BodySystem:
+    """Build a system with one of the GENERATORS
+
+    Args:
+        name (str): The generator name
+        parameters (Optional[dict], optional): Keyword parameters of the generator (count, seed, ...). Defaults to None.
+
+    Returns:
+        BodySystem: The system
+    """
+
+    if name not in GENERATORS:
+        raise Exception(f"Sorry, the generator '{name}' not exist")
+    return GENERATORS[name](**(parameters or {}))
@@ -0,0 +1,248 @@
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from typing import Iterator, Optional
+import numpy as np
+
+from config import COMPUTE_BACKEND, DELTA_T
+from core.body_system import BodySystem
+from core.compiled import select_backend
+from core.ensemble import Ensemble
+from core.gravity import total_energy
+from core.simulation import Simulation
+from utils.template_loader import TemplateLoader
+
+# Parameters understood by a run, "mass_scale" and "velocity_scale" can target a single body with "mass_scale.<name>"
+SWEEP_PARAMETERS = ("delta_t", "method", "mass_scale", "velocity_scale")
+
+# Shared initial state attached once by every worker process
+_worker_state = {}
+
+def _attach_shared_state(memory_name: str, count: int, massive: int, names: list[str], colors: list):
+    """Process pool initializer, maps the (positions, velocities, masses) block published by the parent, the rows
+    from massive on are test particles. The compute backend is resolved here, so Numba (when a system this size
+    uses it) is loaded once per worker instead of inside the first run it executes"""
+
+    memory = shared_memory.SharedMemory(name=memory_name)
+    buffer = np.ndarray((5, count), dtype=np.float64, buffer=memory.buf)
+    _worker_state.update(memory=memory, buffer=buffer, massive=massive, names=names, colors=colors)
+    select_backend(COMPUTE_BACKEND, count)
+
+def _apply_scales(parameters: dict, names: list[str], velocities: np.ndarray, masses: np.ndarray):
+    """Apply the mass/velocity scales of a run to its (N, 2) velocities and (N,) masses in place"""
+
+    for key, value in parameters.items():
+        parameter, _, body_name = key.partition(".")
+        selected = np.array([name == body_name for name in names]) if body_name else slice(None)
+        if parameter == "mass_scale":
+            masses[selected] *= value
+        elif parameter == "velocity_scale":
+            velocities[selected] *= value
+
+def _build_system(parameters: dict) -> BodySystem:
+    """Copy the shared initial state into a new system and apply the mass/velocity scales of the run"""
+
+    buffer, names = _worker_state["buffer"], _worker_state["names"]
+    positions = buffer[0:2].T.copy()
+    velocities = buffer[2:4].T.copy()
+    masses = buffer[4].copy()
+    _apply_scales(parameters, names, velocities, masses)
+
+    colors, massive = [tuple(color) for color in _worker_state["colors"]], _worker_state["massive"]
+    system = BodySystem(len(masses))
+    for rows, test_particles in ((slice(0, massive), False), (slice(massive, None), True)):
+        system.add_arrays(positions[rows], velocities[rows], masses[rows], list(names[rows]), colors[rows],
+                          test_particles=test_particles)
+    return system
+
+def _run_member(run_id: str, parameters: dict, steps: int) -> dict:
+    """Run one member of the sweep inside a worker process and return its metrics"""
+
+    start = time.perf_counter()
+    system = _build_system(parameters)
+    simulation = Simulation(system, parameters.get("delta_t", DELTA_T), parameters.get("method", "RK4"))
+    initial_energy = total_energy(system.positions, system.velocities, system.masses, simulation.softening)
+    for _ in range(steps):
+        simulation.run()
+    final_energy = total_energy(system.positions, system.velocities, system.masses, simulation.softening)
+
+    return {
+        "run_id": run_id, "parameters": parameters, "steps": steps, "simulated_time": simulation.time,
+        "energy_drift": abs((final_energy - initial_energy) / initial_energy) if initial_energy else 0.0,
+        "final_positions": system.positions.tolist(), "final_velocities": system.velocities.tolist(),
+        "wall_time": time.perf_counter() - start,
+    }
+
+class ParameterSweep:
+    """Fans independent simulations of a base system out over a process pool.
+
+    The initial state is published once in shared memory, the runs only receive their parameters. Every finished
+    run is appended to a JSON lines file, runs already there are skipped, so an interrupted sweep can be resumed.
+    """
+
+    def __init__(self, system: BodySystem, steps: int, results_path: Optional[str] = None):
+        """Initialize the sweep
+
+        Args:
+            system (BodySystem): The base (initial) system of every run
+            steps (int): The number of steps of every run
+            results_path (Optional[str], optional): JSON lines file with the results (used to resume). Defaults to None.
+        """
+
+        self.system = system
+        self.steps = steps
+        self.results_path = results_path
+
+    @staticmethod
+    def grid(parameters: dict[str, list]) -> list[dict]:
+        """Build the cartesian product of the parameter values, e.g. {"delta_t": [1e5, 2e5], "method": ["RK4", "Leapfrog"]}"""
+
+        keys = list(parameters)
+        return [dict(zip(keys, values)) for values in itertools.product(*(parameters[key] for key in keys))]
+
+    @staticmethod
+    def random_samples(ranges: dict[str, tuple[float, float]], samples: int, seed: int = 0) -> list[dict]:
+        """Sample every parameter uniformly inside its (low, high) range with a seeded generator"""
+
+        rng = np.random.default_rng(seed)
+        values = {key: rng.uniform(low, high, samples) for key, (low, high) in ranges.items()}
+        return [{key: float(values[key][i]) for key in ranges} for i in range(samples)]
+
+    @staticmethod
+    def run_id(parameters: dict) -> str:
+        return json.dumps(parameters, sort_keys=True)
+
+    def completed_runs(self) -> set[str]:
+        """Return the ids of the runs already stored in the results file"""
+
+        if self.results_path is None or not os.path.exists(self.results_path):
+            return set()
+        completed = set()
+        with open(self.results_path, "r") as file:
+            for line in file:
+                try:
+                    completed.add(json.loads(line)["run_id"])
+                except (ValueError, KeyError):
+                    pass # Line truncated by an interruption, the run is repeated
+        return completed
+
+    def pending_runs(self, runs: list[dict]) -> list[tuple[str, dict]]:
+        """Validate the parameters of the runs and return the (run_id, parameters) of the ones not in the results file"""
+
+        for parameters in runs:
+            for key in parameters:
+                parameter, _, body_name = key.partition(".")
+                if parameter not in SWEEP_PARAMETERS:
+                    raise Exception(f"Sorry, the sweep parameter '{key}' not exist")
+                if body_name and body_name not in self.system.names:
+                    raise Exception(f"Sorry, the body '{body_name}' not exist")
+
+        completed = self.completed_runs()
+        pending = [(self.run_id(parameters), parameters) for parameters in runs]
+        return [(run_id, parameters) for run_id, parameters in pending if run_id not in completed]
+
+    def save_result(self, result: dict):
+        if self.results_path is not None:
+            with open(self.results_path, "a") as file:
+                file.write(json.dumps(result) + "\n")
+
+    def run(self, runs: list[dict], workers: Optional[int] = None) -> Iterator[dict]:
+        """Execute the runs and yield their metrics as soon as each one finishes
+
+        Args:
+            runs (list[dict]): The parameters of every run (see SWEEP_PARAMETERS)
+            workers (Optional[int], optional): The number of processes, defaults to the number of CPUs. Defaults to None.
+
+        Yields:
+            dict: The metrics of a finished run (final state, energy drift, wall time)
+        """
+
+        pending = self.pending_runs(runs)
+        if not pending:
+            return
+
+        count = len(self.system)
+        memory = shared_memory.SharedMemory(create=True, size=max(1, 5 * count * 8))
+        try:
+            buffer = np.ndarray((5, count), dtype=np.float64, buffer=memory.buf)
+            buffer[0:2] = self.system.positions.T
+            buffer[2:4] = self.system.velocities.T
+            buffer[4] = self.system.masses
+            initializer_arguments = (memory.name, count, self.system.massive, list(self.system.names), [list(color) for color in self.system.colors])
+            with ProcessPoolExecutor(workers, initializer=_attach_shared_state, initargs=initializer_arguments) as executor:
+                futures = [executor.submit(_run_member, run_id, parameters, self.steps) for run_id, parameters in pending]
+                for future in as_completed(futures):
+                    result = future.result()
+                    self.save_result(result)
+                    yield result
+        finally:
+            memory.close()
+            memory.unlink()
+
+    def run_batched(self, runs: list[dict], max_energy_error: Optional[float] = None) -> Iterator[dict]:
+        """Execute the runs in this process with one Ensemble per method: every step advances all the runs of a method
+        with a single batched force evaluation, far faster than the process pool for small systems
+
+        Args:
+            runs (list[dict]): The parameters of every run (see SWEEP_PARAMETERS), the adaptive and block methods are not supported
+            max_energy_error (Optional[float], optional): Relative energy error that stops a run as diverged. Defaults to None.
+
+        Yields:
+            dict: The metrics of a finished run (final state, energy drift, diverged, wall time)
+        """
+
+        groups: dict[str, list[tuple[str, dict]]] = {}
+        for run_id, parameters in self.pending_runs(runs):
+            groups.setdefault(parameters.get("method", "RK4"), []).append((run_id, parameters))
+
+        names = list(self.system.names)
+        for method, group in groups.items():
+            start = time.perf_counter()
+            velocities = np.repeat(self.system.velocities[np.newaxis], len(group), axis=0)
+            masses = np.repeat(self.system.masses[np.newaxis], len(group), axis=0)
+            for member, (_, parameters) in enumerate(group):
+                _apply_scales(parameters, names, velocities[member], masses[member])
+            ensemble = Ensemble(np.broadcast_to(self.system.positions, velocities.shape), velocities, masses,
+                                [parameters.get("delta_t", DELTA_T) for _, parameters in group], method,
+                                max_energy_error=max_energy_error)
+            ensemble.run(self.steps)
+            wall_time = (time.perf_counter() - start) / len(group)
+
+            for member, (run_id, parameters) in enumerate(group):
+                result = {
+                    "run_id": run_id, "parameters": parameters, "steps": int(ensemble.steps[member]),
+                    "simulated_time": float(ensemble.time[member]), "energy_drift": float(ensemble.energy_error[member]),
+                    "diverged": bool(ensemble.diverged[member]), "final_positions": ensemble.positions[member].tolist(),
+                    "final_velocities": ensemble.velocities[member].tolist(), "wall_time": wall_time,
+                }
+                self.save_result(result)
+                yield result
+
+def main(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Run a parameter sweep of a template over a process pool")
+    parser.add_argument("--template", default="binary_system_equal_mass", help="Name of the base template")
+    parser.add_argument("--steps", type=int, required=True, help="Number of steps of every run")
+    parser.add_argument("--grid", default=None, help='JSON grid, e.g. {"delta_t": [1e5, 2e5], "method": ["RK4", "Leapfrog"]}')
+    parser.add_argument("--ranges", default=None, help='JSON ranges for random samples, e.g. {"mass_scale": [0.5, 2]}')
+    parser.add_argument("--samples", type=int, default=16, help="Number of random samples (with --ranges)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random samples")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--results", default="sweep_results.jsonl", help="JSON lines results file (resumable)")
+    parser.add_argument("--batched", action="store_true", help="Run the members as one vectorized ensemble per method "
+                        "in this process (fast for small systems)")
+    parser.add_argument("--max-energy-error", type=float, default=None, help="Relative energy error that stops a batched "
+                        "member as diverged")
+    args = parser.parse_args(argv)
+
+    runs = ParameterSweep.grid(json.loads(args.grid)) if args.grid else []
+    if args.ranges:
+        runs += ParameterSweep.random_samples(json.loads(args.ranges), args.samples, args.seed)
+    sweep = ParameterSweep(TemplateLoader("templates.json", args.template).get_template(args.template), args.steps, args.results)
+    results = sweep.run_batched(runs, args.max_energy_error) if args.batched else sweep.run(runs, args.workers)
+    for result in results:
+        print(f"{result['run_id']}: energy drift {result['energy_drift']:.3e}, {result['wall_time']:.3f} s"
+              + (" (diverged)" if result.get("diverged") else ""))
@@ -1,37 +1,307 @@
+import glob
+import hashlib
+import itertools
 import json
 import os
+from typing import Iterator, Optional
 import numpy as np
+from numpy import ndarray
 
-from core.celestial_body import CelestialBody
+from config import TEMPLATE_CACHE_DIR, TEMPLATE_CHUNK_ROWS
+from core.body_system import BodySystem, radius_from_mass
+from utils.generators import GENERATORS, generate
+
+# Columns of a compiled template and of the CSV/NPY/NPZ body lists, the optional ones can be left out
+REQUIRED_COLUMNS = ("mass", "x", "y", "vx", "vy")
+OPTIONAL_COLUMNS = ("name", "r", "g", "b", "radius", "test_particle")
+TABLE_EXTENSIONS = (".csv", ".npy", ".npz")
+INDEX_KEY = "__templates__" # Array of the template names inside the compiled cache
+
+def file_digest(path: str) -> str:
+    """The sha256 of a file, read in blocks"""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compile_template(template_name: str, bodies: list) -> dict[str, ndarray]:
+    """Validate the bodies of a JSON template and convert them to columns
+
+    Args:
+        template_name (str): The template name (used by the error messages)
+        bodies (list): The bodies, dicts with name, mass, position, velocity, color, an optional radius and an optional
+            test_particle flag (a massless body, its mass can be left out)
+
+    Returns:
+        dict[str, ndarray]: The columns (see REQUIRED_COLUMNS and OPTIONAL_COLUMNS), a missing radius is NaN
+    """
+
+    if not isinstance(bodies, list) or not bodies or not all(isinstance(body, dict) for body in bodies):
+        raise Exception(f"Sorry, the template '{template_name}' must be a non empty list of bodies")
+    required = {"name", "mass", "position", "velocity", "color"}
+    for index, body in enumerate(bodies):
+        if not isinstance(body.get("test_particle", False), bool):
+            raise Exception(f"Sorry, the test_particle of the body {index} of the template '{template_name}' must be true or false")
+        missing = required - body.keys() - ({"mass"} if body.get("test_particle") else set())
+        unknown = body.keys() - required - {"radius", "test_particle"}
+        if missing or unknown:
+            problem = f"misses {', '.join(sorted(missing))}" if missing else f"has unknown keys {', '.join(sorted(unknown))}"
+            raise Exception(f"Sorry, the body {index} of the template '{template_name}' {problem}")
+
+    def column(key: str, width: int) -> ndarray:
+        try:
+            values = np.array([body.get(key, 0.0) for body in bodies], dtype=np.float64)
+        except (TypeError, ValueError):
+            values = None
+        if values is None or values.shape != ((len(bodies), width) if width else (len(bodies),)):
+            raise Exception(f"Sorry, the '{key}' of every body of the template '{template_name}' must be "
+                            + (f"{width} numbers" if width else "a number"))
+        return values
+
+    positions, velocities, colors = column("position", 2), column("velocity", 2), column("color", 3)
+    columns = {
+        "name": np.array([str(body["name"]) for body in bodies]), "mass": column("mass", 0),
+        "x": positions[:, 0], "y": positions[:, 1], "vx": velocities[:, 0], "vy": velocities[:, 1],
+        "r": colors[:, 0], "g": colors[:, 1], "b": colors[:, 2],
+        "radius": np.array([np.nan if body.get("radius") is None else body["radius"] for body in bodies], dtype=np.float64),
+        "test_particle": np.array([body.get("test_particle", False) for body in bodies], dtype=np.float64),
+    }
+    validate_columns(columns, f"the template '{template_name}'")
+    return columns
+
+def validate_columns(columns: dict[str, ndarray], source: str):
+    """Check the columns of a body list (required columns, lengths and ranges), raise an Exception when invalid
+
+    Args:
+        columns (dict[str, ndarray]): The columns
+        source (str): Description of where they come from (used by the error messages)
+    """
+
+    missing = [key for key in REQUIRED_COLUMNS if key not in columns]
+    if missing:
+        raise Exception(f"Sorry, {source} misses the columns {', '.join(missing)}")
+    if any(key in columns for key in "rgb") and not all(key in columns for key in "rgb"):
+        raise Exception(f"Sorry, {source} must have all the r, g, b columns or none")
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise Exception(f"Sorry, the columns of {source} have different lengths")
+    for key in REQUIRED_COLUMNS:
+        if not np.isfinite(columns[key]).all():
+            raise Exception(f"Sorry, the column '{key}' of {source} has a value that is not a finite number")
+    if (columns["mass"] < 0).any():
+        raise Exception(f"Sorry, {source} has a negative mass")
+    if "radius" in columns and (columns["radius"] <= 0).any():
+        raise Exception(f"Sorry, {source} has a radius that is not positive")
+    if "r" in columns and any(((columns[key] < 0) | (columns[key] > 255)).any() for key in "rgb"):
+        raise Exception(f"Sorry, {source} has a color outside of 0-255")
+    if "test_particle" in columns and not np.isin(columns["test_particle"], (0, 1)).all():
+        raise Exception(f"Sorry, the column 'test_particle' of {source} must be 0 or 1")
+
+def add_columns(system: BodySystem, columns: dict[str, ndarray]):
+    """Append the bodies of validated columns to the system, one add_arrays call for the massive bodies and one for
+    the test particles"""
+
+    particles = np.asarray(columns["test_particle"]) != 0 if "test_particle" in columns else np.zeros(len(columns["mass"]), dtype=bool)
+    masses = np.where(particles, 0.0, np.asarray(columns["mass"], dtype=np.float64))
+    radii = None
+    if "radius" in columns:
+        radii = np.asarray(columns["radius"], dtype=np.float64)
+        radii = np.where(np.isnan(radii), radius_from_mass(masses), radii) # NaN means computed from the mass
+    colors = None
+    if "r" in columns:
+        colors = [tuple(color) for color in np.column_stack([columns[key] for key in "rgb"]).astype(int).tolist()]
+    positions = np.column_stack((columns["x"], columns["y"]))
+    velocities = np.column_stack((columns["vx"], columns["vy"]))
+    names = np.asarray(columns["name"]).astype(str).tolist() if "name" in columns else None
+    for test_particles in (False, True):
+        rows = np.flatnonzero(particles == test_particles)
+        if len(rows):
+            system.add_arrays(positions[rows], velocities[rows], masses[rows],
+                              None if names is None else [names[row] for row in rows],
+                              None if colors is None else [colors[row] for row in rows],
+                              None if radii is None else radii[rows], test_particles)
+
+def read_csv_chunks(path: str, chunk_rows: int = TEMPLATE_CHUNK_ROWS) -> Iterator[dict[str, ndarray]]:
+    """Parse a CSV body list (a header line with the column names) chunk_rows lines at a time
+
+    The numeric columns of every chunk are parsed by np.loadtxt straight into one float array (the names in a second
+    pass), the file is never held in memory as rows of Python objects. An empty radius is computed from the mass.
+    """
+
+    with open(path, "r", newline="") as file:
+        header = [key.strip() for key in file.readline().strip().split(",")]
+        unknown = set(header) - set(REQUIRED_COLUMNS) - set(OPTIONAL_COLUMNS)
+        if unknown:
+            raise Exception(f"Sorry, the file '{path}' has unknown columns {', '.join(sorted(unknown))}")
+        numeric = [index for index, key in enumerate(header) if key != "name"]
+        converters = {header.index("radius"): lambda text: float(text) if text.strip() else np.nan} if "radius" in header else None
+        while True:
+            lines = list(itertools.islice(file, chunk_rows))
+            if not lines:
+                return
+            try:
+                table = np.loadtxt(lines, delimiter=",", usecols=numeric, converters=converters, quotechar='"', ndmin=2)
+                chunk = {header[index]: table[:, column] for column, index in enumerate(numeric)}
+                if "name" in header:
+                    chunk["name"] = np.loadtxt(lines, delimiter=",", usecols=header.index("name"), dtype=str, quotechar='"', ndmin=1)
+            except ValueError as error:
+                raise Exception(f"Sorry, the file '{path}' is invalid: {error}")
+            yield chunk
+
+def read_npy_chunks(path: str, chunk_rows: int = TEMPLATE_CHUNK_ROWS) -> Iterator[dict[str, ndarray]]:
+    """Read a structured .npy body list (one field per column) memory mapped, chunk_rows rows at a time"""
+
+    table = np.load(path, mmap_mode="r")
+    if table.dtype.names is None:
+        raise Exception(f"Sorry, the file '{path}' must hold a structured array with the fields "
+                        f"{', '.join(REQUIRED_COLUMNS + OPTIONAL_COLUMNS)}")
+    for start in range(0, len(table), chunk_rows):
+        chunk = table[start:start + chunk_rows]
+        yield {key: np.asarray(chunk[key]) for key in table.dtype.names}
+
+def load_table(path: str, chunk_rows: int = TEMPLATE_CHUNK_ROWS) -> BodySystem:
+    """Build a system from a columnar body list file: .csv (with a header), structured .npy or .npz (one array per column)
+
+    Args:
+        path (str): The file
+        chunk_rows (int, optional): Rows parsed at once by the streaming formats. Defaults to TEMPLATE_CHUNK_ROWS.
+
+    Returns:
+        BodySystem: The system with all the bodies of the file
+    """
+
+    if path.endswith(".npz"):
+        with np.load(path) as data:
+            columns = {key: data[key] for key in data.files}
+        validate_columns(columns, f"the file '{path}'")
+        system = BodySystem(len(columns["mass"]))
+        add_columns(system, columns)
+        return system
+
+    if path.endswith(".npy"):
+        chunks, capacity = read_npy_chunks(path, chunk_rows), len(np.load(path, mmap_mode="r"))
+    else:
+        chunks, capacity = read_csv_chunks(path, chunk_rows), chunk_rows
+    system = BodySystem(capacity)
+    for chunk in chunks:
+        validate_columns(chunk, f"the file '{path}'")
+        add_columns(system, chunk)
+    if len(system) == 0:
+        raise Exception(f"Sorry, the file '{path}' has no bodies")
+    return system
 
 class TemplateLoader:
-    """This class handles the load and convertion of json to Celestial Body"""
+    """This class handles the load of the templates to a Body System.
+
+    The JSON template file is validated and compiled once to columns saved in an .npz cache named by the hash of the
+    file, the next starts only hash the file and read the template that is asked for. Body lists in .csv/.npy/.npz
+    files are loaded by passing their path as the template name.
+    """
+
+    def __init__(self, template_file: str, template_name: str, cache_dir: Optional[str] = TEMPLATE_CACHE_DIR):
+        """Initialize the template loader (the template file is only read by the first get_template)
+
+        Args:
+            template_file (str): The JSON template file, relative to src/utils
+            template_name (str): The name of the current template
+            cache_dir (Optional[str], optional): Directory of the compiled cache, relative to src/utils, None disables
+                the cache. Defaults to TEMPLATE_CACHE_DIR.
+        """
 
-    def __init__(self, template_file: str, template_name: str):
-        """Initialize the template loader"""
         self.template_name = template_name
-        template_file_path = os.path.join(os.path.dirname(__file__), template_file)
-        with open(template_file_path, 'r') as file:
-            self.templates = json.load(file)
+        self.template_parameters = {}
+        self.template_file_path = os.path.join(os.path.dirname(__file__), template_file)
+        self.cache_dir = os.path.join(os.path.dirname(__file__), cache_dir) if cache_dir is not None else None
+        self.cache_path: Optional[str] = None
+        self.compiled: Optional[dict[str, dict[str, ndarray]]] = None # Used when the cache cannot be written
+        self._templates: Optional[tuple[str, ...]] = None
+
+    @property
+    def templates(self) -> tuple[str, ...]:
+        """The names of the templates of the template file"""
 
-    def get_template(self, template_name: str) -> list[CelestialBody]:
+        if self._templates is None:
+            self.load_index()
+        return self._templates
+
+    def load_index(self):
+        """Find the compiled cache of the current template file, compile it when missing"""
+
+        digest = file_digest(self.template_file_path)
+        stem = os.path.splitext(os.path.basename(self.template_file_path))[0]
+        if self.cache_dir is not None:
+            self.cache_path = os.path.join(self.cache_dir, f"{stem}-{digest[:16]}.npz")
+            if os.path.exists(self.cache_path):
+                try:
+                    with np.load(self.cache_path) as data:
+                        self._templates = tuple(data[INDEX_KEY].tolist())
+                    return
+                except (OSError, ValueError, KeyError):
+                    pass # Corrupted cache, compiled again below
+
+        with open(self.template_file_path, "r") as file:
+            templates = json.load(file)
+        if not isinstance(templates, dict):
+            raise Exception(f"Sorry, the template file '{self.template_file_path}' must map the names to lists of bodies")
+        compiled = {name: compile_template(name, bodies) for name, bodies in templates.items()}
+        self._templates = tuple(compiled)
+        if self.cache_path is not None and self.write_cache(compiled, stem):
+            return
+        self.cache_path, self.compiled = None, compiled
+
+    def write_cache(self, compiled: dict[str, dict[str, ndarray]], stem: str) -> bool:
+        """Save the compiled templates (tmp file then replace) and remove the caches of older versions of the file"""
+
+        arrays = {f"{name}/{key}": values for name, columns in compiled.items() for key, values in columns.items()}
+        arrays[INDEX_KEY] = np.array(list(compiled), dtype=str)
+        temporary = f"{self.cache_path}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(temporary, "wb") as file:
+                np.savez(file, **arrays)
+            os.replace(temporary, self.cache_path)
+            for old in glob.glob(os.path.join(self.cache_dir, f"{glob.escape(stem)}-*.npz")):
+                if old != self.cache_path:
+                    os.remove(old)
+            return True
+        except OSError:
+            return False
+
+    def template_columns(self, template_name: str) -> dict[str, ndarray]:
+        """Read the columns of one template (only its arrays are read from the cache)"""
+
+        if template_name not in self.templates:
+            raise Exception(f"Sorry, the template '{template_name}' not exist")
+        if self.compiled is not None:
+            return self.compiled[template_name]
+        with np.load(self.cache_path) as data:
+            prefix = f"{template_name}/"
+            return {key[len(prefix):]: data[key] for key in data.files if key.startswith(prefix)}
+
+    def get_template(self, template_name: str, parameters: dict = None) -> BodySystem:
         """Return a template configuration by name.
 
         Args:
-            template_name (str): Name of the template inside the template file
+            template_name (str): Name of the template inside the template file, of a generator (see GENERATORS) or
+                the path of a .csv/.npy/.npz body list
+            parameters (dict, optional): Parameters of the generator (count, seed, ...). Defaults to None.
 
         Returns:
-            list[CelestialBody]: A list of celestial bodies
+            BodySystem: The system with all the celestial bodies
         """
-        bodies = []
+
+        if template_name in GENERATORS:
+            system = generate(template_name, parameters)
+        elif template_name.endswith(TABLE_EXTENSIONS) and template_name not in self.templates:
+            if not os.path.isfile(template_name):
+                raise Exception(f"Sorry, the file '{template_name}' not exist")
+            system = load_table(template_name)
+        else:
+            columns = self.template_columns(template_name)
+            system = BodySystem(len(columns["mass"]))
+            add_columns(system, columns)
         self.template_name = template_name
-        for data in self.templates.get(template_name, None):
-            body = CelestialBody(
-                name=data["name"],
-                mass=data["mass"],
-                position=np.array(data["position"], dtype="float64"),
-                velocity=np.array(data["velocity"], dtype="float64"),
-                color=data["color"]
-            )
-            bodies.append(body)
-        return bodies
+        self.template_parameters = dict(parameters or {}) if template_name in GENERATORS else {}
+        return system
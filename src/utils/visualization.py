@@ -1,29 +1,279 @@
-import matplotlib.pyplot as plt
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Optional
 import numpy as np
+from numpy import ndarray
 
-# from core.celestial_body import CelestialBody
+from config import CHART_DIR, CHART_MAX_BODIES, CHART_POINTS, CHART_WORKERS
+
+CHART_TYPES = ("trajectory", "energy", "distance", "phase")
+CHART_OUTPUTS = ("png", "svg", "window")
+
+def lttb_indices(x: ndarray, y: ndarray, threshold: int) -> ndarray:
+    """Largest-Triangle-Three-Buckets downsampling of a time series (Steinarsson 2013)
+
+    The points between the first and the last are split in threshold - 2 buckets, every bucket keeps the point that
+    makes the largest triangle with the point kept before it and the average of the next bucket, so the peaks survive.
+
+    Args:
+        x (ndarray): The (n,) increasing abscissas
+        y (ndarray): The (n,) values
+        threshold (int): The number of points kept
+
+    Returns:
+        ndarray: The indices of the kept points, increasing
+    """
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, stop = edges[bucket], edges[bucket + 1]
+        next_stop = edges[bucket + 2] if bucket + 2 < len(edges) else n # The last bucket looks at the last point
+        average_x, average_y = x[stop:next_stop].mean(), y[stop:next_stop].mean()
+        area = np.abs((x[previous] - average_x) * (y[start:stop] - y[previous])
+                      - (x[previous] - x[start:stop]) * (average_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[bucket + 1] = previous
+    return selected
+
+def min_max_indices(values: ndarray, buckets: int) -> ndarray:
+    """Keep the first and last points and, in every bucket of consecutive points, the minimum and maximum of every
+    column (for a trajectory the extreme x and y of each piece, so the drawn extent does not shrink)
+
+    Args:
+        values (ndarray): The (n, k) samples
+        buckets (int): The number of buckets
+
+    Returns:
+        ndarray: The indices of the kept points, increasing
+    """
+
+    n, columns = values.shape
+    if n <= 2 * columns * buckets:
+        return np.arange(n)
+    size = -(-n // buckets)
+    padded = np.concatenate((values, np.repeat(values[-1:], buckets * size - n, axis=0))).reshape(buckets, size, columns)
+    offsets = (np.arange(buckets) * size)[:, np.newaxis]
+    picks = np.concatenate((padded.argmin(axis=1) + offsets, padded.argmax(axis=1) + offsets), axis=1)
+    return np.unique(np.concatenate(([0, n - 1], np.minimum(picks.ravel(), n - 1))))
+
+def snapshot_trails(snapshot: dict, max_bodies: int) -> list[tuple[int, ndarray, ndarray]]:
+    """The (body, times, positions) of the valid trail samples of the most massive bodies of a snapshot"""
+
+    bodies = np.argsort(-snapshot["masses"], kind="stable")[:max_bodies]
+    limit = snapshot["window"].shape[1]
+    return [(int(body), snapshot["times"][limit - snapshot["counts"][body]:], snapshot["window"][body, limit - snapshot["counts"][body]:])
+            for body in sorted(bodies) if snapshot["counts"][body] > 1]
 
 class Visualization:
-    """Class containing all the plot/chart generation functions"""
-
-    def plot_orbital_trajectories(self, bodies):
-        plt.figure(figsize=(8, 8))
-        
-        for body in bodies:
-            trails = np.array(body.trails_pos)  # Convert trails_pos to a numpy array for easier plotting
-            if trails.shape[0] > 0:  # Ensure there are positions to plot
-                normalized_color = normalize_color(body.color)
-                plt.plot(trails[:, 0], trails[:, 1], color=normalized_color, label=body.name)
-                plt.scatter(trails[-1, 0], trails[-1, 1], color=normalized_color, marker="o", s=50)  # Current position
-
-        plt.xlabel("X Position (m)")
-        plt.ylabel("Y Position (m)")
-        plt.title("Orbital Trajectories")
-        plt.legend(loc="upper right")
-        plt.grid(True)
-        plt.axis("equal")
-        plt.show()
+    """Class containing all the plot/chart generation functions.
+
+    Every chart draws a snapshot (plain arrays copied from the simulation, see PygameManager.chart_snapshot) into a
+    matplotlib figure, the long series are downsampled to about `points` points first.
+    """
+
+    def __init__(self, points: int = CHART_POINTS, max_bodies: int = CHART_MAX_BODIES):
+        """Initialize the visualization
+
+        Args:
+            points (int, optional): Points kept per plotted series. Defaults to CHART_POINTS.
+            max_bodies (int, optional): Most massive bodies plotted by the trail charts. Defaults to CHART_MAX_BODIES.
+        """
+
+        self.points = points
+        self.max_bodies = max_bodies
+
+    def plot_orbital_trajectories(self, figure, snapshot: dict):
+        axis = figure.subplots()
+        for body, _, trail in snapshot_trails(snapshot, self.max_bodies):
+            trail = trail[min_max_indices(trail, max(1, self.points // 4))]
+            normalized_color = normalize_color(snapshot["colors"][body])
+            axis.plot(trail[:, 0], trail[:, 1], color=normalized_color, label=snapshot["names"][body])
+            axis.scatter(trail[-1, 0], trail[-1, 1], color=normalized_color, marker="o", s=50)  # Current position
+
+        axis.set_xlabel("X Position (m)")
+        axis.set_ylabel("Y Position (m)")
+        axis.set_title("Orbital Trajectories")
+        self.legend(axis, snapshot)
+        axis.grid(True)
+        axis.axis("equal")
+
+    def plot_energy(self, figure, snapshot: dict):
+        """Plot the relative energy error and the drift of the momenta sampled by the DiagnosticsMonitor"""
+
+        history = snapshot["history"]
+        energy_axis, momentum_axis = figure.subplots(2, 1, sharex=True)
+        time = history["time"]
+
+        kept = lttb_indices(time, history["energy_error"], self.points)
+        energy_axis.plot(time[kept], history["energy_error"][kept], color="tab:red")
+        energy_axis.set_ylabel("Relative Energy Error")
+        energy_axis.set_title("Conserved Quantities")
+        energy_axis.grid(True)
+
+        # Drifts relative to the first sample, scaled by the largest magnitude so they are comparable
+        momentum = np.hypot(*(history["momentum"] - history["momentum"][0]).T) / max(np.abs(history["momentum"]).max(), 1e-300)
+        angular = (history["angular_momentum"] - history["angular_momentum"][0]) / max(np.abs(history["angular_momentum"]).max(), 1e-300)
+        for values, label in ((momentum, "Linear Momentum"), (angular, "Angular Momentum")):
+            kept = lttb_indices(time, values, self.points)
+            momentum_axis.plot(time[kept], values[kept], label=label)
+        momentum_axis.set_xlabel("Time (s)")
+        momentum_axis.set_ylabel("Relative Drift")
+        momentum_axis.legend(loc="upper right")
+        momentum_axis.grid(True)
+        figure.tight_layout()
+
+    def relative_trails(self, snapshot: dict) -> list[tuple[int, ndarray, ndarray]]:
+        """The trails relative to the most massive body (the primary), which is left out"""
+
+        primary = int(np.argmax(snapshot["masses"]))
+        trails = snapshot_trails(snapshot, self.max_bodies + 1)
+        primary_trail = next((trail for body, _, trail in trails if body == primary), None)
+        relative = []
+        for body, times, trail in trails:
+            if body == primary:
+                continue
+            if primary_trail is not None:
+                common = min(len(trail), len(primary_trail))
+                times, trail = times[-common:], trail[-common:] - primary_trail[-common:]
+            relative.append((body, times, trail.astype(np.float64)))
+        return relative[:self.max_bodies]
+
+    def plot_distances(self, figure, snapshot: dict):
+        """Distance of every body to the most massive one over the trail samples"""
+
+        axis = figure.subplots()
+        for body, times, trail in self.relative_trails(snapshot):
+            distance = np.hypot(trail[:, 0], trail[:, 1])
+            kept = lttb_indices(times, distance, self.points)
+            axis.plot(times[kept], distance[kept], color=normalize_color(snapshot["colors"][body]), label=snapshot["names"][body])
+
+        axis.set_xlabel("Time (s)")
+        axis.set_ylabel(f"Distance to {snapshot['names'][int(np.argmax(snapshot['masses']))]} (m)")
+        axis.set_title("Distance vs Time")
+        self.legend(axis, snapshot)
+        axis.grid(True)
+
+    def plot_phase(self, figure, snapshot: dict):
+        """Phase plot: distance to the most massive body against the radial velocity (finite differences of the trails)"""
+
+        axis = figure.subplots()
+        for body, times, trail in self.relative_trails(snapshot):
+            if len(times) < 3:
+                continue
+            distance = np.hypot(trail[:, 0], trail[:, 1])
+            radial_velocity = np.gradient(distance, times)
+            phase = np.column_stack((distance, radial_velocity))
+            phase = phase[min_max_indices(phase, max(1, self.points // 4))]
+            axis.plot(phase[:, 0], phase[:, 1], color=normalize_color(snapshot["colors"][body]), label=snapshot["names"][body])
+
+        axis.set_xlabel("Distance (m)")
+        axis.set_ylabel("Radial Velocity (m/s)")
+        axis.set_title("Phase Plot")
+        self.legend(axis, snapshot)
+        axis.grid(True)
+
+    def legend(self, axis, snapshot: dict):
+        if len(snapshot["names"]) <= 20: # A legend of hundreds of bodies hides the chart
+            axis.legend(loc="upper right")
+
+def pyplot():
+    """Import matplotlib.pyplot on the first chart, it takes longer to import than the rest of the program"""
+
+    import matplotlib.pyplot as plt
+    return plt
+
+def render_chart(kind: str, snapshot: dict, path: Optional[str] = None) -> Optional[str]:
+    """Draw a chart of a snapshot (runs in the chart worker process)
+
+    Args:
+        kind (str): The chart type (see CHART_TYPES)
+        snapshot (dict): The arrays copied from the simulation
+        path (Optional[str], optional): The .png/.svg file, None opens a window (until it is closed). Defaults to None.
+
+    Returns:
+        Optional[str]: The written file
+    """
+
+    if path is not None:
+        from matplotlib.figure import Figure # Without pyplot there is no GUI backend and no global state
+        figure = Figure(figsize=(8, 8))
+    else:
+        figure = pyplot().figure(figsize=(8, 8))
+    visualization = Visualization()
+    {"trajectory": visualization.plot_orbital_trajectories, "energy": visualization.plot_energy,
+     "distance": visualization.plot_distances, "phase": visualization.plot_phase}[kind](figure, snapshot)
+    if path is None:
+        pyplot().show()
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    figure.savefig(path)
+    return path
+
+class ChartRenderer:
+    """Renders the charts in worker processes, so the simulation and the window keep running while matplotlib draws.
+
+    The workers are started (spawned, they never inherit pygame or the simulation thread) on the first chart and
+    reused. poll() reports the charts that finished.
+    """
+
+    def __init__(self, directory: str = CHART_DIR, workers: int = CHART_WORKERS):
+        """Initialize the renderer
+
+        Args:
+            directory (str, optional): Directory of the chart files. Defaults to CHART_DIR.
+            workers (int, optional): Number of worker processes (a chart window keeps one busy). Defaults to CHART_WORKERS.
+        """
+
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.executor: Optional[ProcessPoolExecutor] = None
+        self.pending: list[tuple[str, Future]] = []
+        self.charts = 0
+
+    def submit(self, kind: str, snapshot: dict, output: str = "png") -> Optional[str]:
+        """Queue a chart
+
+        Args:
+            kind (str): The chart type (see CHART_TYPES)
+            snapshot (dict): The arrays copied from the simulation
+            output (str, optional): png, svg or window. Defaults to "png".
+
+        Returns:
+            Optional[str]: The file that will be written (None for a window)
+        """
+
+        if kind not in CHART_TYPES:
+            raise Exception(f"Sorry, the chart '{kind}' not exist")
+        if output not in CHART_OUTPUTS:
+            raise ValueError(f"Chart output must be {', '.join(CHART_OUTPUTS)}.")
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        self.charts += 1
+        path = None if output == "window" else \
+            os.path.join(self.directory, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{self.charts}.{output}")
+        self.pending.append((kind, self.executor.submit(render_chart, kind, snapshot, path)))
+        return path
+
+    def poll(self) -> list[tuple[str, Optional[str], Optional[BaseException]]]:
+        """Return the (kind, file, error) of the charts that finished since the last call"""
+
+        finished = [(kind, future) for kind, future in self.pending if future.done()]
+        self.pending = [(kind, future) for kind, future in self.pending if not future.done()]
+        return [(kind, None, future.exception()) if future.exception() is not None else (kind, future.result(), None)
+                for kind, future in finished]
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
 
 def normalize_color(color):
     return tuple(c / 255 for c in color)
-
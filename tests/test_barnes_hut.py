@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from core.barnes_hut import barnes_hut_accelerations, barnes_hut_potential_energy, theta_accuracy_report
+from core.compiled import compiled_kernels
+from core.gravity import pairwise_accelerations, potential_energy
+
+def random_bodies(count: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(size=(count, 2)) * 1e11, rng.uniform(1e20, 1e30, count)
+
+def test_theta_zero_is_the_direct_sum():
+    positions, masses = random_bodies(700)
+    reference = pairwise_accelerations(positions, masses, 1e3)
+    np.testing.assert_allclose(barnes_hut_accelerations(positions, masses, 0.0, 1e3), reference, rtol=0,
+                               atol=1e-10 * np.abs(reference).max())
+    np.testing.assert_allclose(barnes_hut_potential_energy(positions, masses, 0.0), potential_energy(positions, masses), rtol=1e-10)
+
+def test_error_shrinks_with_theta():
+    positions, masses = random_bodies(1500, 1)
+    report = theta_accuracy_report(positions, masses, (0.2, 0.5, 1.0))
+    errors = [entry["p99_error"] for entry in report]
+    assert errors == sorted(errors) and errors[1] < 1e-3
+
+@pytest.mark.skipif(compiled_kernels() is None, reason="Numba is not installed")
+def test_compiled_walk_matches_the_numpy_walk():
+    positions, masses = random_bodies(3000, 2)
+    for theta in (0.0, 0.5, 1.0):
+        reference = barnes_hut_accelerations(positions, masses, theta)
+        np.testing.assert_allclose(barnes_hut_accelerations(positions, masses, theta, backend="numba"), reference, rtol=0,
+                                   atol=1e-10 * np.abs(reference).max())
+    np.testing.assert_allclose(barnes_hut_potential_energy(positions, masses, 0.5, backend="numba"),
+                               barnes_hut_potential_energy(positions, masses, 0.5), rtol=1e-10)
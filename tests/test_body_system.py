@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from core.body_system import BodySystem
+from core.gravity import pairwise_accelerations
+from core.simulation import Simulation
+
+def check_invariants(system: BodySystem, expected: dict):
+    """expected maps every name to its (mass, x, test_particle)"""
+
+    assert len(system.names) == len(system.colors) == len(system.bodies) == system.trails.rows == len(system)
+    assert set(system.names) == set(expected)
+    for index, body in enumerate(system.bodies):
+        mass, x, test_particle = expected[system.names[index]]
+        assert body.index == index and body.system is system
+        assert body.test_particle == test_particle == (index >= system.massive)
+        assert system.masses[index] == (0.0 if test_particle else mass)
+        assert system.positions[index, 0] == x
+
+def test_massive_bodies_stay_before_the_test_particles():
+    rng = np.random.default_rng(1)
+    system = BodySystem(2)
+    expected = {}
+    created = 0
+    for _ in range(400):
+        operation = rng.integers(4)
+        if operation == 0:
+            name, x, test_particle = f"b{created}", float(rng.normal()), bool(rng.integers(2))
+            created += 1
+            expected[name] = (5.0, x, test_particle)
+            system.add(name, 5.0, [x, 0.0], [0.0, 0.0], test_particle=test_particle)
+        elif operation == 1:
+            amount, test_particles = int(rng.integers(1, 4)), bool(rng.integers(2))
+            xs = rng.normal(size=amount)
+            names = [f"b{created + i}" for i in range(amount)]
+            created += amount
+            expected.update((name, (7.0, float(x), test_particles)) for name, x in zip(names, xs))
+            system.add_arrays(np.column_stack((xs, np.zeros(amount))), np.zeros((amount, 2)), np.full(amount, 7.0), names,
+                              test_particles=test_particles)
+        elif len(system):
+            index = int(rng.integers(len(system)))
+            del expected[system.names[index]]
+            system.remove(index)
+        check_invariants(system, expected)
+
+        # The trail of every row follows its body through the moves
+        system.positions[:, 1] = rng.normal(size=len(system))
+        system.record_trails()
+        for index in range(len(system)):
+            np.testing.assert_array_equal(system.trails.trail(index)[-1], system.positions[index].astype(np.float32))
+
+def test_removing_a_view_detaches_it():
+    system = BodySystem()
+    body = system.add("a", 1.0, [0.0, 0.0], [0.0, 0.0])
+    particle = system.add("p", 1.0, [1.0, 0.0], [0.0, 0.0], test_particle=True)
+    system.remove(body)
+    assert body.system is None
+    assert particle.index == 0 and system.massive == 0 and system.test_particles == 1
+    with pytest.raises(IndexError):
+        system.remove(3)
+
+@pytest.mark.parametrize("force_solver", ["direct", "barnes_hut"])
+def test_test_particles_feel_only_the_massive_bodies(force_solver):
+    rng = np.random.default_rng(2)
+    system = BodySystem()
+    system.add_arrays(rng.normal(size=(5, 2)) * 1e11, np.zeros((5, 2)), rng.uniform(1e29, 1e30, 5))
+    system.add_arrays(rng.normal(size=(50, 2)) * 1e11, np.zeros((50, 2)), np.ones(50), test_particles=True)
+    simulation = Simulation(system, force_solver=force_solver, theta=0.0, backend="numpy")
+
+    _, accelerations = simulation.f(0.0, system.positions, system.velocities)
+    # The particles are massless, so the direct sum over every row gives the same field
+    np.testing.assert_allclose(accelerations, pairwise_accelerations(system.positions, system.masses), rtol=1e-12)
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from config import CHECKPOINT_VERSION
+from core.simulation import Simulation
+from utils.generators import asteroid_belt
+
+DELTA_T = 86400.0
+
+def step(simulation: Simulation, steps: int):
+    for _ in range(steps):
+        simulation.run()
+        simulation.system.record_trails()
+
+def belt(test_particles: bool):
+    system = asteroid_belt(40, seed=3, test_particles=test_particles)
+    system.trails.resize(8) # Wraps around before the checkpoint, older samples are still shown after it
+    return system
+
+@pytest.mark.parametrize("method", ["RK4", "Leapfrog", "Yoshida4", "DOPRI5", "Block"])
+@pytest.mark.parametrize("test_particles", [False, True])
+def test_resume_matches_uninterrupted_run(tmp_path, method, test_particles):
+    path = str(tmp_path / "run.npz")
+    interrupted = Simulation(belt(test_particles), DELTA_T, method, backend="numpy", collisions=True)
+    step(interrupted, 7)
+    interrupted.save_checkpoint(path)
+    resumed = Simulation.load_checkpoint(path)
+    step(resumed, 5)
+
+    fresh = Simulation(belt(test_particles), DELTA_T, method, backend="numpy", collisions=True)
+    step(fresh, 12)
+
+    assert resumed.time == fresh.time and resumed.steps == fresh.steps
+    assert resumed.system.massive == fresh.system.massive
+    assert resumed.system.names == fresh.system.names
+    np.testing.assert_array_equal(resumed.system.positions, fresh.system.positions)
+    np.testing.assert_array_equal(resumed.system.velocities, fresh.system.velocities)
+    np.testing.assert_array_equal(resumed.system.trails.counts[:len(fresh.system)], fresh.system.trails.counts[:len(fresh.system)])
+    np.testing.assert_array_equal(resumed.system.trails.window(), fresh.system.trails.window())
+
+def test_checkpoint_keeps_the_settings(tmp_path):
+    path = str(tmp_path / "run.npz")
+    simulation = Simulation(belt(True), 3600.0, "Leapfrog", softening=1e3, force_solver="barnes_hut", theta=0.7,
+                            backend="numpy", collisions=True)
+    step(simulation, 2)
+    simulation.save_checkpoint(path)
+    restored = Simulation.load_checkpoint(path)
+
+    assert (restored.delta_t, restored.method, restored.softening) == (3600.0, "Leapfrog", 1e3)
+    assert (restored.force_solver, restored.theta, restored.backend, restored.collisions) == ("barnes_hut", 0.7, "numpy", True)
+    assert restored.system.test_particles == simulation.system.test_particles
+    np.testing.assert_array_equal(restored.system.masses, simulation.system.masses)
+    np.testing.assert_array_equal(restored.system.radii, simulation.system.radii)
+    assert restored.system.colors == simulation.system.colors
+
+def test_previous_version_loads_without_test_particles(tmp_path):
+    path = str(tmp_path / "run.npz")
+    simulation = Simulation(belt(False), DELTA_T, "RK4", backend="numpy")
+    step(simulation, 3)
+    simulation.save_checkpoint(path)
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if name != "massive"}
+    arrays["version"] = np.array(CHECKPOINT_VERSION - 1)
+    np.savez(path, **arrays)
+
+    restored = Simulation.load_checkpoint(path)
+    assert restored.system.massive == len(restored.system) == len(simulation.system)
+    np.testing.assert_array_equal(restored.system.positions, simulation.system.positions)
+
+    arrays["version"] = np.array(CHECKPOINT_VERSION - 2)
+    np.savez(path, **arrays)
+    with pytest.raises(Exception, match="version not supported"):
+        Simulation.load_checkpoint(path)
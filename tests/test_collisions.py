@@ -0,0 +1,66 @@
+import numpy as np
+
+from core.body_system import BodySystem
+from core.collisions import candidate_pairs, find_collisions, merge_collisions
+
+def totals(system: BodySystem):
+    masses = system.masses
+    return masses.sum(), masses @ system.velocities, masses @ system.positions
+
+def random_system(count: int, seed: int) -> BodySystem:
+    rng = np.random.default_rng(seed)
+    system = BodySystem(count)
+    system.add_arrays(rng.uniform(0, 1e9, (count, 2)), rng.normal(0, 1e3, (count, 2)), rng.uniform(1e22, 1e25, count),
+                      radii=rng.uniform(1e6, 4e7, count))
+    return system
+
+def test_broad_phase_finds_every_touching_pair():
+    system = random_system(300, 1)
+    positions, radii = system.positions, system.radii
+    distance = np.linalg.norm(positions[:, np.newaxis] - positions[np.newaxis], axis=2)
+    first, second = np.nonzero(np.triu(distance <= radii[:, np.newaxis] + radii[np.newaxis], 1))
+    found = find_collisions(positions, radii)
+    assert {frozenset(pair) for pair in zip(*found)} == {frozenset(pair) for pair in zip(first, second)}
+    assert len(candidate_pairs(positions, radii)[0]) < 300 * 299 // 2
+
+def test_merge_conserves_mass_momentum_and_center_of_mass():
+    for seed in range(5):
+        system = random_system(300, seed)
+        mass, momentum, moment = totals(system)
+        volume = (system.radii ** 3).sum()
+        removed = merge_collisions(system)
+
+        assert removed > 0 and len(system) == 300 - removed
+        new_mass, new_momentum, new_moment = totals(system)
+        np.testing.assert_allclose(new_mass, mass, rtol=1e-12)
+        np.testing.assert_allclose(new_momentum, momentum, rtol=1e-12)
+        np.testing.assert_allclose(new_moment, moment, rtol=1e-12)
+        np.testing.assert_allclose((system.radii ** 3).sum(), volume, rtol=1e-12)
+
+def test_chain_merges_into_the_most_massive_body():
+    system = BodySystem()
+    system.add("a", 1.0, [0.0, 0.0], [3.0, 0.0], radius=1.0)
+    system.add("b", 5.0, [1.5, 0.0], [0.0, 0.0], radius=1.0)
+    system.add("c", 2.0, [3.0, 0.0], [0.0, 1.0], radius=1.0)
+    system.add("far", 1.0, [50.0, 0.0], [0.0, 0.0], radius=1.0)
+
+    assert merge_collisions(system) == 2
+    assert sorted(system.names) == ["b", "far"]
+    body = system.bodies[system.names.index("b")]
+    assert body.mass == 8.0
+    np.testing.assert_allclose(body.velocity, [3.0 / 8.0, 2.0 / 8.0])
+    np.testing.assert_allclose(body.position, [(1.5 * 5.0 + 3.0 * 2.0) / 8.0, 0.0])
+    np.testing.assert_allclose(body.radius, np.cbrt(3.0))
+
+def test_test_particles_are_absorbed_but_do_not_merge_together():
+    system = BodySystem()
+    system.add("star", 10.0, [0.0, 0.0], [1.0, 0.0], radius=2.0)
+    system.add_arrays(np.array([[1.0, 0.0], [20.0, 0.0], [20.5, 0.0]]), np.ones((3, 2)), np.zeros(3),
+                      ["hit", "p1", "p2"], radii=np.full(3, 1.0), test_particles=True)
+
+    assert merge_collisions(system) == 1
+    assert system.names == ["star", "p1", "p2"] or system.names == ["star", "p2", "p1"]
+    assert (system.massive, system.test_particles) == (1, 2)
+    star = system.bodies[0]
+    assert star.mass == 10.0
+    np.testing.assert_array_equal(star.velocity, [1.0, 0.0])
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from config import G
+from core.body_system import BodySystem
+from core.gravity import total_energy
+from core.simulation import Simulation
+
+SUN_MASS, EARTH_MASS, ORBIT = 1.989e30, 5.972e24, 1.496e11
+YEAR = 2 * np.pi * np.sqrt(ORBIT ** 3 / (G * (SUN_MASS + EARTH_MASS)))
+
+def circular_orbit() -> BodySystem:
+    system = BodySystem()
+    speed = np.sqrt(G * (SUN_MASS + EARTH_MASS) / ORBIT)
+    system.add("Sun", SUN_MASS, [0.0, 0.0], [0.0, -speed * EARTH_MASS / (SUN_MASS + EARTH_MASS)])
+    system.add("Earth", EARTH_MASS, [ORBIT, 0.0], [0.0, speed * SUN_MASS / (SUN_MASS + EARTH_MASS)])
+    return system
+
+def energy(system: BodySystem) -> float:
+    return total_energy(system.positions, system.velocities, system.masses)
+
+@pytest.mark.parametrize("method, tolerance", [("RK4", 1e-9), ("Leapfrog", 1e-3), ("Verlet", 1e-3), ("Yoshida4", 1e-7),
+                                               ("DOPRI5", 1e-6), ("Block", 1e-5)])
+def test_one_orbit_returns_to_the_start(method, tolerance):
+    system = circular_orbit()
+    start, initial_energy = system.positions.copy(), energy(system)
+    steps = 365
+    simulation = Simulation(system, YEAR / steps, method, backend="numpy")
+    for _ in range(steps):
+        simulation.run()
+
+    assert abs(simulation.time - YEAR) < 1e-6 * YEAR
+    assert abs((energy(system) - initial_energy) / initial_energy) < tolerance
+    assert np.linalg.norm(system.positions[1] - start[1]) < 100 * tolerance * ORBIT
+
+def test_leapfrog_energy_error_stays_bounded():
+    system = circular_orbit()
+    system.velocities[1] *= 1.2 # Eccentric orbit
+    initial_energy = energy(system)
+    simulation = Simulation(system, YEAR / 100, "Leapfrog", backend="numpy")
+    errors = []
+    for _ in range(20):
+        for _ in range(100):
+            simulation.run()
+        errors.append(abs((energy(system) - initial_energy) / initial_energy))
+    # Symplectic: the error oscillates instead of growing with the number of orbits
+    assert max(errors[10:]) < 2 * max(errors[:10])
@@ -0,0 +1,40 @@
+import numpy as np
+
+from core.trails import TrailBuffer
+
+def test_ring_buffer_keeps_the_newest_samples_in_order():
+    trails = TrailBuffer(rows=2, limit=5)
+    trails.add_rows(2)
+    for sample in range(12):
+        trails.record(np.array([[sample, 0.0], [0.0, -sample]]))
+
+    np.testing.assert_array_equal(trails.trail(0)[:, 0], np.arange(7, 12))
+    np.testing.assert_array_equal(trails.trail(1)[:, 1], -np.arange(7, 12))
+    np.testing.assert_array_equal(trails.window(), np.stack((trails.trail(0), trails.trail(1))))
+    assert trails.samples == 12 and trails.valid_mask().all()
+
+def test_new_rows_and_stride():
+    trails = TrailBuffer(rows=1, limit=4, stride=3)
+    trails.add_rows(1)
+    for sample in range(7): # Calls 0, 3 and 6 are stored
+        trails.record(np.array([[sample, 0.0]]))
+        if sample == 4:
+            trails.add_rows(1)
+
+    np.testing.assert_array_equal(trails.trail(0)[:, 0], [0, 3, 6])
+    assert len(trails.trail(1)) == 1
+    np.testing.assert_array_equal(trails.valid_mask()[1], [False, False, False, True])
+
+def test_resize_keeps_the_newest_samples():
+    trails = TrailBuffer(rows=1, limit=6)
+    trails.add_rows(1)
+    for sample in range(9):
+        trails.record(np.array([[sample, 0.0]]))
+    version = trails.version
+
+    trails.resize(3)
+    np.testing.assert_array_equal(trails.trail(0)[:, 0], [6, 7, 8])
+    trails.resize(5)
+    trails.record(np.array([[9.0, 0.0]]))
+    np.testing.assert_array_equal(trails.trail(0)[:, 0], [6, 7, 8, 9])
+    assert trails.version > version